@@ -1,24 +1,68 @@
+import functools
+import re
 import requests
 import json
 import QualityCode
+import parsing
+import ratelimit
+import singleflight
+import transport
+import cache as response_cache
+
+_status_code_pattern = re.compile(rb'"statuscode"\s*:\s*(\d+)')
 
 class Geocoder:
     """An object for searching for companies using MapQuests's custom search engine API
 
+    search and reverse store their result on the object, so an object used through them belongs to one thread. geocode,
+    reverse_geocode, search_many and reverse_many store nothing, so one object can serve any number of threads.
+
     Attributes:
         result (obj): Address result from search method
         address (str): The last address searched for
     """
-    def __init__(self, api_key):
+    search_api_url = 'http://www.mapquestapi.com/geocoding/v1/address'
+    batch_api_url = 'http://www.mapquestapi.com/geocoding/v1/batch'
+    reverse_api_url = 'http://www.mapquestapi.com/geocoding/v1/reverse'
+
+    def __init__(self, api_key, cache=None, lazy=False, keep_response=True, rate_limiter=None, max_retries=3,
+                 local_index=None, spatial_index=None, events=None, single_flight=None, session=None,
+                 archive=None):
         """The constructor for the company searcher
 
         Args:
             api_key (str): The secret key for accessing the api
-            api_app_key (str): The id for the custom search engine
+            cache (obj): A cache such as cache.SQLiteCache that is checked before any request is sent
+            lazy (bool): Defer parsing each response until a field of its result is first read
+            keep_response (bool): Keep the whole parsed response on each result. When False, results only keep the
+                location they describe
+            rate_limiter (obj): A ratelimit.RateLimiter. Requests are counted against the mapquest key
+            max_retries (int): The number of times a throttled or failed request is retried with backoff
+            local_index (obj): A localindex.LocalIndex that answers searches for confidently resolved addresses without
+                a request, and that every new confident result is added to
+            spatial_index (obj): A spatial.SpatialIndex that answers reverse searches for coordinates close to an
+                already geocoded address without a request, and that every new result is added to
+            events (obj): An instrumentation.EventEmitter that requests, cache lookups and parsing are reported to.
+                Defaults to instrumentation.events
+            single_flight (obj): A singleflight.SingleFlight through which concurrent identical requests share one
+                request. Pass the same one to several provider objects to share requests between them. Each object
+                makes its own when None
+            session (requests.Session): The session to send requests with, such as concurrency.shared_session() to
+                share one connection pool between every provider object. A new session is made when None
+            archive (obj): An archive.Archive that every response fetched from the provider is appended to
         """
-        self._session = requests.session()
+        self._session = requests.session() if session is None else session
+        self._transport = transport.Transport(self._session, 'mapquest', rate_limiter, max_retries, events=events)
+        self._events = self._transport.events
+        self._flights = singleflight.SingleFlight() if single_flight is None else single_flight
         self._response = None
         self._api_key = api_key
+        self._cache = cache
+        self._lazy = lazy
+        self._keep_response = keep_response
+        self._local_index = local_index
+        self._spatial_index = spatial_index
+        self._archive = archive
         self.address = None
         self.result = None
 
@@ -30,33 +74,320 @@ class Geocoder:
 
         Raises:
             Exception: If an invalid MapQuest key is provided or if MapQuest response contains an error message
+            ratelimit.RateLimitError: If MapQuest is still throttling the request after every retry
         """
         self.address = address
+        self._response, self.result = self._search(address)
+
+    def geocode(self, address, return_response=False):
+        """Searches for an address without storing anything on the object, so one object can be shared by many threads
+
+        Args:
+            address (str): The full address
+            return_response (bool): Also return the raw response. It is None for a result from the local index and a
+                cache.CachedResponse for a result from the cache
+
+        Returns:
+            AddressResult: The result, or a tuple of the result and the raw response when return_response is True
+        """
+        response, result = self._search(address)
+        return (result, response) if return_response else result
+
+    def search_many(self, addresses, batch_size=100):
+        """Geocodes many addresses using MapQuest's batch endpoint
+
+        Addresses are sent in chunks of up to batch_size locations per request, and an address repeated within a chunk
+        is only sent once. Results are yielded in the same order as the input. A failed batch or an address without a
+        match does not stop the search, instead the AddressResult for that address has its error attribute set.
+
+        Args:
+            addresses (iterable): The full addresses to search for
+            batch_size (int): The number of addresses to send per request. MapQuest allows at most 100.
+
+        Yields:
+            AddressResult: The result for each address, in input order
+
+        Raises:
+            Exception: If an invalid MapQuest key is provided
+        """
+        batch = []
+        for address in addresses:
+            batch.append(address)
+            if len(batch) == batch_size:
+                yield from self._search_batch(batch)
+                batch = []
+        if batch:
+            yield from self._search_batch(batch)
+
+    def _search(self, address):
+        """Searches for an address without storing anything on the object
+
+        Returns:
+            tuple: The raw response and the AddressResult
+        """
+        found = self._lookup(address)
+        if found is not None:
+            return found
+        # Threads searching for the same address at the same time share one request
+        return self._flights.do(response_cache.geocode_key('mapquest', address), self._fetch, address)
+
+    def _fetch(self, address):
+        """Requests an address from the provider and stores the result
 
+        Returns:
+            tuple: The raw response and the AddressResult
+        """
         # Conduct search
-        # search_api_url = 'http://open.mapquestapi.com/geocoding/v1/address'
-        search_api_url = 'http://www.mapquestapi.com/geocoding/v1/address'
-        params = {'key': self._api_key, 'location': self.address}
-        self._response = self._session.get(search_api_url, params=params)
+        params = {'key': self._api_key, 'location': address}
+        response = self._transport.get(self.search_api_url, params=params)
+        result = self._parse(response.content)
+        self._store(address, response.text, result)
+        return response, result
+
+    def _lookup(self, address):
+        """Looks an address up in the local index and then the cache
+
+        Returns:
+            tuple: The raw response, or None if the result came from the local index, and the AddressResult. None if
+                the address was not found
+        """
+        if self._local_index is not None:
+            indexed = self._local_index.lookup('mapquest', address)
+            if indexed is not None:
+                return None, indexed
+
+        if self._cache is not None:
+            cached = self._cached(address)
+            if cached is not None:
+                return response_cache.CachedResponse(cached[0]), cached[1]
+        return None
+
+    def _cached(self, address):
+        """Returns the cached response for an address and the AddressResult parsed from it, or None if it is not cached.
+        A cached response that cannot be parsed is dropped from the cache and counted as a miss"""
+        key = response_cache.geocode_key('mapquest', address)
+        cached = self._cache.get(key)
+        result = None
+        if cached is not None:
+            try:
+                result = self._parse(cached)
+            except Exception:
+                if hasattr(self._cache, 'delete'):
+                    self._cache.delete(key)
+        self._events.emit('cache', 'mapquest', hit=result is not None)
+        return None if result is None else (cached, result)
+
+    def _store(self, address, text, result):
+        """Adds a result fetched from the provider to the cache, archive, local index and spatial index"""
+        if self._cache is not None:
+            self._cache.set(response_cache.geocode_key('mapquest', address), text)
+        if self._archive is not None:
+            self._archive.append('mapquest', response_cache.geocode_key('mapquest', address), text)
+        if self._local_index is not None:
+            self._local_index.add('mapquest', address, result)
+        if self._spatial_index is not None:
+            self._spatial_index.add(result)
+
+    def reverse(self, latitude, longitude):
+        """Searches for the address at a coordinate
+
+        Args:
+            latitude (float): The latitude
+            longitude (float): The longitude
+
+        Raises:
+            Exception: If an invalid MapQuest key is provided or if MapQuest response contains an error message
+        """
+        self.address = '{0},{1}'.format(latitude, longitude)
+        self._response, self.result = self._reverse(latitude, longitude)
+
+    def reverse_geocode(self, latitude, longitude, return_response=False):
+        """Searches for the address at a coordinate without storing anything on the object
+
+        Returns:
+            AddressResult: The result, or a tuple of the result and the raw response when return_response is True. The
+                raw response is None for a result from the spatial index
+        """
+        response, result = self._reverse(latitude, longitude)
+        return (result, response) if return_response else result
 
-        if self._response.text == 'The AppKey submitted with this request is invalid.':
+    def reverse_many(self, latitudes, longitudes, batch_size=100):
+        """Searches for the address at each of many coordinates
+
+        Coordinates close enough to an address in the spatial index are answered from the index. The rest are sent to
+        MapQuest's batch endpoint, batch_size at a time.
+
+        Args:
+            latitudes (array-like): The latitudes
+            longitudes (array-like): The longitudes
+            batch_size (int): The number of coordinates to send per request. MapQuest allows at most 100.
+
+        Returns:
+            list: The AddressResult for each coordinate, in input order
+        """
+        latitudes, longitudes = list(latitudes), list(longitudes)
+        results = [None] * len(latitudes)
+        if self._spatial_index is not None and latitudes:
+            positions, _ = self._spatial_index.nearest_many(latitudes, longitudes)
+            for index, position in enumerate(positions):
+                if position >= 0:
+                    results[index] = self._spatial_index.results[position]
+
+        misses = [index for index, result in enumerate(results) if result is None]
+        for first in range(0, len(misses), batch_size):
+            chunk = misses[first:first + batch_size]
+            locations = [{'latLng': {'lat': latitudes[index], 'lng': longitudes[index]}} for index in chunk]
+            for index, result in zip(chunk, self._request_batch(locations)):
+                results[index] = result
+                if result.error is None and self._spatial_index is not None:
+                    self._spatial_index.add(result)
+        return results
+
+    def _reverse(self, latitude, longitude):
+        """Searches for the address at a coordinate without storing anything on the object
+
+        Returns:
+            tuple: The raw response, or None if the result came from the spatial index, and the AddressResult
+        """
+        if self._spatial_index is not None:
+            nearest = self._spatial_index.nearest(latitude, longitude)
+            if nearest is not None:
+                return None, nearest[0]
+
+        params = {'key': self._api_key, 'location': '{0},{1}'.format(latitude, longitude)}
+        response = self._transport.get(self.reverse_api_url, params=params)
+        result = self._parse(response.content)
+        if self._spatial_index is not None:
+            self._spatial_index.add(result)
+        return response, result
+
+    def _parse(self, raw):
+        """Parses the body of a geocode response into an AddressResult
+
+        In lazy mode only the status code at the start of the response is read, and the rest is parsed when the result
+        is first used.
+
+        Raises:
+            Exception: If an invalid MapQuest key is provided or if MapQuest response contains an error message
+        """
+        raw = raw.encode('utf-8') if isinstance(raw, str) else raw
+        if raw == b'The AppKey submitted with this request is invalid.':
             raise Exception('An invalid api key was provided for MapQuest')
 
+        if self._lazy:
+            status = _status_code_pattern.search(raw, 0, 512)
+            if status is not None and status.group(1) == b'0':
+                return AddressResult(parsing.LazyJSON(raw), keep_response=self._keep_response)
+
         # Parse results
-        results_data = json.loads(self._response.text)
+        results_data = self._events.timed('parse', 'mapquest', parsing.loads, raw)
         if results_data.get('info', {}).get('statuscode') != 0:
             raise Exception(results_data.get('info', {}).get('messages', 'There was an error with the MapQuest request'))
 
-        self.result = AddressResult(results_data)
+        return self._events.timed('build', 'mapquest', AddressResult, results_data, keep_response=self._keep_response)
+
+    def _search_batch(self, addresses):
+        """Returns an AddressResult for each address in the batch, sending one batch request for the addresses that
+        are not in the local index or the cache"""
+        unique, positions = singleflight.collapse(addresses, functools.partial(response_cache.geocode_key, 'mapquest'))
+        if len(unique) < len(addresses):
+            # Addresses repeated in the batch are only sent once
+            results = self._search_batch(unique)
+            return [results[position] for position in positions]
+        if self._cache is None and self._local_index is None and self._archive is None and self._spatial_index is None:
+            return self._request_batch(addresses)
+
+        results = [None] * len(addresses)
+        misses = []
+        for index, address in enumerate(addresses):
+            if self._local_index is not None:
+                results[index] = self._local_index.lookup('mapquest', address)
+            if results[index] is None and self._cache is not None:
+                cached = self._cached(address)
+                if cached is not None:
+                    results[index] = cached[1]
+            if results[index] is None:
+                misses.append(index)
+
+        if misses:
+            for index, result in zip(misses, self._request_batch([addresses[index] for index in misses])):
+                results[index] = result
+                if result.error is not None:
+                    continue
+                if self._local_index is not None:
+                    self._local_index.add('mapquest', addresses[index], result)
+                if self._spatial_index is not None:
+                    self._spatial_index.add(result)
+                if self._cache is not None or self._archive is not None:
+                    # Stored as the response a single search for the address would have returned
+                    location_data = {'info': {'statuscode': 0}, 'results': [{'locations': [result._location]}]}
+                    key = response_cache.geocode_key('mapquest', addresses[index])
+                    if self._cache is not None:
+                        self._cache.set(key, json.dumps(location_data))
+                    if self._archive is not None:
+                        self._archive.append('mapquest', key, json.dumps(location_data))
+        return results
+
+    def _request_batch(self, addresses):
+        """Sends one batch request and returns an AddressResult for each address in the batch"""
+        payload = {'locations': list(addresses), 'options': {'maxResults': 1}}
+        try:
+            response = self._transport.post(self.batch_api_url, params={'key': self._api_key}, json=payload)
+        except (requests.RequestException, ratelimit.RateLimitError) as e:
+            return [AddressResult({}, error=str(e)) for _ in addresses]
+
+        if response.text == 'The AppKey submitted with this request is invalid.':
+            raise Exception('An invalid api key was provided for MapQuest')
+
+        try:
+            results_data = self._events.timed('parse', 'mapquest', parsing.loads, response.content)
+        except ValueError:
+            return [AddressResult({}, error='MapQuest returned an invalid response') for _ in addresses]
+        info = results_data.get('info', {})
+        if info.get('statuscode') != 0:
+            error = str(info.get('messages') or 'There was an error with the MapQuest request')
+            return [AddressResult({}, error=error) for _ in addresses]
+
+        # MapQuest returns one result per provided location in the order they were sent
+        location_results = results_data.get('results', [])
+        results = []
+        for index in range(len(addresses)):
+            if index >= len(location_results):
+                results.append(AddressResult({}, error='MapQuest returned no result for this address'))
+                continue
+            address_data = {'info': info, 'results': [location_results[index]]}
+            if not location_results[index].get('locations'):
+                results.append(AddressResult(address_data, error='No locations were found for this address'))
+            else:
+                results.append(AddressResult(address_data, keep_response=self._keep_response))
+        return results
 
     def write_results(self, write_path):
         """Writes the json response of the geocode search to a text file
 
+        A result answered by the local index or the spatial index has no response, so a response holding only its
+        location is written instead.
+
         Args:
-            The path to write the file to
+            write_path (str): The path to write the file to. An archive.Archive can be given instead, which the
+                response is appended to under the cache key of the address
+
+        Raises:
+            ValueError: If nothing has been searched for yet
         """
+        text = self._response_text()
+        if hasattr(write_path, 'append'):
+            write_path.append('mapquest', response_cache.geocode_key('mapquest', self.address), text)
+            return
         with open(write_path + '.json', 'w') as f:
-            f.write(self._response.text)
+            f.write(text)
+
+    def _response_text(self):
+        if self._response is not None:
+            return self._response.text
+        if self.result is None:
+            raise ValueError('There is no response to write. Call search or reverse first')
+        return json.dumps({'info': {'statuscode': 0}, 'results': [{'locations': [self.result._location]}]})
 
 
 class AddressResult:
@@ -64,6 +395,7 @@ class AddressResult:
 
     Attributes:
         street_address (str): The street address. Example: 1 Main St
+        zip_code (str): The postal code
         neighborhood (str): The neighborhood of the address result
         city (str): The city
         county (str): The county
@@ -73,16 +405,40 @@ class AddressResult:
         longitude (str): The longitude of the address
         geocode_quality (str): The quality of the result found
         geocode_quality_code (str): The quality of the result found
+        quality_score (float): A score from 0 to 1 for how precise and certain the match is. See QualityCode
         side_of_street (str): which side of the street the result is on
+        error (str): The reason no location was found when the result came from a batch search, otherwise None
     """
-    def __init__(self, response):
+    def __init__(self, response, error=None, keep_response=True):
+        """The constructor for the address result
+
+        Args:
+            response (dict): The parsed response, or a parsing.LazyJSON holding the unparsed response
+            error (str): The reason no location was found
+            keep_response (bool): Keep the whole response. When False, only the location is kept once it is read
+        """
         self._response = response
-        self._location = response.get('results', [{}])[0].get('locations', [{}])[0]
+        self.error = error
+        self._keep_response = keep_response
+        if not keep_response and not isinstance(response, parsing.LazyJSON):
+            # Read the location now so the rest of the response can be released
+            self._location
+
+    @functools.cached_property
+    def _location(self):
+        locations = (self._response.get('results') or [{}])[0].get('locations') or [{}]
+        if not self._keep_response:
+            self._response = None
+        return locations[0]
 
     @property
     def street_address(self):
         return self._location.get('street')
 
+    @property
+    def zip_code(self):
+        return self._location.get('postalCode')
+
     @property
     def neighborhood(self):
         return self._location.get('adminArea6')
@@ -119,6 +475,12 @@ class AddressResult:
     def geocode_quality_code(self):
         return self._location.get('geocodeQualityCode')
 
+    @property
+    def quality_score(self):
+        if self.error is not None:
+            return 0.0
+        return self.geocode_quality.score
+
     @property
     def side_of_street(self):
         return self._location.get('sideOfStreet')
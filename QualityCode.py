@@ -3,13 +3,18 @@
 For the reference around geocode quality codes view https://developer.mapquest.com/documentation/geocoding-api/quality-codes/
 
 Attributes:
+    granularity_scores (dict):
+        A score from 0 to 1 for how precise each granularity is, used to compare results across providers.
     granularity_lookup (dict):
         Give a description for and long name for each granularity code. The granularity code is the first two characters
         of the geocode quality code
     confidence_lookup (dict):
         Give a confidence code to see the description and additional considerations. The confidence codes are contained
         in the last three characters of the geocoding quality code.
+    decode_table (dict):
+        The shared GeocodeQuality for every valid quality code, keyed by the code.
 """
+import enum
 
 granularity_lookup = {
     'P1': {
@@ -106,36 +111,148 @@ confidence_lookup = {
 }
 
 
+class Confidence(enum.IntEnum):
+    """The confidence levels of a geocode quality code as ordinals, so that higher values mean better matches"""
+    NONE = 0
+    APPROX = 1
+    GOOD = 2
+    EXACT = 3
+
+
+confidence_codes = {'A': Confidence.EXACT, 'B': Confidence.GOOD, 'C': Confidence.APPROX, 'X': Confidence.NONE}
+granularity_ranks = {code: rank for rank, code in enumerate(granularity_lookup)}
+
+
+granularity_scores = {
+    'P1': 1.0, 'L1': 1.0, 'I1': 0.9, 'B1': 0.8, 'B2': 0.7, 'B3': 0.8,
+    'Z4': 0.5, 'Z3': 0.6, 'Z2': 0.55, 'Z1': 0.45,
+    'A6': 0.45, 'A5': 0.4, 'A4': 0.3, 'A3': 0.2, 'A1': 0.1,
+}
+street_granularities = ('P1', 'L1', 'I1', 'B1', 'B2', 'B3')
+
+
+def describe(quality_code):
+    """Builds the multi-line description of a quality code shown by GeocodeQuality
+
+    Args:
+        quality_code (str): 5 character quality code from the MapQuest geocode request.
+
+    Returns:
+        str: The description
+    """
+    granularity = granularity_lookup.get(quality_code[0:2])
+    granularity = 'Granularity: ' + quality_code[0:2] + '\n' + \
+                  granularity['Name'] + '\n' + \
+                  granularity['Description']
+    street_confidence_code = quality_code[2]
+    street_confidence = 'Full Street Level Confidence: ' + street_confidence_code + '\n' + \
+                        confidence_lookup[street_confidence_code]['Description'] + '\n' + \
+                        confidence_lookup[street_confidence_code]['StreetCon']
+    admin_confidence_code = quality_code[3]
+    admin_confidence = 'Administrative Area Level Confidence: ' + admin_confidence_code + '\n' + \
+                       confidence_lookup[admin_confidence_code]['Description'] + '\n' + \
+                       confidence_lookup[admin_confidence_code]['AdminCon']
+    postal_confidence_code = quality_code[4]
+    postal_confidence = 'Postal Code Level Confidence: ' + postal_confidence_code + '\n' + \
+                        confidence_lookup[postal_confidence_code]['Description'] + '\n' + \
+                        confidence_lookup[postal_confidence_code]['PostalCon']
+    return granularity + '\n\n' + street_confidence + '\n\n' + admin_confidence + '\n\n' + postal_confidence
+
+
 class GeocodeQuality:
     """An object for translating and storing a MapQuest geocode quality code.
 
+    Every valid code is decoded once when the module is imported, and constructing a GeocodeQuality for a valid code
+    returns the shared instance for that code.
+
+    Attributes:
+        quality_code (str): The 5 character quality code
+        granularity (str): The granularity code. Example: P1
+        granularity_name (str): The name of the granularity. Example: POINT
+        granularity_rank (int): The position of the granularity in granularity_lookup, where 0 is the most precise
+        street_confidence (Confidence): The full street level confidence
+        admin_confidence (Confidence): The administrative area level confidence
+        postal_confidence (Confidence): The postal code level confidence
+        score (float): A score from 0 to 1 for how precise and certain the match is, for comparing against other
+            providers. It is the granularity's score from granularity_scores, reduced when the street confidence (for
+            street level granularities) or the administrative area confidence (for other granularities) is low. A
+            confidence of X, or one that is not valid, halves the score.
     """
+    _instances = {}
+
+    def __new__(cls, quality_code):
+        instance = cls._instances.get(quality_code)
+        if instance is None:
+            instance = super().__new__(cls)
+            instance._decode(quality_code)
+        return instance
+
     def __init__(self, quality_code):
         """The constructor for the geocode quality code
 
         Args:
             quality_code (str): 5 character quality code from the MapQuest geocode request.
         """
-        self._quality_code = quality_code
+
+    def _decode(self, quality_code):
+        self.quality_code = self._quality_code = quality_code
+        self.granularity = quality_code[0:2]
+        self.granularity_name = granularity_lookup.get(self.granularity, {}).get('Name')
+        self.granularity_rank = granularity_ranks.get(self.granularity, -1)
+        self.street_confidence = confidence_codes.get(quality_code[2:3])
+        self.admin_confidence = confidence_codes.get(quality_code[3:4])
+        self.postal_confidence = confidence_codes.get(quality_code[4:5])
+        confidence = self.street_confidence if self.granularity in street_granularities else self.admin_confidence
+        if confidence is None:
+            confidence = Confidence.NONE
+        self.score = granularity_scores.get(self.granularity, 0.0) * (0.5 + confidence / 6)
+        self._description = None
 
     def __str__(self):
-        granularity = granularity_lookup.get(self._quality_code[0:2])
-        granularity = 'Granularity: ' + self._quality_code[0:2] + '\n' + \
-                      granularity['Name'] + '\n' + \
-                      granularity['Description']
-        street_confidence_code = self._quality_code[2]
-        street_confidence = 'Full Street Level Confidence: ' + street_confidence_code + '\n' + \
-                            confidence_lookup[street_confidence_code]['Description'] + '\n' + \
-                            confidence_lookup[street_confidence_code]['StreetCon']
-        admin_confidence_code = self._quality_code[3]
-        admin_confidence = 'Administrative Area Level Confidence: ' + admin_confidence_code + '\n' + \
-                           confidence_lookup[admin_confidence_code]['Description'] + '\n' + \
-                           confidence_lookup[admin_confidence_code]['AdminCon']
-        postal_confidence_code = self._quality_code[4]
-        postal_confidence = 'Postal Code Level Confidence: ' + postal_confidence_code + '\n' + \
-                            confidence_lookup[postal_confidence_code]['Description'] + '\n' + \
-                            confidence_lookup[postal_confidence_code]['PostalCon']
-        return granularity + '\n\n' + street_confidence + '\n\n' + admin_confidence + '\n\n' + postal_confidence
+        if self._description is None:
+            self._description = describe(self._quality_code)
+        return self._description
+
+    def __repr__(self):
+        return 'GeocodeQuality({0!r})'.format(self._quality_code)
+
+
+def _build_decode_table():
+    """Creates and describes the shared GeocodeQuality for every valid quality code"""
+    for granularity in granularity_lookup:
+        for street in confidence_lookup:
+            for admin in confidence_lookup:
+                for postal in confidence_lookup:
+                    quality = GeocodeQuality(granularity + street + admin + postal)
+                    str(quality)
+                    GeocodeQuality._instances[quality.quality_code] = quality
+
+
+_build_decode_table()
+decode_table = GeocodeQuality._instances
+
+
+def decode_codes(quality_codes):
+    """Decodes an array of quality codes into integer columns for fast filtering
+
+    Each distinct code is only decoded once. Codes that are missing or not valid get -1 in every column.
+
+    Args:
+        quality_codes (array-like): Quality codes. Example: a pandas Series or a NumPy array of strings
+
+    Returns:
+        dict: int8 NumPy arrays named granularity_rank, street_confidence, admin_confidence and postal_confidence
+    """
+    import numpy
+    unique_codes, inverse = numpy.unique(numpy.asarray(quality_codes, dtype=str), return_inverse=True)
+    columns = ('granularity_rank', 'street_confidence', 'admin_confidence', 'postal_confidence')
+    unique_values = numpy.full((len(unique_codes), len(columns)), -1, dtype=numpy.int8)
+    for row, code in enumerate(unique_codes):
+        quality = decode_table.get(code)
+        if quality is not None:
+            unique_values[row] = [getattr(quality, column) for column in columns]
+    values = unique_values[inverse.reshape(-1)]
+    return {column: values[:, position] for position, column in enumerate(columns)}
 
 
 if __name__ == '__main__':
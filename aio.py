@@ -0,0 +1,516 @@
+"""Async versions of the provider classes for use on an asyncio event loop
+
+AsyncGeocoder, AsyncBingGeocoder and AsyncRouteRetriever send their requests with aiohttp, so thousands of lookups
+can be in flight on one event loop without a thread each. They return the same AddressResult and RouteResult objects as
+Geocoder.Geocoder, bing.Geocoder and bing.RouteRetriever, and use the same caches, local index, spatial index, rate
+limiter and instrumentation events. Each one keeps an instance of its blocking counterpart for parsing responses and
+for those lookups. That instance never sends a request, so it is made without a requests session. The cache and index
+lookups are quick local reads, so they are made on the event loop. Parsing a fetched response and storing it writes to
+SQLite, the local index and the archive, so that is done on the loop's default executor instead of blocking the loop.
+
+Every client can share one pooled aiohttp session, made with make_session, so connections are kept alive and reused
+across clients. A client given no session makes its own on first use and closes it in close. Each call takes a timeout
+that bounds the whole call including retries. Concurrent calls for the same address or route share one request, which
+is cancelled once every task awaiting it has been cancelled.
+
+aiohttp is only needed by this module:
+
+    pip install aiohttp
+"""
+import asyncio
+import functools
+import time
+import Geocoder
+import bing
+import cache as response_cache
+import concurrency
+import instrumentation
+import ratelimit
+import singleflight
+import transport
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+def make_session(limit=100, limit_per_host=0, keepalive_timeout=30.0, timeout=30.0):
+    """Creates an aiohttp session with a connection pool that keeps idle connections open for reuse
+
+    Must be called from a running event loop.
+
+    Args:
+        limit (int): The most connections open at once across every host
+        limit_per_host (int): The most connections open at once to one host. 0 means no limit beyond limit
+        keepalive_timeout (float): The number of seconds an idle connection is kept open
+        timeout (float): The number of seconds allowed for each request attempt
+
+    Returns:
+        aiohttp.ClientSession: The session
+    """
+    if aiohttp is None:
+        raise ImportError('The async clients need aiohttp. Install it with: pip install aiohttp')
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host, keepalive_timeout=keepalive_timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+class Response:
+    """The parts of an HTTP response the providers read, kept after the connection is returned to the pool
+
+    Attributes:
+        url (str): The url of the request
+        status_code (int): The HTTP status
+        headers (dict): The response headers
+        content (bytes): The body
+    """
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+
+class AsyncTransport:
+    """Sends requests for one provider with rate limiting and retries, like transport.Transport
+
+    Attributes:
+        session (aiohttp.ClientSession): The session requests are sent with. Made on first use when not given
+        key (str): The rate limiter key requests are counted against
+    """
+    def __init__(self, session, key, rate_limiter=None, max_retries=3, concurrency_limiter=None, events=None):
+        """The constructor for the async transport
+
+        Args:
+            session (aiohttp.ClientSession): The session to send requests with, or None to make one on first use
+            key (str): The rate limiter key requests are counted against. Example: bing
+            rate_limiter (obj): A ratelimit.RateLimiter shared by everything that uses the same quota
+            max_retries (int): The number of times a throttled or failed request is retried
+            concurrency_limiter (obj): A ratelimit.AdaptiveConcurrency to report the latency of each request to
+            events (obj): An instrumentation.EventEmitter. Defaults to instrumentation.events
+        """
+        if aiohttp is None:
+            raise ImportError('The async clients need aiohttp. Install it with: pip install aiohttp')
+        self.session = session
+        self.key = key
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.concurrency_limiter = concurrency_limiter
+        self.events = instrumentation.events if events is None else events
+        self._owns_session = session is None
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def request(self, method, url, **kwargs):
+        """Sends a request, retrying it while it is throttled or fails
+
+        Returns:
+            Response: The first response that was not throttled, or the last 5xx response
+
+        Raises:
+            ratelimit.RateLimitError: If the request is still throttled after every retry
+            aiohttp.ClientError: If the request could not be sent after every retry
+        """
+        if self.session is None:
+            self.session = make_session()
+        if kwargs.get('params'):
+            # aiohttp only sends str and int parameters
+            kwargs['params'] = {name: str(value) for name, value in kwargs['params'].items()}
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                delay = self.rate_limiter.reserve(self.key)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            start = time.monotonic()
+            try:
+                async with self.session.request(method, url, **kwargs) as raw:
+                    wait_seconds = time.monotonic() - start
+                    response = Response(str(raw.url), raw.status, raw.headers, await raw.read())
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                seconds = time.monotonic() - start
+                self._record(seconds, False)
+                if self.events.enabled:
+                    self.events.emit('request', self.key, method=method, url=url, status=None,
+                                     error=type(e).__name__, attempt=attempt, seconds=seconds)
+                if attempt == self.max_retries:
+                    raise
+                await self._retry(attempt, ratelimit.backoff_delay(attempt))
+                continue
+
+            seconds = time.monotonic() - start
+            throttled = transport.is_throttled(response)
+            self._record(seconds, not throttled and response.status_code not in transport.retry_statuses)
+            if self.events.enabled:
+                self.events.emit('request', self.key, method=method, url=url, status=response.status_code, error=None,
+                                 attempt=attempt, throttled=throttled, bytes=len(response.content), seconds=seconds,
+                                 wait_seconds=wait_seconds, download_seconds=seconds - wait_seconds)
+            if not throttled and response.status_code not in transport.retry_statuses:
+                return response
+            if attempt < self.max_retries:
+                await self._retry(attempt, transport.retry_after(response) or ratelimit.backoff_delay(attempt))
+
+        if throttled:
+            raise ratelimit.RateLimitError('The {0} request was throttled {1} times'.format(self.key, attempt + 1))
+        return response
+
+    def _record(self, latency, ok):
+        if self.concurrency_limiter is not None:
+            self.concurrency_limiter.record(latency, ok)
+
+    async def _retry(self, attempt, delay):
+        if self.events.enabled:
+            self.events.emit('retry', self.key, attempt=attempt, delay=delay)
+        await asyncio.sleep(delay)
+
+    async def close(self):
+        """Closes the session if this transport made it"""
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class _NoSession:
+    """Stands in for the requests session of the blocking provider an async client parses with, which sends nothing"""
+    def close(self):
+        pass
+
+
+_no_session = _NoSession()
+
+
+async def _call(coroutine, timeout):
+    if timeout is None:
+        return await coroutine
+    return await asyncio.wait_for(coroutine, timeout)
+
+
+async def _off_loop(function, *args):
+    """Runs a blocking function on the default executor of the running loop"""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args))
+
+
+async def run_concurrently(function, queries, max_in_flight=100, limiter=None):
+    """Awaits function for each query with at most max_in_flight running at once, yielding results as they complete
+
+    The async counterpart of concurrency.run_concurrently. Queries are read lazily from the input, and an exception
+    raised for one query is returned with that query instead of stopping the others.
+
+    Args:
+        function (callable): A coroutine function called with a single query
+        queries (dict or iterable): The queries to run. For a dict, the keys are used to tag the results
+        max_in_flight (int): The maximum number of queries running at once
+        limiter (obj): A ratelimit.AdaptiveConcurrency. When given, the number of queries running is kept to its
+            current limit, up to max_in_flight
+
+    Yields:
+        tuple: (key, result, error) where error is the exception raised for the query or None
+    """
+    items = iter(concurrency.keyed_items(queries))
+    in_flight = {}
+
+    def top_up():
+        limit = max_in_flight if limiter is None else max(1, min(max_in_flight, limiter.limit))
+        while len(in_flight) < limit:
+            for key, query in items:
+                in_flight[asyncio.ensure_future(function(query))] = key
+                break
+            else:
+                return
+
+    try:
+        top_up()
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                key = in_flight.pop(task)
+                error = task.exception()
+                yield key, None if error else task.result(), error
+            top_up()
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+
+class _AsyncClient:
+    """Closes the transport of an async client"""
+    async def close(self):
+        await self._transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class AsyncGeocoder(_AsyncClient):
+    """An async version of Geocoder.Geocoder for searching MapQuest
+
+    Unlike Geocoder.Geocoder, each call returns its result instead of storing it on the object, so one object can serve
+    many concurrent calls.
+    """
+    search_api_url = Geocoder.Geocoder.search_api_url
+    reverse_api_url = Geocoder.Geocoder.reverse_api_url
+
+    def __init__(self, api_key, session=None, cache=None, lazy=False, keep_response=True, rate_limiter=None,
+                 max_retries=3, local_index=None, spatial_index=None, events=None, timeout=None):
+        """The constructor for the async MapQuest geocoder
+
+        Args:
+            api_key (str): The secret key for accessing the api
+            session (aiohttp.ClientSession): A session shared with other clients, such as one from make_session. A
+                session is made on first use when None
+            timeout (float): The default number of seconds allowed for each call, including retries
+            The other arguments are as accepted by Geocoder.Geocoder
+        """
+        self._provider = Geocoder.Geocoder(api_key, cache, lazy, keep_response, rate_limiter, max_retries,
+                                           local_index, spatial_index, events, session=_no_session)
+        self._transport = AsyncTransport(session, 'mapquest', rate_limiter, max_retries, events=self._provider._events)
+        self.timeout = timeout
+        self._flights = singleflight.AsyncSingleFlight()
+
+    async def search(self, address, timeout=None):
+        """Searches for an address
+
+        Args:
+            address (str): The full address
+            timeout (float): The number of seconds allowed for the call. Defaults to the timeout of the object
+
+        Returns:
+            Geocoder.AddressResult: The result
+
+        Raises:
+            asyncio.TimeoutError: If the call took longer than the timeout
+        """
+        return await _call(self._search(address), self.timeout if timeout is None else timeout)
+
+    async def search_many(self, addresses, max_in_flight=100, timeout=None):
+        """Searches for many addresses concurrently, yielding each result as soon as it is returned
+
+        Yields:
+            tuple: (key, AddressResult, error) where error is the exception raised for the address or None
+        """
+        async for item in run_concurrently(lambda address: self.search(address, timeout), addresses, max_in_flight):
+            yield item
+
+    async def reverse(self, latitude, longitude, timeout=None):
+        """Searches for the address at a coordinate
+
+        Returns:
+            Geocoder.AddressResult: The result
+        """
+        return await _call(self._reverse(latitude, longitude), self.timeout if timeout is None else timeout)
+
+    async def _search(self, address):
+        found = self._provider._lookup(address)
+        if found is not None:
+            return found[1]
+        return await self._flights.do(response_cache.geocode_key('mapquest', address), self._fetch, address)
+
+    async def _fetch(self, address):
+        params = {'key': self._provider._api_key, 'location': address}
+        response = await self._transport.get(self.search_api_url, params=params)
+        return await _off_loop(self._parse_and_store, address, response)
+
+    def _parse_and_store(self, address, response):
+        result = self._provider._parse(response.content)
+        self._provider._store(address, response.text, result)
+        return result
+
+    async def _reverse(self, latitude, longitude):
+        spatial_index = self._provider._spatial_index
+        if spatial_index is not None:
+            nearest = spatial_index.nearest(latitude, longitude)
+            if nearest is not None:
+                return nearest[0]
+        params = {'key': self._provider._api_key, 'location': '{0},{1}'.format(latitude, longitude)}
+        response = await self._transport.get(self.reverse_api_url, params=params)
+        return await _off_loop(self._parse_reverse, response)
+
+    def _parse_reverse(self, response):
+        result = self._provider._parse(response.content)
+        if self._provider._spatial_index is not None:
+            self._provider._spatial_index.add(result)
+        return result
+
+
+class AsyncBingGeocoder(_AsyncClient):
+    """An async version of bing.Geocoder
+
+    Each call returns its result instead of storing it on the object, so one object can serve many concurrent calls.
+    """
+    search_api_url = bing.Geocoder.search_api_url
+    reverse_api_url = bing.Geocoder.reverse_api_url
+
+    def __init__(self, api_key, session=None, cache=None, lazy=False, keep_response=True, rate_limiter=None,
+                 max_retries=3, concurrency_limiter=None, local_index=None, spatial_index=None, events=None,
+                 timeout=None):
+        """The constructor for the async Bing geocoder
+
+        Args:
+            api_key (str): The secret key for accessing the api
+            session (aiohttp.ClientSession): A session shared with other clients, such as one from make_session. A
+                session is made on first use when None
+            timeout (float): The default number of seconds allowed for each call, including retries
+            The other arguments are as accepted by bing.Geocoder
+        """
+        self._provider = bing.Geocoder(api_key, 1, cache, lazy, keep_response, rate_limiter, max_retries,
+                                       concurrency_limiter, local_index, spatial_index, events, session=_no_session)
+        self._transport = AsyncTransport(session, 'bing', rate_limiter, max_retries, concurrency_limiter,
+                                         self._provider._events)
+        self.timeout = timeout
+        self._flights = singleflight.AsyncSingleFlight()
+
+    async def search(self, address, timeout=None):
+        """Searches for an address
+
+        Args:
+            address (str): The address to search for
+            timeout (float): The number of seconds allowed for the call. Defaults to the timeout of the object
+
+        Returns:
+            bing.AddressResult: The result
+
+        Raises:
+            asyncio.TimeoutError: If the call took longer than the timeout
+        """
+        return await _call(self._search(address), self.timeout if timeout is None else timeout)
+
+    async def search_many(self, addresses, max_in_flight=100, timeout=None):
+        """Searches for many addresses concurrently, yielding each result as soon as it is returned
+
+        Yields:
+            tuple: (key, AddressResult, error) where error is the exception raised for the address or None
+        """
+        async for item in run_concurrently(lambda address: self.search(address, timeout), addresses, max_in_flight,
+                                           self._transport.concurrency_limiter):
+            yield item
+
+    async def reverse(self, latitude, longitude, timeout=None):
+        """Searches for the address at a coordinate
+
+        Returns:
+            bing.AddressResult: The result
+        """
+        return await _call(self._reverse(latitude, longitude), self.timeout if timeout is None else timeout)
+
+    async def _search(self, address):
+        found = self._provider._lookup(address)
+        if found is not None:
+            return found[1]
+        return await self._flights.do(response_cache.geocode_key('bing', address), self._fetch, address)
+
+    async def _fetch(self, address):
+        params = {'key': self._provider._api_key, 'q': address}
+        response = await self._transport.get(self.search_api_url, params=params)
+        return await _off_loop(self._parse_and_store, address, response)
+
+    def _parse_and_store(self, address, response):
+        result = self._provider._parse(response.content, response.status_code)
+        self._provider._store(address, response.text, result)
+        return result
+
+    async def _reverse(self, latitude, longitude):
+        spatial_index = self._provider._spatial_index
+        if spatial_index is not None:
+            nearest = spatial_index.nearest(latitude, longitude)
+            if nearest is not None:
+                return nearest[0]
+        response = await self._transport.get(self.reverse_api_url.format(latitude=latitude, longitude=longitude),
+                                             params={'key': self._provider._api_key})
+        return await _off_loop(self._parse_reverse, response)
+
+    def _parse_reverse(self, response):
+        result = self._provider._parse(response.content, response.status_code)
+        if self._provider._spatial_index is not None:
+            self._provider._spatial_index.add(result)
+        return result
+
+
+class AsyncRouteRetriever(_AsyncClient):
+    """An async version of bing.RouteRetriever
+
+    Each call returns its route instead of storing it on the object, so one object can serve many concurrent calls.
+    """
+    route_api_url = bing.RouteRetriever.route_api_url
+
+    def __init__(self, api_key, session=None, cache=None, cache_ttls=None, lazy=False, keep_response=True,
+                 rate_limiter=None, max_retries=3, concurrency_limiter=None, events=None, timeout=None):
+        """The constructor for the async route retriever
+
+        Args:
+            api_key (str): The secret key for accessing the api
+            session (aiohttp.ClientSession): A session shared with other clients, such as one from make_session. A
+                session is made on first use when None
+            timeout (float): The default number of seconds allowed for each call, including retries
+            The other arguments are as accepted by bing.RouteRetriever
+        """
+        self._provider = bing.RouteRetriever(api_key, 1, cache, cache_ttls, lazy, keep_response, rate_limiter,
+                                              max_retries, concurrency_limiter, events, session=_no_session)
+        self._transport = AsyncTransport(session, 'bing', rate_limiter, max_retries, concurrency_limiter,
+                                         self._provider._events)
+        self.timeout = timeout
+        self._flights = singleflight.AsyncSingleFlight()
+
+    async def calculate_route(self, start_location, end_location, travelMode, timeout=None, **kwargs):
+        """Finds the route between two addresses
+
+        Args:
+            start_location (str): The address of the location to start at
+            end_location (str): The address of the location to end at
+            travelMode (str): The mode of travel. Can be Driving, Transit or Walking.
+            timeout (float): The number of seconds allowed for the call. Defaults to the timeout of the object
+            kwargs: Additional parameters as accepted by bing.RouteRetriever.calculate_route
+
+        Returns:
+            bing.RouteResult: The route
+
+        Raises:
+            asyncio.TimeoutError: If the call took longer than the timeout
+        """
+        timeout = self.timeout if timeout is None else timeout
+        return await _call(self._route(start_location, end_location, travelMode, **kwargs), timeout)
+
+    async def calculate_routes(self, queries, max_in_flight=100, timeout=None):
+        """Calculates many routes concurrently, yielding each route as soon as it is returned
+
+        Args:
+            queries (dict or iterable): Queries as accepted by bing.RouteRetriever.calculate_routes
+
+        Yields:
+            tuple: (key, RouteResult, error) where error is the exception raised for the query or None
+        """
+        def route(query):
+            options = query[3] if len(query) > 3 else {}
+            return self.calculate_route(*query[:3], timeout=timeout, **options)
+
+        async for item in run_concurrently(route, queries, max_in_flight, self._transport.concurrency_limiter):
+            yield item
+
+    async def _route(self, start_location, end_location, travelMode, via=None, **kwargs):
+        via = via or []
+        cache_key = response_cache.route_key(start_location, end_location, travelMode, kwargs, via)
+        found = self._provider._lookup(cache_key)
+        if found is not None:
+            return found[1]
+        return await self._flights.do(cache_key, self._fetch, cache_key, start_location, end_location, travelMode, via,
+                                      kwargs)
+
+    async def _fetch(self, cache_key, start_location, end_location, travelMode, via, options):
+        params = self._provider._route_params(start_location, end_location, via, options)
+        response = await self._transport.get(self.route_api_url.format(travelMode=travelMode), params=params)
+        return await _off_loop(self._parse_and_store, cache_key, response, options)
+
+    def _parse_and_store(self, cache_key, response, options):
+        result = self._provider._parse(response.content, response.status_code)
+        self._provider._store(cache_key, response.text, options)
+        return result
@@ -0,0 +1,372 @@
+"""A module for keeping every raw provider response in compressed files that can be searched and replayed
+
+Archive appends responses to a directory of segment files instead of writing one file per response:
+
+    segment-N.arc       A header naming the compression, then blocks of records, each block compressed on its own
+    segment-N.idx       Sorted (key hash, location) pairs for every record in the segment, written when it is sealed
+
+A record is the kind of response (mapquest, bing or route), the key it was stored under and the response text. Keys
+are the cache keys, such as cache.geocode_key('bing', address), so an archived response is found by the same
+normalized query that would find it in a cache. Records are held in memory until a block is full, and a segment is
+sealed and a new one started once it reaches max_segment_bytes, so memory use does not grow with the archive.
+
+Blocks are compressed with zstandard when it is installed and with gzip otherwise. Each segment records which one it
+uses, so an archive can hold both.
+
+get reads one block to return the latest response for a key. replay streams every response back as the AddressResult
+or RouteResult it describes, one block at a time, without sending any requests.
+"""
+import collections
+import glob
+import gzip
+import hashlib
+import os
+import struct
+import threading
+import Geocoder
+import bing
+import localindex
+import parsing
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_magic = b'ARC1'
+_codecs = {'zstd': b'Z', 'gzip': b'G'}
+_block_header = struct.Struct('<II')
+_record_header = struct.Struct('<HII')
+_index_entry = struct.Struct('<QQ')
+# A location is the offset of its block in the segment shifted past the position of the record in the block
+_position_bits = 20
+
+
+def key_hash(key):
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def build_result(kind, text):
+    """Rebuilds the result object from an archived response
+
+    Args:
+        kind (str): mapquest, bing or route
+        text (str): The response body
+
+    Returns:
+        obj: A Geocoder.AddressResult, bing.AddressResult or bing.RouteResult
+    """
+    data = parsing.loads(text)
+    if kind == 'mapquest':
+        return Geocoder.AddressResult(data)
+    if kind == 'route':
+        return bing.RouteResult(data)
+    return bing.AddressResult(parsing.walk(data, ('resourceSets', 0, 'resources', 0)))
+
+
+def _compress(codec, data):
+    if codec == b'Z':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def _decompress(codec, data):
+    if codec == b'Z':
+        if zstandard is None:
+            raise ImportError('zstandard must be installed to read a segment compressed with zstd')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _encode_records(records):
+    parts = []
+    for kind, key, text in records:
+        kind, key, text = kind.encode('utf-8'), key.encode('utf-8'), text.encode('utf-8')
+        parts.append(_record_header.pack(len(kind), len(key), len(text)))
+        parts.extend((kind, key, text))
+    return b''.join(parts)
+
+
+def _decode_records(payload):
+    records = []
+    offset = 0
+    while offset < len(payload):
+        kind_size, key_size, text_size = _record_header.unpack_from(payload, offset)
+        offset += _record_header.size
+        kind = payload[offset:offset + kind_size].decode('utf-8')
+        offset += kind_size
+        key = payload[offset:offset + key_size].decode('utf-8')
+        offset += key_size
+        records.append((kind, key, payload[offset:offset + text_size].decode('utf-8')))
+        offset += text_size
+    return records
+
+
+def _read_blocks(f):
+    """Yields the offset, record count and compressed bytes of each whole block from the current position of a file.
+    A block cut short by a crash ends the iteration"""
+    while True:
+        offset = f.tell()
+        header = f.read(_block_header.size)
+        if len(header) < _block_header.size:
+            return
+        size, count = _block_header.unpack(header)
+        data = f.read(size)
+        if len(data) < size:
+            return
+        yield offset, count, data
+
+
+class Archive:
+    """An append only store of raw provider responses
+
+    Attributes:
+        directory (str): The directory holding the segment files
+        codec (str): The compression used for new segments, zstd or gzip
+    """
+    def __init__(self, directory, max_segment_bytes=64 * 1024 * 1024, block_records=256, block_bytes=1024 * 1024,
+                 max_segments=None, compression=None, cached_blocks=16):
+        """The constructor for the archive
+
+        Args:
+            directory (str): The directory holding the segment files. It is created if it does not exist
+            max_segment_bytes (int): The size at which a segment is sealed and a new one started
+            block_records (int): The most records held in memory before they are compressed and written as a block
+            block_bytes (int): The most bytes of response text held in memory before they are written as a block
+            max_segments (int): The most sealed segments to keep. The oldest are deleted past this. None keeps every
+                segment
+            compression (str): zstd or gzip. Defaults to zstd when zstandard is installed and gzip otherwise
+            cached_blocks (int): The number of decompressed blocks kept for repeated reads by get
+        """
+        if compression is None:
+            compression = 'gzip' if zstandard is None else 'zstd'
+        if compression not in _codecs:
+            raise ValueError('compression must be one of ' + ', '.join(_codecs))
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstandard must be installed to compress with zstd')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.codec = compression
+        self.max_segment_bytes = max_segment_bytes
+        self.block_records = block_records
+        self.block_bytes = block_bytes
+        self.max_segments = max_segments
+        self.cached_blocks = cached_blocks
+        self._lock = threading.RLock()
+        self._blocks = collections.OrderedDict()
+        self._pending = []
+        self._pending_bytes = 0
+        self._sealed = []
+        for path in sorted(glob.glob(os.path.join(directory, 'segment-*.arc'))):
+            if not os.path.exists(path[:-4] + '.idx'):
+                # A segment that was never sealed, because the process stopped while writing it
+                self._recover(path)
+            self._sealed.append(self._open_sealed(path))
+        self._open_segment()
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, 'segment-{0:06d}.arc'.format(number))
+
+    def _open_sealed(self, path):
+        f = open(path, 'rb')
+        return path, f, f.read(len(_magic) + 1)[-1:], localindex.Segment(path[:-4] + '.idx', _index_entry)
+
+    def _open_segment(self):
+        number = int(os.path.basename(self._sealed[-1][0])[8:14]) + 1 if self._sealed else 1
+        self._path = self._segment_path(number)
+        self._file = open(self._path, 'ab+')
+        self._file.write(_magic + _codecs[self.codec])
+        self._file.flush()
+        self._codec = _codecs[self.codec]
+        self._index = {}
+        self._size = self._file.tell()
+
+    def _recover(self, path):
+        """Indexes an unsealed segment, cutting off a block that was only partly written"""
+        entries = []
+        with open(path, 'r+b') as f:
+            header = f.read(len(_magic) + 1)
+            if len(header) < len(_magic) + 1:
+                f.truncate(0)
+                f.write(_magic + _codecs['gzip'])
+                end = f.tell()
+            else:
+                end = f.tell()
+                for offset, count, data in _read_blocks(f):
+                    for position, (_, key, _) in enumerate(_decode_records(_decompress(header[-1:], data))):
+                        entries.append((key_hash(key), offset << _position_bits | position))
+                    end = f.tell()
+            f.truncate(end)
+        localindex.write_segment(path[:-4] + '.idx', entries, _index_entry)
+
+    def append(self, kind, key, text):
+        """Adds a response
+
+        Args:
+            kind (str): mapquest, bing or route, which sets the result replay rebuilds
+            key (str): The key to find the response by, such as its cache key
+            text (str): The response body
+        """
+        with self._lock:
+            self._pending.append((kind, key, text))
+            self._pending_bytes += len(text)
+            if len(self._pending) >= self.block_records or self._pending_bytes >= self.block_bytes:
+                self._write_block()
+                if self._size >= self.max_segment_bytes:
+                    self.rotate()
+
+    def _write_block(self):
+        if not self._pending:
+            return
+        data = _compress(self._codec, _encode_records(self._pending))
+        offset = self._size
+        self._file.write(_block_header.pack(len(data), len(self._pending)) + data)
+        self._file.flush()
+        self._size += _block_header.size + len(data)
+        for position, (_, key, _) in enumerate(self._pending):
+            self._index.setdefault(key_hash(key), []).append(offset << _position_bits | position)
+        self._pending = []
+        self._pending_bytes = 0
+
+    def rotate(self):
+        """Writes the records held in memory, seals the current segment and starts a new one"""
+        with self._lock:
+            self._write_block()
+            self._seal()
+            self._open_segment()
+            if self.max_segments is not None:
+                while len(self._sealed) > self.max_segments:
+                    self._remove(self._sealed.pop(0))
+
+    def _seal(self):
+        entries = [(hashed, location) for hashed, locations in self._index.items() for location in locations]
+        localindex.write_segment(self._path[:-4] + '.idx', entries, _index_entry)
+        self._file.close()
+        self._sealed.append(self._open_sealed(self._path))
+
+    def _remove(self, sealed):
+        path, f, _, segment = sealed
+        segment.close()
+        f.close()
+        for key in [key for key in self._blocks if key[0] == path]:
+            del self._blocks[key]
+        os.remove(path[:-4] + '.idx')
+        os.remove(path)
+
+    def flush(self):
+        """Writes the records held in memory to the current segment and syncs it to disk"""
+        with self._lock:
+            self._write_block()
+            os.fsync(self._file.fileno())
+
+    def get(self, key):
+        """Returns the latest response stored under a key
+
+        Args:
+            key (str): The key the response was appended with
+
+        Returns:
+            tuple: The kind and the response text, or None if the key is not in the archive
+        """
+        hashed = key_hash(key)
+        with self._lock:
+            for kind, record_key, text in reversed(self._pending):
+                if record_key == key:
+                    return kind, text
+            found = self._find(self._path, self._file, self._codec, self._index.get(hashed, ()), key)
+            if found is not None:
+                return found
+            # Newer segments first, so the latest response for a key wins
+            for path, f, codec, segment in reversed(self._sealed):
+                found = self._find(path, f, codec, segment.find(hashed), key)
+                if found is not None:
+                    return found
+        return None
+
+    def result(self, key):
+        """Returns the result object rebuilt from the latest response stored under a key, or None"""
+        found = self.get(key)
+        return None if found is None else build_result(*found)
+
+    def _find(self, path, f, codec, locations, key):
+        for location in reversed(locations):
+            kind, record_key, text = self._read_block(path, f, codec, location >> _position_bits)[
+                location & ((1 << _position_bits) - 1)]
+            if record_key == key:
+                return kind, text
+        return None
+
+    def _read_block(self, path, f, codec, offset):
+        records = self._blocks.get((path, offset))
+        if records is not None:
+            self._blocks.move_to_end((path, offset))
+            return records
+        f.seek(offset)
+        size, _ = _block_header.unpack(f.read(_block_header.size))
+        records = _decode_records(_decompress(codec, f.read(size)))
+        self._blocks[path, offset] = records
+        if len(self._blocks) > self.cached_blocks:
+            self._blocks.popitem(last=False)
+        return records
+
+    def records(self, kind=None):
+        """Yields every response in the order it was appended, reading one block at a time
+
+        Args:
+            kind (str): Only yield responses of this kind. Every response is yielded when None
+
+        Yields:
+            tuple: The kind, key and response text of each response
+        """
+        with self._lock:
+            self._write_block()
+            paths = [sealed[0] for sealed in self._sealed] + [self._path]
+            end = self._size
+        for path in paths:
+            with open(path, 'rb') as f:
+                codec = f.read(len(_magic) + 1)[-1:]
+                for offset, _, data in _read_blocks(f):
+                    if path == paths[-1] and offset >= end:
+                        break
+                    for record in _decode_records(_decompress(codec, data)):
+                        if kind is None or record[0] == kind:
+                            yield record
+
+    def replay(self, kind=None):
+        """Yields the result object for every response in the order it was appended, without sending any requests
+
+        Args:
+            kind (str): Only replay responses of this kind. Every response is replayed when None
+
+        Yields:
+            tuple: The key and the Geocoder.AddressResult, bing.AddressResult or bing.RouteResult of each response
+        """
+        for record_kind, key, text in self.records(kind):
+            yield key, build_result(record_kind, text)
+
+    def close(self):
+        """Seals the current segment. A segment that has no records is removed instead"""
+        with self._lock:
+            self._write_block()
+            if self._index:
+                self._seal()
+            else:
+                self._file.close()
+                os.remove(self._path)
+            for _, f, _, segment in self._sealed:
+                segment.close()
+                f.close()
+            self._sealed = []
+            self._blocks.clear()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(sealed[3]) for sealed in self._sealed) + \
+                sum(len(locations) for locations in self._index.values()) + len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
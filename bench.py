@@ -0,0 +1,347 @@
+"""A benchmark of the provider classes against a local mock of the MapQuest and Bing APIs
+
+MockProviderServer serves canned MapQuest geocode, Bing Locations and Bing Routes responses from a local port, with a
+configurable delay, error rate and route size, so the benchmark needs neither a network connection nor an api key.
+Each benchmark reports throughput, latency percentiles and the peak memory allocated while it ran.
+
+Example:
+    python bench.py --requests 500 --latency 0.02 --error-rate 0.01 --itinerary-items 200
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import Geocoder
+import bing
+
+
+def mapquest_location(address, index=0):
+    return {
+        'street': '{0} Main St'.format(100 + index), 'adminArea6': '', 'adminArea6Type': 'Neighborhood',
+        'adminArea5': 'Minneapolis', 'adminArea5Type': 'City', 'adminArea4': 'Hennepin', 'adminArea4Type': 'County',
+        'adminArea3': 'MN', 'adminArea3Type': 'State', 'adminArea1': 'US', 'adminArea1Type': 'Country',
+        'postalCode': '55401', 'geocodeQualityCode': 'L1AAA', 'geocodeQuality': 'ADDRESS', 'dragPoint': False,
+        'sideOfStreet': 'R', 'linkId': '0', 'unknownInput': '', 'type': 's',
+        'latLng': {'lat': 44.97 + index * 1e-4, 'lng': -93.26 - index * 1e-4},
+        'displayLatLng': {'lat': 44.97 + index * 1e-4, 'lng': -93.26 - index * 1e-4},
+        'mapUrl': 'http://www.mapquestapi.com/staticmap/v5/map?locations={0}'.format(urllib.parse.quote(address)),
+    }
+
+
+def mapquest_response(addresses):
+    return {
+        'info': {'statuscode': 0, 'copyright': {'text': '© 2021 MapQuest, Inc.'}, 'messages': []},
+        'options': {'maxResults': -1, 'thumbMaps': True, 'ignoreLatLngInput': False},
+        'results': [{'providedLocation': {'location': address}, 'locations': [mapquest_location(address, index)]}
+                    for index, address in enumerate(addresses)],
+    }
+
+
+def bing_location(query):
+    return {
+        '__type': 'Location:http://schemas.microsoft.com/search/local/ws/rest/v1',
+        'bbox': [44.96, -93.27, 44.98, -93.25], 'name': query, 'entityType': 'Address', 'confidence': 'High',
+        'point': {'type': 'Point', 'coordinates': [44.97, -93.26]},
+        'address': {'addressLine': '100 Main St', 'adminDistrict': 'MN', 'adminDistrict2': 'Hennepin County',
+                    'countryRegion': 'United States', 'formattedAddress': query, 'locality': 'Minneapolis',
+                    'postalCode': '55401'},
+        'geocodePoints': [{'type': 'Point', 'coordinates': [44.97, -93.26], 'calculationMethod': 'Rooftop',
+                           'usageTypes': ['Display']}],
+        'matchCodes': ['Good'],
+    }
+
+
+def traffic_factor(departure):
+    """Returns a traffic multiple with morning and evening peaks for a departure time such as 05/04/2021 07:30:00"""
+    match = re.search(r'(\d{1,2}):(\d{2})', departure or '')
+    if match is None:
+        return 1.2
+    hour = int(match.group(1)) + int(match.group(2)) / 60
+    return 1.0 + 0.8 * math.exp(-(hour - 8) ** 2 / 2) + 0.6 * math.exp(-(hour - 17) ** 2 / 2)
+
+
+def bing_envelope(resources):
+    return {'authenticationResultCode': 'ValidCredentials', 'brandLogoUri': 'http://dev.virtualearth.net/logo.png',
+            'copyright': 'Copyright © 2021 Microsoft and its suppliers.',
+            'resourceSets': [{'estimatedTotal': len(resources), 'resources': resources}],
+            'statusCode': 200, 'statusDescription': 'OK', 'traceId': 'mock'}
+
+
+def bing_route(stops, travel_mode, itinerary_items, traffic=1.2):
+    """Returns a route resource with one leg between each pair of consecutive stops
+
+    Args:
+        traffic (float): The travel duration with traffic as a multiple of the duration without it
+    """
+    items = [{'compassDirection': 'north', 'details': [{'compassDegrees': 0, 'maneuverType': 'DepartStart',
+                                                         'names': ['Main St'], 'roadType': 'Street'}],
+              'iconType': 'Auto', 'instruction': {'maneuverType': 'DepartStart', 'text': 'Head north on Main St'},
+              'maneuverPoint': {'type': 'Point', 'coordinates': [44.85 + step * 1e-3, -93.24]},
+              'sideOfStreet': 'Unknown', 'travelDistance': 0.25, 'travelDuration': 30, 'travelMode': travel_mode}
+             for step in range(itinerary_items)]
+    legs = [{'startLocation': bing_location(start), 'endLocation': bing_location(end), 'itineraryItems': items,
+             'travelDistance': 0.25 * itinerary_items, 'travelDuration': 30 * itinerary_items}
+            for start, end in zip(stops, stops[1:])]
+    return {
+        '__type': 'Route:http://schemas.microsoft.com/search/local/ws/rest/v1', 'distanceUnit': 'Kilometer',
+        'durationUnit': 'Second', 'travelDistance': 0.25 * itinerary_items * len(legs),
+        'travelDuration': 30 * itinerary_items * len(legs), 'travelDurationTraffic': round(30 * traffic * itinerary_items * len(legs)),
+        'trafficCongestion': 'Mild', 'travelMode': travel_mode, 'routeLegs': legs,
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._respond(None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._respond(json.loads(self.rfile.read(length)) if length else {})
+
+    def _respond(self, body):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            self._send(503, b'{"statusCode": 503, "statusDescription": "Service Unavailable"}')
+            return
+
+        url = urllib.parse.urlparse(self.path)
+        query = {name: values[0] for name, values in urllib.parse.parse_qs(url.query).items()}
+        if url.path == '/geocoding/v1/address':
+            data = mapquest_response([query.get('location', '')])
+        elif url.path == '/geocoding/v1/reverse':
+            data = mapquest_response([query.get('location', '')])
+        elif url.path == '/geocoding/v1/batch':
+            data = mapquest_response([str(location) for location in body.get('locations', [])])
+        elif url.path == '/REST/v1/Locations':
+            data = bing_envelope([bing_location(query.get('q', ''))])
+        elif url.path.startswith('/REST/v1/Locations/'):
+            data = bing_envelope([bing_location(url.path.rsplit('/', 1)[1])])
+        elif url.path == '/REST/v1/Routes/DistanceMatrix':
+            origins, destinations = query['origins'].split(';'), query['destinations'].split(';')
+            cells = [{'originIndex': row, 'destinationIndex': column, 'travelDistance': 1.0 + row + column,
+                      'travelDuration': 60.0 * (1 + row + column)}
+                     for row in range(len(origins)) for column in range(len(destinations))]
+            data = bing_envelope([{'results': cells}])
+        elif url.path.startswith('/REST/v1/Routes/'):
+            # Only stops start a new leg, via waypoints are passed through
+            waypoints = sorted((int(name.split('.')[1]), name.startswith('wp'), value) for name, value in query.items()
+                               if name.startswith(('wp.', 'vwp.')))
+            stops = [value for _, stop, value in waypoints if stop]
+            data = bing_envelope([bing_route(stops, url.path.rsplit('/', 1)[1], server.itinerary_items,
+                                             traffic_factor(query.get('dt')))])
+        else:
+            self._send(404, b'{"statusCode": 404, "statusDescription": "Not Found"}')
+            return
+        self._send(200, json.dumps(data).encode('utf-8'))
+
+    def _send(self, status, payload):
+        # The status line, headers and body go out in one write, so Nagle's algorithm does not hold back the body
+        head = 'HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n\r\n'.format(
+            status, self.responses[status][0], len(payload))
+        self.wfile.write(head.encode('latin-1') + payload)
+
+
+class _Server(ThreadingHTTPServer):
+    # Enough queued connections for clients that open hundreds at once
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class MockProviderServer:
+    """A local HTTP server that answers like the MapQuest and Bing APIs
+
+    Attributes:
+        url (str): The base url of the server. Example: http://127.0.0.1:54321
+    """
+    def __init__(self, latency=0.0, error_rate=0.0, itinerary_items=20, port=0):
+        """The constructor for the mock server
+
+        Args:
+            latency (float): The number of seconds to wait before answering each request
+            error_rate (float): The fraction of requests answered with a 503 error
+            itinerary_items (int): The number of steps in each route, which sets the size of route responses
+            port (int): The port to listen on. 0 picks a free port
+        """
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.latency = latency
+        self._server.error_rate = error_rate
+        self._server.itinerary_items = itinerary_items
+        self.url = 'http://127.0.0.1:{0}'.format(self._server.server_port)
+        self._worker = None
+
+    def start(self, process=False):
+        """Starts answering requests
+
+        Args:
+            process (bool): Serve from a forked process instead of a thread, so the server does not compete with the
+                code being measured for the GIL. Needs a platform that can fork
+        """
+        if process:
+            self._worker = multiprocessing.get_context('fork').Process(target=self._server.serve_forever, daemon=True)
+        else:
+            self._worker = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._worker.start()
+        return self
+
+    def stop(self):
+        if isinstance(self._worker, threading.Thread):
+            self._server.shutdown()
+        else:
+            self._worker.terminate()
+            self._worker.join()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def point_at(self, provider):
+        """Sends every request of a Geocoder.Geocoder, bing.Geocoder or bing.RouteRetriever to this server"""
+        if isinstance(provider, Geocoder.Geocoder):
+            provider.search_api_url = self.url + '/geocoding/v1/address'
+            provider.batch_api_url = self.url + '/geocoding/v1/batch'
+            provider.reverse_api_url = self.url + '/geocoding/v1/reverse'
+        elif isinstance(provider, bing.Geocoder):
+            provider.search_api_url = self.url + '/REST/v1/Locations'
+            provider.reverse_api_url = self.url + '/REST/v1/Locations/{latitude},{longitude}'
+        else:
+            provider.route_api_url = self.url + '/REST/v1/Routes/{travelMode}'
+            provider.matrix_api_url = self.url + '/REST/v1/Routes/DistanceMatrix'
+        return provider
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def measure(name, function, calls):
+    """Calls function calls times and summarizes the run
+
+    The calls are timed with tracemalloc off, since tracing slows every allocation, and then a few more calls are made
+    with it on to find the peak memory.
+
+    Args:
+        name (str): The name of the benchmark
+        function (callable): Called with the number of the call
+        calls (int): The number of calls
+
+    Returns:
+        dict: The throughput in calls per second, latency percentiles in milliseconds, errors and peak memory in KiB
+    """
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for call in range(calls):
+        call_start = time.perf_counter()
+        try:
+            function(call)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for call in range(min(calls, 10)):
+        try:
+            function(calls + call)
+        except Exception:
+            pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {'benchmark': name, 'calls': calls, 'errors': errors, 'throughput': calls / elapsed,
+            'p50_ms': percentile(latencies, 0.5) * 1000, 'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000, 'peak_kib': peak / 1024}
+
+
+def run_benchmarks(requests=200, latency=0.0, error_rate=0.0, itinerary_items=20, workers=8):
+    """Runs every benchmark against a fresh mock server
+
+    Returns:
+        list: A dict of results for each benchmark
+    """
+    results = []
+    server = MockProviderServer(latency, error_rate, itinerary_items).start(process=hasattr(os, 'fork'))
+    try:
+        mapquest = server.point_at(Geocoder.Geocoder('mock', max_retries=0))
+        results.append(measure('mapquest_search', lambda call: mapquest.search('{0} Main St'.format(call)), requests))
+
+        batch = requests // 100 or 1
+        results.append(measure('mapquest_search_many_x100', lambda call: list(
+            mapquest.search_many('{0} {1} Main St'.format(call, number) for number in range(100))), batch))
+
+        geocoder = server.point_at(bing.Geocoder('mock', pool_size=workers, max_retries=0))
+        results.append(measure('bing_search', lambda call: geocoder.search('{0} Main St'.format(call)), requests))
+        results.append(measure('bing_search_concurrently_x100', lambda call: list(geocoder.search_concurrently(
+            ['{0} {1} Main St'.format(call, number) for number in range(100)], workers)), batch))
+
+        route_retriever = server.point_at(bing.RouteRetriever('mock', pool_size=workers, max_retries=0))
+        results.append(measure('calculate_route', lambda call: route_retriever.calculate_route(
+            'Mall of America', '{0} Main St'.format(call), 'Driving'), requests))
+
+        route_retriever.calculate_route('Mall of America', 'Minneapolis Airport', 'Driving')
+        route_payload = json.loads(route_retriever._response.text)
+
+        # The properties cache what they read, so each call reads a new result rather than the cached values
+        def read_route(call):
+            route = bing.RouteResult(route_payload)
+            return (route.distance, route.duration, route.duration_traffic, route.mode, str(route.start_location),
+                    route.print_instructions)
+        results.append(measure('route_properties', read_route, requests))
+
+        geocoder.search('100 Main St')
+        address_payload = json.loads(geocoder._response.text)['resourceSets'][0]['resources'][0]
+
+        def read_address(call):
+            address = bing.AddressResult(address_payload)
+            return (address.street_address, address.city, address.state, address.latitude, address.longitude,
+                    address.geocode_quality)
+        results.append(measure('address_properties', read_address, requests * 10))
+    finally:
+        server.stop()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the provider classes against a local mock server')
+    parser.add_argument('--requests', type=int, default=200, help='The number of calls per benchmark')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the mock server waits per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='The fraction of requests that fail')
+    parser.add_argument('--itinerary-items', type=int, default=20, help='The number of steps in each route')
+    parser.add_argument('--workers', type=int, default=8, help='The number of requests in flight for concurrent runs')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.requests, args.latency, args.error_rate, args.itinerary_items, args.workers)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('{0:<32}{1:>8}{2:>8}{3:>12}{4:>10}{5:>10}{6:>10}{7:>12}'.format(
+        'benchmark', 'calls', 'errors', 'calls/s', 'p50 ms', 'p95 ms', 'p99 ms', 'peak KiB'))
+    for result in results:
+        print('{benchmark:<32}{calls:>8}{errors:>8}{throughput:>12.1f}{p50_ms:>10.2f}{p95_ms:>10.2f}{p99_ms:>10.2f}'
+              '{peak_kib:>12.1f}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,98 @@
-import requests
+import array
+import base64
+import collections
+import csv
+import datetime
+import functools
+import io
 import json
+import math
+import sys
+import concurrency
+import parsing
+import singleflight
+import transport
+import trip
+import cache as response_cache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Scores from 0 to 1 for comparing a Bing location against results from other providers
+confidence_scores = {'High': 1.0, 'Medium': 0.6, 'Low': 0.3}
+match_code_factors = {'Good': 1.0, 'Ambiguous': 0.7, 'UpHierarchy': 0.5}
+
+# One step of a route. coordinates is the (latitude, longitude) of the maneuver, or None
+RouteStep = collections.namedtuple('RouteStep', ['leg', 'distance', 'duration', 'maneuver', 'text', 'coordinates'])
+
+# The format Bing accepts for the dt parameter of a route
+_departure_format = '%m/%d/%Y %H:%M:%S'
 
 class RouteRetriever:
-    """An object for retrieving the route between two locations using Bing's custom search API"""
+    """An object for retrieving the route between two locations using Bing's custom search API
 
-    def __init__(self, api_key):
+    calculate_route and calculate_waypoint_route store their route on the object, so an object used through them
+    belongs to one thread. get_route, get_waypoint_route, calculate_routes, calculate_matrix, calculate_trip,
+    sweep_departures and departure_duration store nothing on the object beyond caching, so one object can serve any
+    number of threads.
+    """
+    route_api_url = 'http://dev.virtualearth.net/REST/v1/Routes/{travelMode}'
+    matrix_api_url = 'http://dev.virtualearth.net/REST/v1/Routes/DistanceMatrix'
+    matrix_max_cells = 2500
+    max_waypoints = 25
+    matrix_travel_modes = ('driving', 'walking', 'transit')
+    # The calculate_route options the distance matrix API has a parameter for
+    matrix_options = ('du', 'dt')
+
+    def __init__(self, api_key, pool_size=10, cache=None, cache_ttls=None, lazy=False, keep_response=True,
+                 rate_limiter=None, max_retries=3, concurrency_limiter=None, events=None, single_flight=None,
+                 session=None, archive=None):
         """The constructor for the route retriever utilizing bing
         
         Args:
             api_key (str): The secret key for accessing the api
-        
+            pool_size (int): The number of keep-alive connections to hold open for concurrent requests. Not used when
+                a session is given
+            cache (obj): A cache such as cache.TieredCache that is checked before any request is sent
+            cache_ttls (dict): The time to live of a cached route for each value of optmz. Defaults to cache.route_ttls
+            lazy (bool): Defer parsing each response until a field of its route is first read
+            keep_response (bool): Keep the whole parsed response on each route. When False, routes only keep the
+                route resources
+            rate_limiter (obj): A ratelimit.RateLimiter. Requests are counted against the bing key
+            max_retries (int): The number of times a throttled or failed request is retried with backoff
+            concurrency_limiter (obj): A ratelimit.AdaptiveConcurrency that sets how many concurrent requests are in
+                flight from the latency and errors seen
+            events (obj): An instrumentation.EventEmitter that requests, cache lookups and parsing are reported to.
+                Defaults to instrumentation.events
+            single_flight (obj): A singleflight.SingleFlight through which concurrent identical requests share one
+                request. Pass the same one to several provider objects to share requests between them. Each object
+                makes its own when None
+            session (requests.Session): The session to send requests with, such as concurrency.shared_session() to
+                share one connection pool between every provider object. A new session is made when None
+            archive (obj): An archive.Archive that every response fetched from the provider is appended to
         """
-        self._session = requests.session()
+        self._session = concurrency.make_session(pool_size) if session is None else session
+        self._transport = transport.Transport(self._session, 'bing', rate_limiter, max_retries, concurrency_limiter,
+                                              events=events)
+        self._events = self._transport.events
+        self._flights = singleflight.SingleFlight() if single_flight is None else single_flight
         self._response = None
         self._api_key = api_key
+        self._cache = cache
+        self._cache_ttls = cache_ttls
+        self._lazy = lazy
+        self._keep_response = keep_response
+        self._archive = archive
+        # The DepartureProfile objects made by sweep_departures, by cache key
+        self._profiles = response_cache.MemoryCache(max_entries=100000)
         self.start_location = None
         self.end_location = None
         self.route = None
 
     def calculate_route(self, start_location, end_location, travelMode, **kwargs):
-        """Finds the route between two address. Note this object is only setup to handle two waypoints.
+        """Finds the route between two address. Use calculate_waypoint_route for routes with more waypoints.
         The _response attribute can be accessed to work with the raw response from bing for additional functionality
         
         Args:
@@ -47,39 +120,438 @@ class RouteRetriever:
                     - Departure: The dateTime parameter contains the desired departure time for a transit request.
                     - LastAvailable: The dateTime parameter contains the latest departure time available for a transit request.
         """
-        search_api_url = 'http://dev.virtualearth.net/REST/v1/Routes/{travelMode}'.format(travelMode = travelMode)
+        self.start_location = start_location
+        self.end_location = end_location
+        self._response, self.route = self._route(start_location, end_location, travelMode, **kwargs)
+
+    def calculate_waypoint_route(self, waypoints, travelMode, via=(), **kwargs):
+        """Finds the route through a list of waypoints, in the order given
+
+        Args:
+            waypoints (list): Addresses or (latitude, longitude) pairs. There can be at most max_waypoints
+            travelMode (str): Specifies the mode of travel for the route. Can be Driving, Transit or Walking.
+            via (iterable): The positions in waypoints of via waypoints, which the route passes through without
+                stopping. The first and last waypoints cannot be via waypoints
+            kwargs: Additional parameters as accepted by calculate_route
+
+        Raises:
+            ValueError: If there are fewer than two waypoints, more than max_waypoints, or the first or last is a via
+                waypoint
+        """
+        self._response, self.route = self._waypoint_route(waypoints, travelMode, via, **kwargs)
+        self.start_location = _waypoint(waypoints[0])
+        self.end_location = _waypoint(waypoints[-1])
+
+    def get_route(self, start_location, end_location, travelMode, return_response=False, **kwargs):
+        """Finds the route between two addresses without storing anything on the object, so one object can be shared
+        by many threads
+
+        Args:
+            start_location (str): The address of the location to start at
+            end_location (str): The address of the location to end at
+            travelMode (str): Specifies the mode of travel for the route. Can be Driving, Transit or Walking.
+            return_response (bool): Also return the raw response, which is a cache.CachedResponse for a cached route
+            kwargs: Additional parameters as accepted by calculate_route
+
+        Returns:
+            RouteResult: The route, or a tuple of the route and the raw response when return_response is True
+        """
+        response, route = self._route(start_location, end_location, travelMode, **kwargs)
+        return (route, response) if return_response else route
+
+    def get_waypoint_route(self, waypoints, travelMode, via=(), return_response=False, **kwargs):
+        """Finds the route through a list of waypoints without storing anything on the object
+
+        Takes the arguments of calculate_waypoint_route and return_response as accepted by get_route.
+
+        Returns:
+            RouteResult: The route, or a tuple of the route and the raw response when return_response is True
+        """
+        response, route = self._waypoint_route(waypoints, travelMode, via, **kwargs)
+        return (route, response) if return_response else route
+
+    def _waypoint_route(self, waypoints, travelMode, via=(), **kwargs):
+        waypoints = [_waypoint(point) for point in waypoints]
+        via = set(via)
+        if not 2 <= len(waypoints) <= self.max_waypoints:
+            raise ValueError('A route needs between 2 and {0} waypoints'.format(self.max_waypoints))
+        if via & {0, len(waypoints) - 1}:
+            raise ValueError('The first and last waypoints cannot be via waypoints')
+
+        between = [('vwp' if position in via else 'wp', waypoint)
+                   for position, waypoint in enumerate(waypoints[1:-1], 1)]
+        return self._route(waypoints[0], waypoints[-1], travelMode, via=between, **kwargs)
+
+    def calculate_trip(self, stops, travelMode, round_trip=False, end=None, max_workers=8, **kwargs):
+        """Finds a short order to visit a list of stops in, and the routes between them in that order
+
+        The duration between every pair of stops is found with calculate_matrix, which uses the cache, and the order is
+        chosen with trip.optimize_order. The trip is then routed with as few requests as the max_waypoints limit
+        allows.
+
+        Args:
+            stops (list): Addresses or (latitude, longitude) pairs. The trip starts at the first stop
+            travelMode (str): Specifies the mode of travel for the route. Can be Driving, Transit or Walking.
+            round_trip (bool): Return to the first stop at the end of the trip
+            end (int): The position in stops of the stop to finish at. None lets the optimizer choose
+            max_workers (int): The maximum number of requests in flight at once
+            kwargs: Additional parameters as accepted by calculate_route
+
+        Returns:
+            trip.Trip: The order of the stops and the route for each section of the trip
+        """
+        matrix = self.calculate_matrix(stops, stops, travelMode, max_workers, **kwargs)
+        order = trip.optimize_order(matrix.durations, 0, end, round_trip)
+        waypoints = [_waypoint(stops[position]) for position in order]
+        queries = [(section[0], section[-1], travelMode, dict(kwargs, via=[('wp', point) for point in section[1:-1]]))
+                   for section in trip.sections(waypoints, self.max_waypoints)]
+        routes = [None] * len(queries)
+        for index, route, error in self.calculate_routes(queries, max_workers):
+            if error is not None:
+                raise error
+            routes[index] = route
+        return trip.Trip(stops, order, routes, matrix)
+
+    def calculate_routes(self, queries, max_workers=8):
+        """Calculates many routes concurrently, yielding each route as soon as it is returned
+
+        Args:
+            queries (dict or iterable): Each query is a tuple of (start_location, end_location, travelMode) with an
+                optional fourth item holding a dict of additional parameters as accepted by calculate_route. For a dict
+                of queries, the keys are used to tag the results, otherwise the position of the query is used.
+            max_workers (int): The maximum number of requests in flight at once
+
+        Yields:
+            tuple: (key, RouteResult, error) where error is the exception raised for the query or None
+        """
+        def route(query):
+            start_location, end_location, travelMode = query[:3]
+            options = query[3] if len(query) > 3 else {}
+            return self._route(start_location, end_location, travelMode, **options)[1]
+
+        return concurrency.run_concurrently(route, queries, max_workers, self._transport.concurrency_limiter)
+
+    def sweep_departures(self, pairs, travelMode, window_start, window_end, step=datetime.timedelta(minutes=15),
+                         max_workers=8, ttl=24 * 60 * 60, **kwargs):
+        """Finds how long each route takes for departures at regular times across a window
+
+        A time dependent route is requested for every pair and departure time, max_workers at a time. The durations of
+        each pair are kept as a DepartureProfile, in memory and in the cache, so departure_duration can answer any
+        departure inside the window from the profile without another request.
+
+        Args:
+            pairs (iterable): (start_location, end_location) tuples. Locations are addresses or (latitude, longitude)
+                pairs. Repeated pairs are only requested once
+            travelMode (str): Specifies the mode of travel for the route. Can be Driving, Transit or Walking.
+            window_start (datetime.datetime): The first departure, in the local time of the start locations
+            window_end (datetime.datetime): The last departure. It is only included when it falls on a step
+            step (datetime.timedelta): The time between departures
+            max_workers (int): The maximum number of requests in flight at once
+            ttl (float): The number of seconds a profile is kept in the cache
+            kwargs: Additional parameters as accepted by calculate_route. Driving routes use optmz=timeWithTraffic
+                unless another optmz is given, so their durations include the predicted traffic
+
+        Returns:
+            list: The DepartureProfile of each pair, in the order given. Departures that could not be routed are NaN in
+                the profile, and the first exception raised for the pair is its error
+        """
+        options = _departure_options(travelMode, kwargs)
+        departures = int((window_end - window_start) // step) + 1
+        unique_pairs, pair_index = _unique([tuple(_waypoint(point) for point in pair) for pair in pairs])
+        durations = [array.array('f', [math.nan]) * departures for _ in unique_pairs]
+        errors = {}
+
+        def route(query):
+            start_location, end_location, departure = query
+            return self._route(start_location, end_location, travelMode, dt=departure.strftime(_departure_format),
+                               tt='Departure', **options)[1]
+
+        # Read lazily by run_concurrently, with the position of the pair and departure encoded in the key
+        queries = ((start_location, end_location, window_start + slot * step)
+                   for start_location, end_location in unique_pairs for slot in range(departures))
+        for index, result, error in concurrency.run_concurrently(route, queries, max_workers,
+                                                                 self._transport.concurrency_limiter):
+            pair, slot = divmod(index, departures)
+            if error is not None:
+                errors.setdefault(pair, error)
+                continue
+            durations[pair][slot] = _to_float(result.duration_traffic if result.duration_traffic is not None
+                                              else result.duration)
+
+        profiles = []
+        for pair, (start_location, end_location) in enumerate(unique_pairs):
+            profile = DepartureProfile(window_start, step, durations[pair], errors.get(pair))
+            cache_key = response_cache.profile_key(start_location, end_location, travelMode, options)
+            self._profiles.set(cache_key, profile, ttl)
+            if self._cache is not None:
+                self._cache.set(cache_key, profile.to_text(), ttl=ttl)
+            profiles.append(profile)
+        return [profiles[position] for position in pair_index]
+
+    def departure_profile(self, start_location, end_location, travelMode, **kwargs):
+        """Returns the DepartureProfile stored by sweep_departures for a route, or None if there is none
+
+        Args:
+            kwargs: The additional parameters the sweep was made with
+        """
+        cache_key = response_cache.profile_key(_waypoint(start_location), _waypoint(end_location), travelMode,
+                                               _departure_options(travelMode, kwargs))
+        profile = self._profiles.get(cache_key)
+        if profile is None and self._cache is not None:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                profile = DepartureProfile.from_text(cached)
+                self._profiles.set(cache_key, profile)
+        return profile
+
+    def departure_duration(self, start_location, end_location, travelMode, departure, **kwargs):
+        """Returns how long a route takes for a departure time
+
+        When a profile from sweep_departures covers the departure, the duration is interpolated from the departures on
+        either side of it. Otherwise one time dependent route is requested.
+
+        Args:
+            start_location (str): The address or (latitude, longitude) pair to start at
+            end_location (str): The address or (latitude, longitude) pair to end at
+            travelMode (str): Specifies the mode of travel for the route. Can be Driving, Transit or Walking.
+            departure (datetime.datetime): The departure time, in the local time of the start location
+            kwargs: Additional parameters as accepted by calculate_route
+
+        Returns:
+            float: The duration in seconds
+        """
+        profile = self.departure_profile(start_location, end_location, travelMode, **kwargs)
+        if profile is not None and profile.covers(departure):
+            duration = profile.duration_at(departure)
+            if not math.isnan(duration):
+                return duration
+        route = self._route(_waypoint(start_location), _waypoint(end_location), travelMode,
+                            dt=departure.strftime(_departure_format), tt='Departure',
+                            **_departure_options(travelMode, kwargs))[1]
+        return _to_float(route.duration_traffic if route.duration_traffic is not None else route.duration)
+
+    def calculate_matrix(self, origins, destinations, travelMode, max_workers=8, **kwargs):
+        """Finds the distance and duration between every origin and every destination
+
+        Repeated origins and destinations are only requested once. When every origin and destination is a
+        (latitude, longitude) pair and no option other than du and dt is given, the matrix is requested from Bing's
+        distance matrix API in as few requests as possible. Otherwise each pair is routed with calculate_routes,
+        max_workers at a time, so every option applies. The distance matrix API has no optimize parameter, so giving
+        optmz routes each pair.
+
+        Args:
+            origins (list): Addresses or (latitude, longitude) pairs to start from
+            destinations (list): Addresses or (latitude, longitude) pairs to end at
+            travelMode (str): The mode of travel. Can be Driving, Transit or Walking.
+            max_workers (int): The maximum number of requests in flight at once
+            kwargs: Additional parameters as accepted by calculate_route
+
+        Returns:
+            RouteMatrix: The distances and durations
+        """
+        unique_origins, origin_index = _unique(origins)
+        unique_destinations, destination_index = _unique(destinations)
+        rows, columns = len(unique_origins), len(unique_destinations)
+        distances, durations = _new_matrix(rows, columns), _new_matrix(rows, columns)
+        errors = {}
+
+        if travelMode.lower() in self.matrix_travel_modes and set(kwargs) <= set(self.matrix_options) and \
+                all(_is_coordinate(point) for point in unique_origins + unique_destinations):
+            self._request_matrix(unique_origins, unique_destinations, travelMode, distances, durations, **kwargs)
+        else:
+            queries = {}
+            for row, origin in enumerate(unique_origins):
+                for column, destination in enumerate(unique_destinations):
+                    if origin == destination:
+                        distances[row][column] = durations[row][column] = 0.0
+                    else:
+                        queries[row, column] = (_waypoint(origin), _waypoint(destination), travelMode, kwargs)
+            for (row, column), route, error in self.calculate_routes(queries, max_workers):
+                if error is not None:
+                    errors[unique_origins[row], unique_destinations[column]] = error
+                    continue
+                distances[row][column] = _to_float(route.distance)
+                durations[row][column] = _to_float(route.duration)
+
+        return RouteMatrix(origins, destinations,
+                           _expand(distances, origin_index, destination_index),
+                           _expand(durations, origin_index, destination_index),
+                           errors)
+
+    def _request_matrix(self, origins, destinations, travelMode, distances, durations, **kwargs):
+        """Fills in distances and durations from the distance matrix API, splitting the origins across requests so
+        that no request holds more than matrix_max_cells pairs"""
+        params = {'key': self._api_key,
+                  'destinations': ';'.join('{0},{1}'.format(*point) for point in destinations),
+                  'travelMode': travelMode.lower(),
+                  'timeUnit': 'second',
+                  'distanceUnit': {'mi': 'mile', 'km': 'kilometer'}.get(kwargs.get('du'), 'kilometer')}
+        if 'dt' in kwargs:
+            params['startTime'] = kwargs['dt']
+        rows_per_request = max(1, self.matrix_max_cells // len(destinations))
+        for first_row in range(0, len(origins), rows_per_request):
+            chunk = origins[first_row:first_row + rows_per_request]
+            params['origins'] = ';'.join('{0},{1}'.format(*point) for point in chunk)
+            results_data = self._events.timed('parse', 'bing', parsing.loads, self._matrix_response(params, kwargs))
+            if results_data.get('statusCode') != 200:
+                raise Exception(results_data.get('statusDescription', 'The request returned a non-success status.'))
+
+            cells = results_data.get('resourceSets', [{}])[0].get('resources', [{}])[0].get('results', [])
+            for cell in cells:
+                row = first_row + cell['originIndex']
+                column = cell['destinationIndex']
+                # Bing reports -1 when no route could be found between the pair
+                distances[row][column] = _to_float(cell.get('travelDistance', -1))
+                durations[row][column] = _to_float(cell.get('travelDuration', -1))
+
+    def _matrix_response(self, params, options):
+        """Returns the body of a distance matrix request, from the cache when it holds one"""
+        cache_key = response_cache.matrix_key(params['origins'], params['destinations'], params['travelMode'],
+                                              {name: value for name, value in params.items()
+                                               if name not in ('key', 'origins', 'destinations', 'travelMode')})
+        if self._cache is not None:
+            cached = self._cache.get(cache_key)
+            self._events.emit('cache', 'bing', hit=cached is not None)
+            if cached is not None:
+                return cached
+
+        response = self._transport.get(self.matrix_api_url, params=params)
+        if self._cache is not None and response.status_code == 200:
+            self._cache.set(cache_key, response.text, ttl=response_cache.route_ttl(options, self._cache_ttls))
+        return response.content
+
+    def _route(self, start_location, end_location, travelMode, via=None, **kwargs):
+        """Requests a route without storing anything on the object, so it can be called from many threads
+
+        Args:
+            via (list): The waypoints between the start and end, as (parameter prefix, address) pairs where the prefix
+                is wp for a stop and vwp for a via waypoint
+
+        Returns:
+            tuple: The raw response and the RouteResult
+        """
+        via = via or []
+        cache_key = response_cache.route_key(start_location, end_location, travelMode, kwargs, via)
+        found = self._lookup(cache_key)
+        if found is not None:
+            return found
+        # Threads requesting the same route at the same time share one request
+        return self._flights.do(cache_key, self._fetch, cache_key, start_location, end_location, travelMode, via,
+                                kwargs)
+
+    def _fetch(self, cache_key, start_location, end_location, travelMode, via, options):
+        """Requests a route from Bing and caches it
+
+        Returns:
+            tuple: The raw response and the RouteResult
+        """
+        search_api_url = self.route_api_url.format(travelMode = travelMode)
+        params = self._route_params(start_location, end_location, via, options)
+        response = self._transport.get(search_api_url, params=params)
+        result = self._parse(response.content, response.status_code)
+        self._store(cache_key, response.text, options)
+        return response, result
+
+    def _route_params(self, start_location, end_location, via, options):
         params = {'key': self._api_key, 
                   'wp.0':start_location, 
-                  'wp.1':end_location
+                  'wp.{0}'.format(len(via) + 1):end_location
                   }
-        if kwargs:
-            params.update(**kwargs)
-            
-        self._response = self._session.get(search_api_url, params=params)
-        
-        #Parse Results
-        results_data = json.loads(self._response.text)
+        # Waypoints and via waypoints share one numbering, in the order they are travelled through
+        for position, (prefix, waypoint) in enumerate(via, 1):
+            params['{0}.{1}'.format(prefix, position)] = waypoint
+        if options:
+            params.update(**options)
+        return params
+
+    def _lookup(self, cache_key):
+        """Returns the raw response and RouteResult for a cached route, or None if the route is not cached"""
+        if self._cache is not None:
+            cached = self._cache.get(cache_key)
+            self._events.emit('cache', 'bing', hit=cached is not None)
+            if cached is not None:
+                return response_cache.CachedResponse(cached), self._parse(cached)
+        return None
+
+    def _store(self, cache_key, text, options):
+        if self._cache is not None:
+            self._cache.set(cache_key, text, ttl=response_cache.route_ttl(options, self._cache_ttls))
+        if self._archive is not None:
+            self._archive.append('route', cache_key, text)
+
+    def _parse(self, raw, status_code=200):
+        """Parses the body of a Routes response into a RouteResult
+
+        In lazy mode a response with a success status is not parsed until the route is first used. Bing sends the same
+        status in the HTTP response as in the body.
+
+        Raises:
+            Exception: If the response has a non-success status
+        """
+        if self._lazy and status_code == 200:
+            return RouteResult(parsing.LazyJSON(raw), keep_response=self._keep_response)
+
+        results_data = self._events.timed('parse', 'bing', parsing.loads, raw)
         if results_data.get('statusCode') != 200:
             raise Exception(results_data.get('statusDescription', 'The request returned a non-success status.'))
     
-        self.route = RouteResult(results_data)
+        return self._events.timed('build', 'bing', RouteResult, results_data, keep_response=self._keep_response)
 
 
 class Geocoder:
     """An object for searching for companies using Bing's custom search engine API
 
+    search and reverse store their result on the object, so an object used through them belongs to one thread. geocode,
+    reverse_geocode, search_concurrently and reverse_many store nothing, so one object can serve any number of threads.
+
     Attributes:
     """
-    def __init__(self, api_key):
+    search_api_url = 'http://dev.virtualearth.net/REST/v1/Locations'
+    reverse_api_url = 'http://dev.virtualearth.net/REST/v1/Locations/{latitude},{longitude}'
+
+    def __init__(self, api_key, pool_size=10, cache=None, lazy=False, keep_response=True, rate_limiter=None,
+                 max_retries=3, concurrency_limiter=None, local_index=None, spatial_index=None, events=None,
+                 single_flight=None, session=None, archive=None):
         """The constructor for the address geocoder utilizing bing
 
         Args:
             api_key (str): The secret key for accessing the api
-            api_app_key (str): The id for the custom search engine
+            pool_size (int): The number of keep-alive connections to hold open for concurrent requests. Not used when
+                a session is given
+            cache (obj): A cache such as cache.SQLiteCache that is checked before any request is sent
+            lazy (bool): Defer parsing each response until a field of its result is first read
+            keep_response (bool): Keep the whole location resource on each result. When False, results only keep the
+                fields of the resource they read
+            rate_limiter (obj): A ratelimit.RateLimiter. Requests are counted against the bing key
+            max_retries (int): The number of times a throttled or failed request is retried with backoff
+            concurrency_limiter (obj): A ratelimit.AdaptiveConcurrency that sets how many concurrent requests are in
+                flight from the latency and errors seen
+            local_index (obj): A localindex.LocalIndex that answers searches for confidently resolved addresses without
+                a request, and that every new confident result is added to
+            spatial_index (obj): A spatial.SpatialIndex that answers reverse searches for coordinates close to an
+                already geocoded address without a request, and that every new result is added to
+            events (obj): An instrumentation.EventEmitter that requests, cache lookups and parsing are reported to.
+                Defaults to instrumentation.events
+            single_flight (obj): A singleflight.SingleFlight through which concurrent identical requests share one
+                request. Pass the same one to several provider objects to share requests between them. Each object
+                makes its own when None
+            session (requests.Session): The session to send requests with, such as concurrency.shared_session() to
+                share one connection pool between every provider object. A new session is made when None
+            archive (obj): An archive.Archive that every response fetched from the provider is appended to
         """
-        self._session = requests.session()
+        self._session = concurrency.make_session(pool_size) if session is None else session
+        self._transport = transport.Transport(self._session, 'bing', rate_limiter, max_retries, concurrency_limiter,
+                                              events=events)
+        self._events = self._transport.events
+        self._flights = singleflight.SingleFlight() if single_flight is None else single_flight
         self._response = None
         self._api_key = api_key
+        self._cache = cache
+        self._lazy = lazy
+        self._keep_response = keep_response
+        self._local_index = local_index
+        self._spatial_index = spatial_index
+        self._archive = archive
         self.address = None
         self.result = None
 
@@ -90,31 +562,214 @@ class Geocoder:
             address (str): The address to search for
         Raises:
             Exception: If an invalid Bing key is provided
+            ratelimit.RateLimitError: If Bing is still throttling the request after every retry
         """
         self.address = address
+        self._response, self.result = self._search(address)
+
+    def geocode(self, address, return_response=False):
+        """Searches for an address without storing anything on the object, so one object can be shared by many threads
+
+        Args:
+            address (str): The address to search for
+            return_response (bool): Also return the raw response. It is None for a result from the local index and a
+                cache.CachedResponse for a result from the cache
+
+        Returns:
+            AddressResult: The result, or a tuple of the result and the raw response when return_response is True
+        """
+        response, result = self._search(address)
+        return (result, response) if return_response else result
+
+    def search_concurrently(self, addresses, max_workers=8):
+        """Searches for many addresses concurrently, yielding each result as soon as it is returned
+
+        Args:
+            addresses (dict or iterable): The addresses to search for. For a dict, the keys are used to tag the results,
+                otherwise the position of the address is used.
+            max_workers (int): The maximum number of requests in flight at once
+
+        Yields:
+            tuple: (key, AddressResult, error) where error is the exception raised for the address or None
+        """
+        return concurrency.run_concurrently(lambda address: self._search(address)[1], addresses, max_workers,
+                                            self._transport.concurrency_limiter)
+
+    def _search(self, address):
+        """Searches for an address without storing anything on the object, so it can be called from many threads
 
+        Returns:
+            tuple: The raw response and the AddressResult
+        """
+        found = self._lookup(address)
+        if found is not None:
+            return found
+        # Threads searching for the same address at the same time share one request
+        return self._flights.do(response_cache.geocode_key('bing', address), self._fetch, address)
+
+    def _fetch(self, address):
+        """Requests an address from the provider and stores the result
+
+        Returns:
+            tuple: The raw response and the AddressResult
+        """
         # Conduct search
-        # search_api_url = 'http://open.mapquestapi.com/geocoding/v1/address'
-        search_api_url = 'http://dev.virtualearth.net/REST/v1/Locations'
-        params = {'key': self._api_key, 'q': self.address}
-        self._response = self._session.get(search_api_url, params=params)
+        params = {'key': self._api_key, 'q': address}
+        response = self._transport.get(self.search_api_url, params=params)
+        result = self._parse(response.content, response.status_code)
+        self._store(address, response.text, result)
+        return response, result
+
+    def _lookup(self, address):
+        """Looks an address up in the local index and then the cache
+
+        Returns:
+            tuple: The raw response, or None if the result came from the local index, and the AddressResult. None if
+                the address was not found
+        """
+        if self._local_index is not None:
+            indexed = self._local_index.lookup('bing', address)
+            if indexed is not None:
+                return None, indexed
+
+        if self._cache is not None:
+            cached = self._cache.get(response_cache.geocode_key('bing', address))
+            self._events.emit('cache', 'bing', hit=cached is not None)
+            if cached is not None:
+                return response_cache.CachedResponse(cached), self._parse(cached)
+        return None
+
+    def _store(self, address, text, result):
+        """Adds a result fetched from the provider to the cache, archive, local index and spatial index"""
+        if self._cache is not None:
+            self._cache.set(response_cache.geocode_key('bing', address), text)
+        if self._archive is not None:
+            self._archive.append('bing', response_cache.geocode_key('bing', address), text)
+        if self._local_index is not None:
+            self._local_index.add('bing', address, result)
+        if self._spatial_index is not None:
+            self._spatial_index.add(result)
+
+    def reverse(self, latitude, longitude):
+        """Searches for the address at a coordinate
+
+        Args:
+            latitude (float): The latitude
+            longitude (float): The longitude
+
+        Raises:
+            Exception: If the response has a non-success status
+        """
+        self.address = '{0},{1}'.format(latitude, longitude)
+        self._response, self.result = self._reverse(latitude, longitude)
 
+    def reverse_geocode(self, latitude, longitude, return_response=False):
+        """Searches for the address at a coordinate without storing anything on the object
+
+        Returns:
+            AddressResult: The result, or a tuple of the result and the raw response when return_response is True. The
+                raw response is None for a result from the spatial index
+        """
+        response, result = self._reverse(latitude, longitude)
+        return (result, response) if return_response else result
 
-        # Parse results
-        results_data = json.loads(self._response.text)
+    def reverse_many(self, latitudes, longitudes, max_workers=8):
+        """Searches for the address at each of many coordinates
+
+        Coordinates close enough to an address in the spatial index are answered from the index. The rest are
+        requested concurrently.
+
+        Args:
+            latitudes (array-like): The latitudes
+            longitudes (array-like): The longitudes
+            max_workers (int): The maximum number of requests in flight at once
+
+        Returns:
+            list: The AddressResult for each coordinate in input order, or the exception raised for it
+        """
+        latitudes, longitudes = list(latitudes), list(longitudes)
+        results = [None] * len(latitudes)
+        if self._spatial_index is not None and latitudes:
+            positions, _ = self._spatial_index.nearest_many(latitudes, longitudes)
+            for index, position in enumerate(positions):
+                if position >= 0:
+                    results[index] = self._spatial_index.results[position]
+
+        misses = {index: (latitudes[index], longitudes[index])
+                  for index, result in enumerate(results) if result is None}
+        for index, result, error in concurrency.run_concurrently(lambda point: self._reverse(*point)[1], misses,
+                                                                 max_workers, self._transport.concurrency_limiter):
+            results[index] = result if error is None else error
+        return results
+
+    def _reverse(self, latitude, longitude):
+        """Searches for the address at a coordinate without storing anything on the object
+
+        Returns:
+            tuple: The raw response, or None if the result came from the spatial index, and the AddressResult
+        """
+        if self._spatial_index is not None:
+            nearest = self._spatial_index.nearest(latitude, longitude)
+            if nearest is not None:
+                return None, nearest[0]
+
+        params = {'key': self._api_key}
+        response = self._transport.get(self.reverse_api_url.format(latitude=latitude, longitude=longitude),
+                                       params=params)
+        result = self._parse(response.content, response.status_code)
+        if self._spatial_index is not None:
+            self._spatial_index.add(result)
+        return response, result
+
+    def _parse(self, raw, status_code=200):
+        """Parses the body of a Locations response into an AddressResult
+
+        In lazy mode a response with a success status is not parsed until the result is first used. Only the first
+        location is kept once the response is parsed.
+
+        Raises:
+            Exception: If the response has a non-success status
+        """
+        if self._lazy and status_code == 200:
+            keep = None if self._keep_response else AddressResult.fields
+            return AddressResult(parsing.LazyJSON(raw, ('resourceSets', 0, 'resources', 0), keep))
+
+        results_data = self._events.timed('parse', 'bing', parsing.loads, raw)
         if results_data.get('statusCode') != 200:
             raise Exception(results_data.get('statusDescription', 'The request returned a non-success status.'))
 
-        self.result = AddressResult(results_data.get('resourceSets', [{}])[0].get('resources', [{}])[0])
+        return self._events.timed('build', 'bing', AddressResult,
+                                  results_data.get('resourceSets', [{}])[0].get('resources', [{}])[0],
+                                  self._keep_response)
 
     def write_results(self, write_path):
         """Writes the json response of the google search to a text file
 
+        A result answered by the local index or the spatial index has no response, so a response holding only its
+        location resource is written instead.
+
         Args:
-            The path to write the file to
+            write_path (str): The path to write the file to. An archive.Archive can be given instead, which the
+                response is appended to under the cache key of the address
+
+        Raises:
+            ValueError: If nothing has been searched for yet
         """
+        text = self._response_text()
+        if hasattr(write_path, 'append'):
+            write_path.append('bing', response_cache.geocode_key('bing', self.address), text)
+            return
         with open(write_path + '.json', 'w') as f:
-            f.write(self._response.text)
+            f.write(text)
+
+    def _response_text(self):
+        if self._response is not None:
+            return self._response.text
+        if self.result is None:
+            raise ValueError('There is no response to write. Call search or reverse first')
+        resource = self.result._response
+        resource = resource.data if isinstance(resource, parsing.LazyJSON) else resource
+        return json.dumps({'statusCode': 200, 'resourceSets': [{'estimatedTotal': 1, 'resources': [resource]}]})
 
 
 class RouteResult:
@@ -131,11 +786,30 @@ class RouteResult:
         start_location (obj): The address that bing utilized as the start address as an AddressObject
         end_location (obj): The address that bing utilized as the end address as an AddressObject
         print_instructions (str): A step by step print out of instructions to travel the route
+        instructions_csv (str): The steps of the route as CSV
+        instructions_json (str): The steps of the route as a JSON list
+        leg_count (int): The number of legs, which is one less than the number of waypoints
 
     """
-    def __init__(self, response):
+    def __init__(self, response, keep_response=True):
+        """The constructor for the route result
+
+        Args:
+            response (dict): The parsed response, or a parsing.LazyJSON holding the unparsed response
+            keep_response (bool): Keep the whole response. When False, only the route resources are kept once read
+        """
         self._response = response
-        self._results = self._response.get('resourceSets', [{}])[0].get('resources', [{}])
+        self._keep_response = keep_response
+        if not keep_response and not isinstance(response, parsing.LazyJSON):
+            # Read the routes now so the rest of the response can be released
+            self._results
+
+    @functools.cached_property
+    def _results(self):
+        results = self._response.get('resourceSets', [{}])[0].get('resources', [{}])
+        if not self._keep_response:
+            self._response = None
+        return results
         
     @property
     def distance_unit(self):
@@ -163,24 +837,201 @@ class RouteResult:
     
     @property
     def start_location(self):
-        return AddressResult(self._results[0].get('routeLegs', [{}])[0].get('endLocation', {}))
+        return AddressResult((self._results[0].get('routeLegs') or [{}])[0].get('startLocation', {}))
         
     @property
     def end_location(self):
-        return AddressResult(self._results[0].get('routeLegs', [{}])[0].get('startLocation', {}))
+        return AddressResult((self._results[0].get('routeLegs') or [{}])[-1].get('endLocation', {}))
         
     @property
-    def print_instructions(self):
-        all_instructions = ''
-        
+    def leg_count(self):
+        return len(self._results[0].get('routeLegs', []))
+
+    def steps(self, leg=None):
+        """Yields the steps of the route in order, reading each from the response only as it is reached
+
+        Args:
+            leg (int): Only yield the steps of this leg. Every leg is yielded when None
+
+        Yields:
+            RouteStep: A step of the route
+        """
         #Each segement between two waypoints requested is considered a route leg
-        for routeLeg in self._results[0].get('routeLegs', [{}]):
+        route_legs = self._results[0].get('routeLegs', [])
+        legs = enumerate(route_legs) if leg is None else [(leg, route_legs[leg])]
+        for leg_index, route_leg in legs:
             #each route leg has multiple steps
-            for direction in routeLeg.get('itineraryItems',[{}]):
-                all_instructions += "(" + str(direction.get('travelDistance',{})) + ") "
-                all_instructions += direction.get('instruction',{}).get('text') + '\n'
-        
-        return all_instructions
+            for item in route_leg.get('itineraryItems', []):
+                instruction = item.get('instruction') or {}
+                point = (item.get('maneuverPoint') or {}).get('coordinates')
+                yield RouteStep(leg_index, item.get('travelDistance'), item.get('travelDuration'),
+                                instruction.get('maneuverType'), instruction.get('text') or '',
+                                tuple(point) if point else None)
+
+    @functools.cached_property
+    def print_instructions(self):
+        return ''.join('({0}) {1}\n'.format('' if step.distance is None else step.distance, step.text)
+                       for step in self.steps())
+
+    @functools.cached_property
+    def instructions_csv(self):
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(['leg', 'distance', 'duration', 'maneuver', 'text', 'latitude', 'longitude'])
+        writer.writerows([step.leg, step.distance, step.duration, step.maneuver, step.text,
+                          *(step.coordinates or (None, None))] for step in self.steps())
+        return output.getvalue()
+
+    @functools.cached_property
+    def instructions_json(self):
+        return json.dumps([step._asdict() for step in self.steps()])
+
+
+class RouteMatrix:
+    """The distances and durations between a list of origins and a list of destinations
+
+    When NumPy is installed the matrices are float arrays of shape (len(origins), len(destinations)), otherwise they
+    are lists holding an array of floats for each origin. Either way matrix[i][j] is the value from origins[i] to
+    destinations[j]. Pairs without a route are NaN.
+
+    Attributes:
+        origins (list): The origins, in the order given
+        destinations (list): The destinations, in the order given
+        distances (obj): The distance of each route, in the unit requested (km by default)
+        durations (obj): The duration of each route in seconds
+        errors (dict): The exception raised for each (origin, destination) pair that could not be routed
+    """
+    def __init__(self, origins, destinations, distances, durations, errors=None):
+        self.origins = list(origins)
+        self.destinations = list(destinations)
+        self.distances = distances
+        self.durations = durations
+        self.errors = errors or {}
+
+    def distance(self, origin, destination):
+        """Returns the distance from an origin to a destination"""
+        return self.distances[self.origins.index(origin)][self.destinations.index(destination)]
+
+    def duration(self, origin, destination):
+        """Returns the duration from an origin to a destination"""
+        return self.durations[self.origins.index(origin)][self.destinations.index(destination)]
+
+
+def _unique(points):
+    """Returns the unique points in order of first appearance and the position of each input point in that list"""
+    positions = {}
+    unique = []
+    index = []
+    for point in points:
+        key = tuple(point) if isinstance(point, list) else point
+        if key not in positions:
+            positions[key] = len(unique)
+            unique.append(key)
+        index.append(positions[key])
+    return unique, index
+
+
+def _is_coordinate(point):
+    return isinstance(point, tuple) and len(point) == 2 and all(isinstance(value, (int, float)) for value in point)
+
+
+def _waypoint(point):
+    """Formats a point as a route waypoint. Coordinates are written as latitude,longitude"""
+    return '{0},{1}'.format(*point) if _is_coordinate(point) else point
+
+
+def _to_float(value):
+    if value is None or value == -1:
+        return math.nan
+    return float(value)
+
+
+def _departure_options(travelMode, options):
+    """Returns the route parameters for a time dependent route, without dt and tt"""
+    options = {name: value for name, value in options.items() if name not in ('dt', 'tt')}
+    if travelMode.lower() == 'driving' and 'optmz' not in options and 'optimize' not in options:
+        options['optmz'] = 'timeWithTraffic'
+    return options
+
+
+def _new_matrix(rows, columns):
+    if numpy is not None:
+        return numpy.full((rows, columns), numpy.nan)
+    return [array.array('d', [math.nan]) * columns for _ in range(rows)]
+
+
+def _expand(matrix, row_index, column_index):
+    """Builds the full matrix from the matrix of unique points"""
+    if numpy is not None:
+        return matrix[numpy.ix_(row_index, column_index)]
+    return [array.array('d', (matrix[row][column] for column in column_index)) for row in row_index]
+
+
+class DepartureProfile:
+    """The duration of a route for departures at regular times
+
+    The durations are held in an array of 32 bit floats, so a day of departures 15 minutes apart takes 384 bytes.
+
+    Attributes:
+        start (datetime.datetime): The first departure
+        step (datetime.timedelta): The time between departures
+        durations (array.array): The duration in seconds for each departure. NaN where the route could not be found
+        error (Exception): The first exception raised while sweeping the route, or None
+    """
+    def __init__(self, start, step, durations, error=None):
+        self.start = start
+        self.step = step
+        self.durations = durations
+        self.error = error
+
+    @property
+    def end(self):
+        """The last departure"""
+        return self.start + (len(self.durations) - 1) * self.step
+
+    def departures(self):
+        """Returns the departure time of each duration"""
+        return [self.start + slot * self.step for slot in range(len(self.durations))]
+
+    def covers(self, departure):
+        return self.start <= departure <= self.end
+
+    def duration_at(self, departure):
+        """Returns the duration for a departure inside the profile, interpolated linearly between the departures on
+        either side of it
+
+        Raises:
+            ValueError: If the departure is before the first or after the last departure of the profile
+        """
+        if not self.covers(departure):
+            raise ValueError('{0} is outside the profile from {1} to {2}'.format(departure, self.start, self.end))
+        slot, fraction = divmod((departure - self.start) / self.step, 1)
+        slot = int(slot)
+        if not fraction:
+            return float(self.durations[slot])
+        before, after = self.durations[slot], self.durations[slot + 1]
+        return before + (after - before) * fraction
+
+    def to_text(self):
+        """Returns the profile as JSON text for storing in a cache"""
+        durations = array.array('f', self.durations)
+        if sys.byteorder == 'big':
+            durations.byteswap()
+        return json.dumps({'start': self.start.isoformat(), 'step': self.step.total_seconds(),
+                           'durations': base64.b64encode(durations.tobytes()).decode('ascii')})
+
+    @classmethod
+    def from_text(cls, text):
+        """Rebuilds a profile from the text made by to_text"""
+        data = json.loads(text)
+        durations = array.array('f', base64.b64decode(data['durations']))
+        if sys.byteorder == 'big':
+            durations.byteswap()
+        return cls(datetime.datetime.fromisoformat(data['start']), datetime.timedelta(seconds=data['step']), durations)
+
+    def __len__(self):
+        return len(self.durations)
+
 
 class AddressResult:
     """An address object
@@ -196,12 +1047,31 @@ class AddressResult:
         longitude (str): The longitude of the address
         geocode_quality (str): The quality of the result found
         geocode_quality_code (str): The quality of the result found
+        quality_score (float): A score from 0 to 1 for how precise and certain the match is, from the confidence and
+            match codes
         side_of_street (str): which side of the street the result is on
     """
-    def __init__(self, response):
+    # The fields of the location resource a result reads
+    fields = ('address', 'geocodePoints', 'confidence', 'matchCodes')
+
+    def __init__(self, response, keep_response=True):
+        """The constructor for the address result
+
+        Args:
+            response (dict): The location resource, or a parsing.LazyJSON holding the unparsed response
+            keep_response (bool): Keep the whole resource. When False, only the fields in fields are kept
+        """
+        if not keep_response and isinstance(response, dict):
+            response = {name: response[name] for name in self.fields if name in response}
         self._response = response
-        self._location = response.get('address', {})
-        self._coordinates = response.get('geocodePoints', [{}])[0].get('coordinates', [None, None])
+
+    @functools.cached_property
+    def _location(self):
+        return self._response.get('address', {})
+
+    @functools.cached_property
+    def _coordinates(self):
+        return self._response.get('geocodePoints', [{}])[0].get('coordinates', [None, None])
 
     @property
     def street_address(self):
@@ -247,6 +1117,15 @@ class AddressResult:
     def geocode_quality_code(self):
         return str(self._response.get('matchCodes', str([])))
 
+    @property
+    def quality_score(self):
+        if self.latitude is None:
+            return 0.0
+        score = confidence_scores.get(self.geocode_quality, 0.0)
+        for match_code in self._response.get('matchCodes', []):
+            score *= match_code_factors.get(match_code, 1.0)
+        return score
+
     def __str__(self):
         return self._location.get('formattedAddress')
 
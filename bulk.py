@@ -0,0 +1,293 @@
+"""A command line pipeline for geocoding a CSV or JSON lines file of addresses
+
+Addresses are read, geocoded and written a chunk at a time, so memory use does not grow with the size of the input.
+After each chunk is written a checkpoint file is saved next to the output. If the run stops part way, running the same
+command again picks up after the last checkpoint instead of geocoding the finished rows again.
+
+The checkpoint holds the byte offset in the input after the last finished row, so a resumed run seeks straight to the
+next row instead of reading every finished row again. A JSON line that is not valid JSON is written with an error
+instead of stopping the run.
+
+Each chunk is normalized with normalize.prepare_queries before anything is sent. Spellings of the same address are sent
+once, and empty or placeholder rows are written with an error instead of being sent. Unit numbers after the street are
+removed from what is sent, so every unit of a building shares one request and one cache key, which is the key of the
+address without its unit. Without pandas each address is normalized with normalize.normalize_address instead, which
+keeps unit numbers, and only missing, empty and placeholder rows are held back.
+
+Example:
+    python bulk.py addresses.csv geocoded.csv --provider bing --column address
+"""
+import argparse
+import csv
+import json
+import os
+import Geocoder
+import bing
+import cache
+import normalize
+import singleflight
+
+output_fields = ['row', 'address', 'street_address', 'city', 'county', 'state', 'country', 'latitude', 'longitude',
+                 'geocode_quality_code', 'error']
+
+
+class UnreadableRow(str):
+    """Stands in for the address of an input row that could not be read
+
+    It is an empty string, so it is never sent to a provider, and geocode_chunk writes its error for the row.
+
+    Attributes:
+        error (str): Why the row could not be read
+    """
+    def __new__(cls, error):
+        row = super().__new__(cls, '')
+        row.error = error
+        return row
+
+
+def read_addresses(path, column='address', file_format=None):
+    """Reads addresses from a CSV or JSON lines file one row at a time
+
+    Args:
+        path (str): The path to the input file
+        column (str): The CSV column or JSON key holding the address. A JSON line holding a plain string is used as is.
+        file_format (str): csv or jsonl. Defaults to the file extension
+
+    Yields:
+        tuple: The row number, counting from 0, and the address. The address of a JSON line that is not valid JSON is
+            an UnreadableRow
+    """
+    for row_number, address, _ in read_rows(path, column, file_format):
+        yield row_number, address
+
+
+def read_rows(path, column='address', file_format=None, offset=0, row_number=0):
+    """Reads addresses like read_addresses, starting from a byte offset into the file
+
+    Args:
+        path (str): The path to the input file
+        column (str): The CSV column or JSON key holding the address
+        file_format (str): csv or jsonl. Defaults to the file extension
+        offset (int): The byte offset to start reading at, as yielded with an earlier row. 0 starts at the first row
+        row_number (int): The row number of the row at offset
+
+    Yields:
+        tuple: The row number, the address and the byte offset just after the row
+    """
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+    with open(path, 'rb') as f:
+        position = 0
+
+        def lines():
+            nonlocal position
+            for line in f:
+                position += len(line)
+                yield line.decode('utf-8')
+
+        if file_format == 'csv':
+            # The csv module reads one record at a time, so position is just after the row it last returned
+            reader = csv.reader(lines())
+            header = next(reader, [])
+            index = header.index(column) if column in header else None
+            if offset > position:
+                f.seek(offset)
+                position = offset
+            for row in reader:
+                if not row:
+                    continue
+                address = row[index] if index is not None and index < len(row) else ''
+                yield row_number, address, position
+                row_number += 1
+        else:
+            f.seek(offset)
+            position = offset
+            for line in lines():
+                if not line.strip():
+                    address = ''
+                else:
+                    try:
+                        record = json.loads(line)
+                    except ValueError as e:
+                        address = UnreadableRow('Line {0} is not valid JSON: {1}'.format(row_number + 1, e))
+                    else:
+                        address = (record.get(column) or '') if isinstance(record, dict) else str(record)
+                yield row_number, address, position
+                row_number += 1
+
+
+def chunks(rows, chunk_size):
+    """Groups an iterable into lists of at most chunk_size items"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def prepare_queries(addresses):
+    """Returns the distinct queries of a chunk of addresses, with normalize.prepare_queries when pandas is installed
+
+    Without pandas each address is normalized with normalize.normalize_address and duplicates are removed with
+    singleflight.collapse. Only missing, empty and placeholder addresses are rejected.
+
+    Returns:
+        tuple: The distinct queries, the position of the query of each address or -1 if it was rejected, and why each
+            address was rejected or None
+    """
+    try:
+        prepared = normalize.prepare_queries(addresses)
+    except ImportError:
+        pass
+    else:
+        return prepared.queries, prepared.inverse.tolist(), prepared.reasons.tolist()
+
+    reasons = []
+    for address in addresses:
+        normalized = '' if address is None else normalize.normalize_address(address)
+        reasons.append('missing' if address is None else 'empty' if not normalized else
+                       'placeholder' if normalized in normalize.placeholder_values else None)
+    accepted = [position for position, reason in enumerate(reasons) if reason is None]
+    queries, positions = singleflight.collapse(normalize.normalize_address(addresses[position])
+                                               for position in accepted)
+    inverse = [-1] * len(addresses)
+    for position, query in zip(accepted, positions):
+        inverse[position] = query
+    return queries, inverse, reasons
+
+
+def geocode_chunk(geocoder, rows, max_workers=8):
+    """Geocodes a chunk of rows with either provider
+
+    Args:
+        geocoder (obj): A Geocoder.Geocoder or a bing.Geocoder
+        rows (list): (row number, address) tuples
+        max_workers (int): The maximum number of requests in flight for providers that are searched concurrently
+
+    Returns:
+        list: (row number, address, AddressResult or None, error message or None) tuples in input order. Rows that are
+            empty, not an address or could not be read are not sent, and get an error saying why
+    """
+    # Each distinct normalized address is only geocoded once, and its result is given to every row that holds it
+    addresses, inverse, reasons = prepare_queries([address for _, address in rows])
+    if isinstance(geocoder, Geocoder.Geocoder):
+        results = [(result, result.error) for result in geocoder.search_many(addresses)]
+    else:
+        results = [None] * len(addresses)
+        for index, result, error in geocoder.search_concurrently(addresses, max_workers):
+            results[index] = (result, None if error is None else str(error))
+    chunk = []
+    for (row_number, address), position, reason in zip(rows, inverse, reasons):
+        if isinstance(address, UnreadableRow):
+            chunk.append((row_number, address, None, 'Not read: ' + address.error))
+        elif position < 0:
+            chunk.append((row_number, address, None, 'Not sent: ' + reason))
+        else:
+            chunk.append((row_number, address) + results[position])
+    return chunk
+
+
+def to_record(row_number, address, result, error):
+    """Flattens a geocoded row into a dict with the output_fields"""
+    record = {'row': row_number, 'address': address, 'error': error}
+    if result is not None and error is None:
+        for field in output_fields[2:-1]:
+            record[field] = getattr(result, field)
+    return record
+
+
+def load_checkpoint(checkpoint_path):
+    """Returns the saved checkpoint, or a checkpoint at the start of the input if there is none"""
+    if not os.path.exists(checkpoint_path):
+        return {'rows_done': 0, 'output_bytes': 0, 'input_offset': 0}
+    with open(checkpoint_path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    """Saves the checkpoint by writing a temporary file and renaming it, so a crash never leaves a partial file"""
+    temporary_path = checkpoint_path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temporary_path, checkpoint_path)
+
+
+def run(geocoder, input_path, output_path, column='address', file_format=None, chunk_size=100, max_workers=8,
+        resume=True):
+    """Geocodes every address in the input file and writes the results as CSV
+
+    Args:
+        geocoder (obj): A Geocoder.Geocoder or a bing.Geocoder
+        input_path (str): The CSV or JSON lines file to read
+        output_path (str): The CSV file to write
+        column (str): The CSV column or JSON key holding the address
+        file_format (str): csv or jsonl. Defaults to the input file extension
+        chunk_size (int): The number of rows geocoded between checkpoints
+        max_workers (int): The maximum number of requests in flight for providers that are searched concurrently
+        resume (bool): Continue from the checkpoint of an earlier run instead of starting over
+
+    Returns:
+        int: The number of rows geocoded by this run
+    """
+    checkpoint_path = output_path + '.checkpoint'
+    checkpoint = load_checkpoint(checkpoint_path) if resume else {'rows_done': 0, 'output_bytes': 0, 'input_offset': 0}
+    rows_done = checkpoint['rows_done']
+
+    with open(output_path, 'a+' if rows_done else 'w', newline='', encoding='utf-8') as f:
+        # Drop anything written after the last checkpoint so those rows are not duplicated
+        f.truncate(checkpoint['output_bytes'])
+        f.seek(checkpoint['output_bytes'])
+        writer = csv.DictWriter(f, fieldnames=output_fields)
+        if not rows_done:
+            writer.writeheader()
+
+        if 'input_offset' in checkpoint:
+            rows = read_rows(input_path, column, file_format, checkpoint['input_offset'], rows_done)
+        else:
+            # A checkpoint saved without an input offset, so the finished rows are read and skipped
+            rows = (row for row in read_rows(input_path, column, file_format) if row[0] >= rows_done)
+        geocoded = 0
+        for chunk in chunks(rows, chunk_size):
+            for row in geocode_chunk(geocoder, [(row_number, address) for row_number, address, _ in chunk],
+                                     max_workers):
+                writer.writerow(to_record(*row))
+            f.flush()
+            os.fsync(f.fileno())
+            geocoded += len(chunk)
+            save_checkpoint(checkpoint_path, {'rows_done': chunk[-1][0] + 1, 'output_bytes': f.tell(),
+                                              'input_offset': chunk[-1][2]})
+
+    return geocoded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Geocode a CSV or JSON lines file of addresses')
+    parser.add_argument('input', help='The CSV or JSON lines file of addresses')
+    parser.add_argument('output', help='The CSV file to write the results to')
+    parser.add_argument('--provider', choices=['mapquest', 'bing'], default='mapquest')
+    parser.add_argument('--key', help='The api key. Read from MAPQUEST_KEY or BING_KEY if not given')
+    parser.add_argument('--column', default='address', help='The column or key holding the address')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='The input format. Defaults to the file extension')
+    parser.add_argument('--chunk-size', type=int, default=100, help='The number of rows between checkpoints')
+    parser.add_argument('--workers', type=int, default=8, help='The maximum number of requests in flight')
+    parser.add_argument('--cache', help='The path of a SQLite file to cache responses in')
+    parser.add_argument('--restart', action='store_true', help='Ignore any checkpoint and start from the first row')
+    args = parser.parse_args(argv)
+
+    api_key = args.key or os.environ.get('MAPQUEST_KEY' if args.provider == 'mapquest' else 'BING_KEY') or \
+        input('Enter the {0} api key: '.format(args.provider))
+    response_cache = cache.SQLiteCache(args.cache) if args.cache else None
+    if args.provider == 'mapquest':
+        geocoder = Geocoder.Geocoder(api_key, cache=response_cache)
+    else:
+        geocoder = bing.Geocoder(api_key, pool_size=args.workers, cache=response_cache)
+
+    geocoded = run(geocoder, args.input, args.output, args.column, args.format, args.chunk_size, args.workers,
+                   resume=not args.restart)
+    print('Geocoded {0} rows'.format(geocoded))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+"""A module for caching provider responses so repeated lookups do not go back to the network
+
+Any object with get(key) and set(key, value) methods can be passed to a provider as its cache. A delete(key) method is
+optional, and is used to drop entries that can no longer be parsed. Two stores are
+provided: MemoryCache keeps entries in process, and SQLiteCache keeps entries in a file so they survive between runs.
+Both expire entries after a time to live and evict the least recently used entries once max_entries is reached.
+TieredCache puts a MemoryCache in front of a persistent store.
+
+Attributes:
+    route_ttls (dict):
+        The default number of seconds a route lives in the cache for each value of the optmz option. Routes that use
+        live traffic go stale quickly, while distance and time routes only change when the road network does. The None
+        entry is used when optmz is not given or is not listed.
+"""
+import collections
+import json
+import sqlite3
+import threading
+import time
+import normalize
+
+
+def geocode_key(provider, address):
+    """Builds the cache key for an address search
+
+    Args:
+        provider (str): The name of the provider. Example: bing
+        address (str): The address searched for
+
+    Returns:
+        str: The cache key
+    """
+    return provider + ':' + normalize.normalize_address(address)
+
+
+route_ttls = {
+    'timeWithTraffic': 15 * 60,
+    'timeAvoidClosure': 60 * 60,
+    'time': 7 * 24 * 60 * 60,
+    'distance': 30 * 24 * 60 * 60,
+    None: 7 * 24 * 60 * 60,
+}
+
+
+def route_key(start_location, end_location, travelMode, options, waypoints=()):
+    """Builds the cache key for a route
+
+    The waypoints are normalized, and the additional options are sorted by name so the order they were passed in does
+    not matter.
+
+    Args:
+        start_location (str): The address of the location to start at
+        end_location (str): The address of the location to end at
+        travelMode (str): The mode of travel
+        options (dict): The additional parameters sent with the route request
+        waypoints (list): The (parameter prefix, address) of each waypoint between the start and end. Example:
+            [('wp', '1 Main St'), ('vwp', '5 Oak Ave')]
+
+    Returns:
+        str: The cache key
+    """
+    canonical_options = sorted((str(name), str(value)) for name, value in options.items())
+    parts = [normalize.normalize_address(start_location),
+             normalize.normalize_address(end_location),
+             travelMode.lower(),
+             canonical_options]
+    if waypoints:
+        parts.append([[prefix, normalize.normalize_address(address)] for prefix, address in waypoints])
+    return 'route:' + json.dumps(parts)
+
+
+def profile_key(start_location, end_location, travelMode, options):
+    """Builds the cache key for the departure time profile of a route
+
+    Args:
+        start_location (str): The address of the location to start at
+        end_location (str): The address of the location to end at
+        travelMode (str): The mode of travel
+        options (dict): The additional parameters of the route requests, except dt and tt
+
+    Returns:
+        str: The cache key
+    """
+    return 'profile:' + route_key(start_location, end_location, travelMode, options)[len('route:'):]
+
+
+def matrix_key(origins, destinations, travelMode, options):
+    """Builds the cache key for a distance matrix request
+
+    Args:
+        origins (str): The origins parameter of the request
+        destinations (str): The destinations parameter of the request
+        travelMode (str): The mode of travel
+        options (dict): The other parameters sent with the request, except the api key
+
+    Returns:
+        str: The cache key
+    """
+    canonical_options = sorted((str(name), str(value)) for name, value in options.items())
+    return 'matrix:' + json.dumps([origins, destinations, travelMode.lower(), canonical_options])
+
+
+def route_ttl(options, ttls=None):
+    """Returns the number of seconds a route with these options should be cached for
+
+    Args:
+        options (dict): The additional parameters sent with the route request
+        ttls (dict): The time to live for each value of the optmz option. Defaults to route_ttls
+
+    Returns:
+        float: The time to live in seconds
+    """
+    ttls = route_ttls if ttls is None else ttls
+    return ttls.get(options.get('optmz', options.get('optimize')), ttls.get(None))
+
+
+class CachedResponse:
+    """Stands in for a requests response when a result is read from a cache
+
+    Attributes:
+        text (str): The body of the response
+    """
+    status_code = 200
+
+    def __init__(self, text):
+        self.text = text
+
+    @property
+    def content(self):
+        return self.text.encode('utf-8')
+
+
+class MemoryCache:
+    """An in process least recently used cache
+
+    Attributes:
+        hits (int): The number of get calls that found a live entry
+        misses (int): The number of get calls that found no entry or an expired entry
+    """
+    def __init__(self, max_entries=10000, ttl=None):
+        """The constructor for the memory cache
+
+        Args:
+            max_entries (int): The number of entries to hold before evicting the least recently used entry
+            ttl (float): The default number of seconds an entry lives. None keeps entries until they are evicted
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value stored for key, or None if there is no live entry"""
+        return self._get(key)[0]
+
+    def _get(self, key):
+        """Returns the value stored for key and the time it expires, or (None, None) if there is no live entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[1] is not None and entry[1] < time.time()):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, value, ttl=None):
+        """Stores value for key
+
+        Args:
+            key (str): The key
+            value (str): The value
+            ttl (float): The number of seconds the entry lives, overriding the default time to live
+        """
+        ttl = self.ttl if ttl is None else ttl
+        self._set(key, value, None if ttl is None else time.time() + ttl)
+
+    def _set(self, key, value, expires):
+        """Stores value for key until the time expires"""
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the size of the cache and the hit and miss counters as a dict"""
+        return {'entries': len(self), 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """A least recently used cache stored in a SQLite database file
+
+    Attributes:
+        hits (int): The number of get calls that found a live entry
+        misses (int): The number of get calls that found no entry or an expired entry
+    """
+    def __init__(self, path, max_entries=1000000, ttl=None):
+        """The constructor for the SQLite cache
+
+        Args:
+            path (str): The path to the database file. It is created if it does not exist
+            max_entries (int): The number of entries to hold before evicting the least recently used entries
+            ttl (float): The default number of seconds an entry lives. None keeps entries until they are evicted
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS entries '
+                                 '(key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        self._count = self._connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def get(self, key):
+        """Returns the value stored for key, or None if there is no live entry"""
+        return self._get(key)[0]
+
+    def _get(self, key):
+        """Returns the value stored for key and the time it expires, or (None, None) if there is no live entry"""
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute('SELECT value, expires FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                if row is not None:
+                    self._connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                    self._count -= 1
+                self.misses += 1
+                return None, None
+            self._connection.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+            self.hits += 1
+            return row
+
+    def set(self, key, value, ttl=None):
+        """Stores value for key
+
+        Args:
+            key (str): The key
+            value (str): The value
+            ttl (float): The number of seconds the entry lives, overriding the default time to live
+        """
+        ttl = self.ttl if ttl is None else ttl
+        self._set(key, value, None if ttl is None else time.time() + ttl)
+
+    def _set(self, key, value, expires):
+        """Stores value for key until the time expires"""
+        now = time.time()
+        with self._lock:
+            updated = self._connection.execute('UPDATE entries SET value = ?, expires = ?, accessed = ? WHERE key = ?',
+                                               (value, expires, now, key)).rowcount
+            if not updated:
+                self._connection.execute('INSERT INTO entries VALUES (?, ?, ?, ?)', (key, value, expires, now))
+                self._count += 1
+            if self._count > self.max_entries:
+                self._evict(self._count - self.max_entries)
+
+    def _evict(self, count):
+        """Removes expired entries, then the least recently used entries until count entries have been removed"""
+        removed = self._connection.execute('DELETE FROM entries WHERE expires < ?', (time.time(),)).rowcount
+        if removed < count:
+            removed += self._connection.execute('DELETE FROM entries WHERE key IN '
+                                                '(SELECT key FROM entries ORDER BY accessed LIMIT ?)',
+                                                (count - removed,)).rowcount
+        self._count -= removed
+
+    def delete(self, key):
+        with self._lock:
+            self._count -= self._connection.execute('DELETE FROM entries WHERE key = ?', (key,)).rowcount
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute('DELETE FROM entries')
+            self._count = 0
+
+    def close(self):
+        self._connection.close()
+
+    def stats(self):
+        """Returns the size of the cache and the hit and miss counters as a dict"""
+        return {'entries': len(self), 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return self._count
+
+
+class TieredCache:
+    """A memory cache in front of a persistent cache
+
+    Reads check the memory tier first and fall back to the persistent tier, copying anything found there into the
+    memory tier with the same expiry time. Writes go to both tiers.
+
+    Attributes:
+        memory (obj): The in process tier, usually a MemoryCache
+        persistent (obj): The persistent tier, usually a SQLiteCache
+    """
+    def __init__(self, memory, persistent):
+        """The constructor for the tiered cache
+
+        Args:
+            memory (obj): The in process tier, usually a MemoryCache
+            persistent (obj): The persistent tier, usually a SQLiteCache
+        """
+        self.memory = memory
+        self.persistent = persistent
+
+    @property
+    def hits(self):
+        return self.memory.hits + self.persistent.hits
+
+    @property
+    def misses(self):
+        return self.persistent.misses
+
+    def get(self, key):
+        """Returns the value stored for key, or None if neither tier has a live entry"""
+        return self._get(key)[0]
+
+    def _get(self, key):
+        value, expires = self.memory._get(key)
+        if value is None:
+            value, expires = self.persistent._get(key)
+            if value is not None:
+                self.memory._set(key, value, expires)
+        return value, expires
+
+    def set(self, key, value, ttl=None):
+        """Stores value for key in both tiers
+
+        Args:
+            key (str): The key
+            value (str): The value
+            ttl (float): The number of seconds the entry lives. Defaults to the persistent tier's time to live
+        """
+        ttl = self.persistent.ttl if ttl is None else ttl
+        self._set(key, value, None if ttl is None else time.time() + ttl)
+
+    def _set(self, key, value, expires):
+        self.memory._set(key, value, expires)
+        self.persistent._set(key, value, expires)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        self.persistent.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        self.persistent.clear()
+
+    def stats(self):
+        """Returns the hit and miss counters for each tier as a dict"""
+        return {'memory': self.memory.stats(), 'persistent': self.persistent.stats(),
+                'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self.persistent)
@@ -0,0 +1,190 @@
+"""A small client for the local service started by service.py
+
+The client only imports the standard library modules it needs to send a request, so a script using it starts in a
+fraction of the time it takes to import requests, pandas and the provider modules. The service does the lookups with
+its warm connections and cache. pandas is only imported by batch when a DataFrame is asked for.
+
+Example:
+    import client
+    service = client.Client()                                   # http://127.0.0.1:8765
+    service = client.Client('/tmp/addresslookup.sock')          # a Unix socket
+    print(service.geocode('81 1st st N, Paris')['latitude'])
+
+    python client.py geocode "81 1st st N, Paris"
+"""
+import http.client
+import json
+import socket
+
+
+class ServiceError(Exception):
+    """Raised when the service answers a request with an error
+
+    Attributes:
+        status (int): The HTTP status of the answer
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+class Client:
+    """Sends requests to the service over one keep-alive connection
+
+    A client belongs to one thread. Make a client for each thread that sends requests.
+    """
+    def __init__(self, address='http://127.0.0.1:8765', timeout=60):
+        """The constructor for the client
+
+        Args:
+            address (str): The http or https url of the service, or the path of its Unix socket
+            timeout (float): The seconds to wait for an answer
+        """
+        self.address = address
+        self.timeout = timeout
+        self._connection = None
+
+    def _connect(self):
+        if self.address.startswith('https://'):
+            return http.client.HTTPSConnection(self.address[len('https://'):].rstrip('/'), timeout=self.timeout)
+        if self.address.startswith('http://'):
+            return http.client.HTTPConnection(self.address[len('http://'):].rstrip('/'), timeout=self.timeout)
+        return _UnixConnection(self.address, self.timeout)
+
+    def _request(self, method, path, body=None):
+        payload = None if body is None else json.dumps(body).encode('utf-8')
+        headers = {} if payload is None else {'Content-Type': 'application/json'}
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = self._connect()
+            try:
+                self._connection.request(method, path, payload, headers)
+                response = self._connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The service closed the kept alive connection. Send once more on a new one
+                self.close()
+                if attempt:
+                    raise
+        if response.getheader('Content-Type', '').startswith('text/plain'):
+            return data.decode('utf-8')
+        result = json.loads(data)
+        if response.status != 200:
+            raise ServiceError(response.status, result.get('error', 'The service returned status {0}'.format(
+                response.status)))
+        return result
+
+    def geocode(self, address, provider=None):
+        """Geocodes an address
+
+        Args:
+            address (str): The address to search for
+            provider (str): mapquest or bing. Defaults to the first provider the service has a key for
+
+        Returns:
+            dict: The street_address, city, county, state, country, latitude, longitude and geocode_quality_code
+        """
+        return self._request('POST', '/geocode', {'address': address, 'provider': provider})
+
+    def reverse(self, latitude, longitude, provider=None):
+        """Returns the address fields of the address at a coordinate"""
+        return self._request('POST', '/reverse', {'latitude': latitude, 'longitude': longitude, 'provider': provider})
+
+    def route(self, start, end, travelMode='Driving', waypoints=None, steps=False, **options):
+        """Calculates a route with Bing
+
+        Args:
+            start (str): The address to start at
+            end (str): The address to end at
+            travelMode (str): Driving, Walking or Transit
+            waypoints (list): Stops between the start and the end
+            steps (bool): Include the steps of the route
+            options: Additional parameters as accepted by bing.RouteRetriever.calculate_route
+
+        Returns:
+            dict: The distance, duration, duration_traffic, units, mode, leg_count, start_location, end_location and
+                steps when asked for
+        """
+        return self._request('POST', '/route', {'start': start, 'end': end, 'travelMode': travelMode,
+                                                'waypoints': waypoints or [], 'steps': steps, 'options': options})
+
+    def batch(self, addresses, provider=None, as_frame=False):
+        """Geocodes many addresses in one request
+
+        Args:
+            addresses (list): The addresses to search for
+            provider (str): mapquest or bing
+            as_frame (bool): Return a pandas DataFrame instead of a list
+
+        Returns:
+            list: The address fields and an error for each address, in order
+        """
+        records = self._request('POST', '/batch', {'addresses': list(addresses), 'provider': provider})
+        if as_frame:
+            import pandas
+            return pandas.DataFrame.from_records(records)
+        return records
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def metrics(self):
+        """Returns the service's metrics in the Prometheus text format"""
+        return self._request('GET', '/metrics')
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Send a request to the local geocoding service')
+    parser.add_argument('--service', default='http://127.0.0.1:8765', help='The url or Unix socket of the service')
+    parser.add_argument('--provider', choices=['mapquest', 'bing'], help='The provider to geocode with')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('geocode', help='Geocode an address').add_argument('address')
+    reverse_parser = commands.add_parser('reverse', help='Find the address at a coordinate')
+    reverse_parser.add_argument('latitude', type=float)
+    reverse_parser.add_argument('longitude', type=float)
+    route_parser = commands.add_parser('route', help='Calculate a route')
+    route_parser.add_argument('start')
+    route_parser.add_argument('end')
+    route_parser.add_argument('--mode', default='Driving', help='Driving, Walking or Transit')
+    route_parser.add_argument('--steps', action='store_true', help='Include the steps of the route')
+    commands.add_parser('health', help='Show the providers the service has')
+    args = parser.parse_args(argv)
+
+    with Client(args.service) as client:
+        if args.command == 'geocode':
+            answer = client.geocode(args.address, args.provider)
+        elif args.command == 'reverse':
+            answer = client.reverse(args.latitude, args.longitude, args.provider)
+        elif args.command == 'route':
+            answer = client.route(args.start, args.end, args.mode, steps=args.steps)
+        else:
+            answer = client.health()
+    print(json.dumps(answer, indent=2))
+
+
+if __name__ == '__main__':
+    main()
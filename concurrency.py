@@ -0,0 +1,115 @@
+"""A module for running many provider requests at once with a bounded number of requests in flight
+
+Requests are run on a thread pool. Each provider object shares one requests session between its threads, and the
+session is mounted with a connection pool large enough that every worker can keep its own keep-alive connection.
+shared_session returns one session for the whole process, which every provider object can be given so they all draw
+on the same pool of connections.
+"""
+import concurrent.futures
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+_shared_session = None
+_shared_lock = threading.Lock()
+
+
+def make_session(pool_size=10, block=False):
+    """Creates a requests session whose connection pool can hold pool_size keep-alive connections per host
+
+    Args:
+        pool_size (int): The number of connections to keep open to each host
+        block (bool): Make a request wait for a free connection when pool_size are in use, instead of opening an extra
+            connection that is closed after the request
+
+    Returns:
+        requests.Session: The session
+    """
+    session = requests.session()
+    _mount(session, pool_size, block)
+    return session
+
+
+def _mount(session, pool_size, block):
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=block)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+
+def shared_session(pool_size=None, block=False):
+    """Returns the requests session shared by the whole process
+
+    The session is thread safe for the provider requests: its connection pool hands each thread its own connection.
+    The first call creates it. Calling again with a pool_size resizes the pool for the requests sent after the call,
+    while requests already in flight finish on the old pool.
+
+    Args:
+        pool_size (int): The number of connections to keep open to each host. Defaults to 10 when the session is created
+            and leaves the pool as it is otherwise
+        block (bool): Make a request wait for a free connection when pool_size are in use
+
+    Returns:
+        requests.Session: The session
+    """
+    global _shared_session
+    with _shared_lock:
+        if _shared_session is None:
+            _shared_session = make_session(pool_size or 10, block)
+        elif pool_size is not None:
+            _mount(_shared_session, pool_size, block)
+        return _shared_session
+
+
+def keyed_items(queries):
+    """Pairs each query with its input key. The key is the mapping key for a dict, otherwise the position of the query
+
+    Args:
+        queries (dict or iterable): The queries to run
+
+    Returns:
+        iterable: (key, query) tuples
+    """
+    if hasattr(queries, 'items'):
+        return queries.items()
+    return enumerate(queries)
+
+
+def run_concurrently(function, queries, max_workers=8, limiter=None):
+    """Calls function on each query from a thread pool, yielding results as they complete
+
+    No more than max_workers queries are in flight at once, and queries are read lazily from the input, so very long
+    inputs are not all submitted up front. An exception raised for one query is returned with that query instead of
+    stopping the others.
+
+    Args:
+        function (callable): Called with a single query
+        queries (dict or iterable): The queries to run. For a dict, the keys are used to tag the results
+        max_workers (int): The maximum number of queries in flight
+        limiter (obj): A ratelimit.AdaptiveConcurrency. When given, the number of queries in flight is kept to its
+            current limit, up to max_workers
+
+    Yields:
+        tuple: (key, result, error) where error is the exception raised for the query or None
+    """
+    items = iter(keyed_items(queries))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
+
+        def top_up():
+            """Submits queries until the in flight limit is reached or the input runs out"""
+            limit = max_workers if limiter is None else max(1, min(max_workers, limiter.limit))
+            while len(in_flight) < limit:
+                for key, query in items:
+                    in_flight[executor.submit(function, query)] = key
+                    break
+                else:
+                    return
+
+        top_up()
+        while in_flight:
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                key = in_flight.pop(future)
+                error = future.exception()
+                yield key, None if error else future.result(), error
+            top_up()
@@ -0,0 +1,225 @@
+"""A module for seeing where the time in a search or a route goes
+
+Transports and provider objects report what they do to an EventEmitter. Each event has a name, the provider and a dict
+of values:
+
+    request     One attempt at an HTTP request. method, url, status (None if the request could not be sent), error,
+                attempt, throttled, bytes, seconds, wait_seconds (connecting and waiting for the response headers) and
+                download_seconds (reading the body)
+    retry       A failed attempt is about to be retried. attempt and delay in seconds
+    cache       A cache lookup. hit is True or False
+    parse       Decoding a response body. seconds and bytes
+    build       Constructing the result object from the decoded body. seconds
+
+Every provider object reports to the module level emitter, events, unless it is given its own. Listeners are called on
+the thread that made the request, so they should be quick. When nothing is subscribed, reporting an event costs one
+empty loop and no timing is done.
+
+MetricsRegistry is a listener that keeps counters and histograms of the events, and exports them as Prometheus text or
+as a JSON snapshot:
+
+    registry = instrumentation.MetricsRegistry()
+    instrumentation.events.subscribe(registry.record)
+    ...
+    print(registry.to_prometheus())
+"""
+import bisect
+import json
+import threading
+import time
+
+
+class EventEmitter:
+    """Calls each subscribed listener with every event reported to it"""
+    def __init__(self):
+        # Replaced rather than changed in place, so events can be reported while listeners subscribe
+        self._listeners = ()
+
+    @property
+    def enabled(self):
+        """True if anything is subscribed"""
+        return bool(self._listeners)
+
+    def subscribe(self, listener):
+        """Adds a listener
+
+        Args:
+            listener (callable): Called with the event name, the provider and a dict of values
+        """
+        self._listeners = self._listeners + (listener,)
+        return listener
+
+    def unsubscribe(self, listener):
+        self._listeners = tuple(existing for existing in self._listeners if existing is not listener)
+
+    def emit(self, event, provider, **values):
+        for listener in self._listeners:
+            listener(event, provider, values)
+
+    def timed(self, event, provider, function, *args, **kwargs):
+        """Calls function, reporting how long it took as an event when anything is subscribed
+
+        Returns:
+            obj: What function returned
+        """
+        if not self._listeners:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        if event == 'parse' and args and isinstance(args[0], (bytes, str)):
+            self.emit(event, provider, seconds=seconds, bytes=len(args[0]))
+        else:
+            self.emit(event, provider, seconds=seconds)
+        return result
+
+
+events = EventEmitter()
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+size_buckets = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Counter:
+    """A count for each combination of label values"""
+    def __init__(self, name, description, labels):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+
+    def increment(self, label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Histogram:
+    """Bucketed observations for each combination of label values
+
+    Attributes:
+        buckets (tuple): The upper bounds of the buckets, in increasing order
+        values (dict): For each combination of label values, a list of the count in each bucket with one more for
+            observations above the last bound, then the sum of the observations
+    """
+    def __init__(self, name, description, labels, buckets):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, label_values, value):
+        counts = self.values.get(label_values)
+        if counts is None:
+            counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+
+class MetricsRegistry:
+    """Counters and histograms of the events reported by transports and provider objects
+
+    Attributes:
+        prefix (str): The start of every metric name
+    """
+    def __init__(self, prefix='addresslookup', latency_buckets=latency_buckets, size_buckets=size_buckets):
+        """The constructor for the metrics registry
+
+        Args:
+            prefix (str): The start of every metric name
+            latency_buckets (tuple): The upper bounds in seconds of the buckets of the phase timings
+            size_buckets (tuple): The upper bounds in bytes of the buckets of the response sizes
+        """
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self.requests = self.counter('requests_total', 'HTTP request attempts by status code',
+                                     ('provider', 'status'))
+        self.errors = self.counter('request_errors_total', 'HTTP request attempts that could not be sent',
+                                   ('provider', 'error'))
+        self.retries = self.counter('retries_total', 'Request attempts that were retried', ('provider',))
+        self.cache = self.counter('cache_lookups_total', 'Cache lookups by outcome', ('provider', 'result'))
+        self.phases = self.histogram('phase_seconds', 'Time spent in each phase of a request', ('provider', 'phase'),
+                                     latency_buckets)
+        self.sizes = self.histogram('response_bytes', 'Size of response bodies', ('provider',), size_buckets)
+
+    def counter(self, name, description, labels=()):
+        """Returns the counter with a name, adding it if it does not exist"""
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(self.prefix + '_' + name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=latency_buckets):
+        """Returns the histogram with a name, adding it if it does not exist"""
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(self.prefix + '_' + name, description, labels, buckets))
+
+    def record(self, event, provider, values):
+        """Updates the metrics for an event. Subscribe this method to an EventEmitter"""
+        with self._lock:
+            if event == 'request':
+                if values.get('status') is None:
+                    self.errors.increment((provider, values.get('error') or 'unknown'))
+                    return
+                self.requests.increment((provider, str(values['status'])))
+                self.phases.observe((provider, 'wait'), values['wait_seconds'])
+                self.phases.observe((provider, 'download'), values['download_seconds'])
+                self.sizes.observe((provider,), values['bytes'])
+            elif event == 'retry':
+                self.retries.increment((provider,))
+            elif event == 'cache':
+                self.cache.increment((provider, 'hit' if values['hit'] else 'miss'))
+            elif event in ('parse', 'build'):
+                self.phases.observe((provider, event), values['seconds'])
+
+    def snapshot(self):
+        """Returns every metric as a dict that can be dumped to JSON"""
+        with self._lock:
+            snapshot = {}
+            for metric in self._metrics.values():
+                series = []
+                for label_values, value in metric.values.items():
+                    labels = dict(zip(metric.labels, label_values))
+                    if isinstance(metric, Histogram):
+                        series.append({'labels': labels, 'buckets': dict(zip(map(str, metric.buckets), value[:-2])),
+                                       'count': sum(value[:-1]), 'sum': value[-1]})
+                    else:
+                        series.append({'labels': labels, 'value': value})
+                snapshot[metric.name] = {'type': type(metric).__name__.lower(), 'description': metric.description,
+                                         'series': series}
+            return snapshot
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        """Returns every metric in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for metric in self._metrics.values():
+                kind = 'histogram' if isinstance(metric, Histogram) else 'counter'
+                lines.append('# HELP {0} {1}'.format(metric.name, metric.description))
+                lines.append('# TYPE {0} {1}'.format(metric.name, kind))
+                for label_values, value in sorted(metric.values.items()):
+                    labels = list(zip(metric.labels, label_values))
+                    if kind == 'counter':
+                        lines.append('{0}{1} {2}'.format(metric.name, _labels(labels), value))
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                        cumulative += count
+                        lines.append('{0}_bucket{1} {2}'.format(metric.name, _labels(labels + [('le', bound)]),
+                                                                cumulative))
+                    lines.append('{0}_sum{1} {2}'.format(metric.name, _labels(labels), value[-1]))
+                    lines.append('{0}_count{1} {2}'.format(metric.name, _labels(labels), cumulative))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            for metric in self._metrics.values():
+                metric.values.clear()
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join('{0}="{1}"'.format(name, value) for (name, _), value in zip(pairs, escaped)) + '}'
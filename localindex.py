@@ -0,0 +1,313 @@
+"""A module for answering geocode searches offline from addresses that have already been resolved
+
+LocalIndex keeps every resolved address in a directory of files:
+
+    records.jsonl       One JSON record per resolved address, only ever appended to
+    keys-N.idx          Sorted (key hash, record offset) pairs for exact lookups of the normalized address
+    trigrams-N.idx      Sorted (trigram hash, record offset) pairs for finding near duplicate addresses
+
+Each flush of newly added addresses writes a new pair of index segments, so adding addresses never rewrites existing
+files. The segments and the records file are memory mapped and searched in place, so opening an index does not load
+it into Python objects. compact merges the segments into one pair once there are many.
+"""
+import glob
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+import Geocoder
+import bing
+import normalize
+
+_key_entry = struct.Struct('<QQ')
+_trigram_entry = struct.Struct('<IQ')
+_directionals = frozenset(['n', 's', 'e', 'w', 'ne', 'nw', 'se', 'sw'])
+
+
+def key_hash(provider, normalized_address):
+    digest = hashlib.blake2b((provider + ':' + normalized_address).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def trigrams(normalized_address):
+    """Returns the set of three character substrings of an address, padded so short words still have trigrams"""
+    padded = '  ' + normalized_address + ' '
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+def anchor_tokens(normalized_address):
+    """Returns the words of an address that a near duplicate must share: every word holding a digit, such as the house
+    number and postal code, and every directional"""
+    return [word for word in normalized_address.split() if word in _directionals or any(c.isdigit() for c in word)]
+
+
+def trigram_hash(trigram):
+    return zlib.crc32(trigram.encode('utf-8'))
+
+
+def result_data(provider, result):
+    """Returns the part of an AddressResult needed to rebuild it"""
+    if provider == 'mapquest':
+        return result._location
+    response = result._response
+    return response.data if hasattr(response, 'data') else response
+
+
+def build_result(provider, data):
+    """Rebuilds an AddressResult from the data returned by result_data"""
+    if provider == 'mapquest':
+        return Geocoder.AddressResult({'info': {'statuscode': 0}, 'results': [{'locations': [data]}]})
+    return bing.AddressResult(data)
+
+
+class Segment:
+    """A memory mapped file of fixed size entries sorted by their first field"""
+    def __init__(self, path, entry):
+        self.path = path
+        self._entry = entry
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._count = size // entry.size
+
+    def __len__(self):
+        return self._count
+
+    def entries(self):
+        return self._entry.iter_unpack(self._map[:self._count * self._entry.size])
+
+    def _first_at_least(self, value):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry.unpack_from(self._map, middle * self._entry.size)[0] < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def count(self, value):
+        """Returns the number of entries whose first field equals value, without reading them"""
+        return self._first_at_least(value + 1) - self._first_at_least(value)
+
+    def find(self, value):
+        """Returns the second field of every entry whose first field equals value"""
+        low = self._first_at_least(value)
+        found = []
+        while low < self._count:
+            first, second = self._entry.unpack_from(self._map, low * self._entry.size)
+            if first != value:
+                break
+            found.append(second)
+            low += 1
+        return found
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+
+def write_segment(path, entries, entry):
+    """Writes entries sorted by their first field, through a temporary file so a crash never leaves half a segment"""
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        for values in sorted(entries):
+            f.write(entry.pack(*values))
+    os.replace(temporary_path, path)
+
+
+class LocalIndex:
+    """An on disk index of resolved addresses
+
+    Attributes:
+        min_score (float): The quality_score a result needs to be added to the index or returned from it
+        min_similarity (float): The trigram similarity from 0 to 1 a near duplicate needs to be returned, or None to
+            only return exact matches
+    """
+    def __init__(self, directory, min_score=0.8, min_similarity=None, flush_every=1000, max_postings=1000):
+        """The constructor for the local index
+
+        Args:
+            directory (str): The directory holding the index files. It is created if it does not exist
+            min_score (float): The quality_score a result needs to be added to the index or returned from it
+            min_similarity (float): The trigram similarity a near duplicate needs to be returned. A near duplicate must
+                also have the same house number, directionals and postal code, so it only differs in spelling. None,
+                the default, only returns exact matches of the normalized address
+            flush_every (int): The number of added addresses to hold in memory before writing a new segment
+            max_postings (int): Trigrams found in more addresses than this in a segment are too common to narrow a
+                near duplicate search, and are skipped so a miss does not read most of the index
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.min_score = min_score
+        self.min_similarity = min_similarity
+        self.flush_every = flush_every
+        self.max_postings = max_postings
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._records_path = os.path.join(directory, 'records.jsonl')
+        self._records = open(self._records_path, 'ab+')
+        self._records_map = None
+        self._key_segments = [Segment(path, _key_entry) for path in self._segment_paths('keys')]
+        self._trigram_segments = [Segment(path, _trigram_entry) for path in self._segment_paths('trigrams')]
+        self._remap()
+
+    def _segment_paths(self, kind):
+        return sorted(glob.glob(os.path.join(self.directory, kind + '-*.idx')))
+
+    def _remap(self):
+        if self._records_map is not None:
+            self._records_map.close()
+        self._records.flush()
+        size = os.fstat(self._records.fileno()).st_size
+        self._records_map = mmap.mmap(self._records.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def _read_record(self, offset):
+        end = self._records_map.find(b'\n', offset)
+        return json.loads(self._records_map[offset:end])
+
+    def add(self, provider, address, result):
+        """Adds a resolved address. Results below min_score are ignored
+
+        Args:
+            provider (str): mapquest or bing
+            address (str): The address that was searched for
+            result (obj): The AddressResult for the address
+
+        Returns:
+            bool: True if the result was added
+        """
+        score = result.quality_score
+        if score < self.min_score:
+            return False
+        key = normalize.normalize_address(address)
+        with self._lock:
+            self._pending[provider, key] = {'provider': provider, 'key': key, 'score': score,
+                                            'data': result_data(provider, result)}
+            if len(self._pending) >= self.flush_every:
+                self.flush()
+        return True
+
+    def flush(self):
+        """Appends the added addresses to the records file and writes a new pair of index segments for them"""
+        with self._lock:
+            if not self._pending:
+                return
+            keys, grams = [], []
+            self._records.seek(0, os.SEEK_END)
+            for record in self._pending.values():
+                offset = self._records.tell()
+                self._records.write(json.dumps(record).encode('utf-8') + b'\n')
+                keys.append((key_hash(record['provider'], record['key']), offset))
+                grams.extend((trigram_hash(gram), offset) for gram in trigrams(record['key']))
+            self._records.flush()
+            os.fsync(self._records.fileno())
+
+            number = len(self._segment_paths('keys')) + 1
+            while os.path.exists(os.path.join(self.directory, 'keys-{0:06d}.idx'.format(number))):
+                number += 1
+            key_path = os.path.join(self.directory, 'keys-{0:06d}.idx'.format(number))
+            trigram_path = os.path.join(self.directory, 'trigrams-{0:06d}.idx'.format(number))
+            write_segment(trigram_path, grams, _trigram_entry)
+            write_segment(key_path, keys, _key_entry)
+            self._key_segments.append(Segment(key_path, _key_entry))
+            self._trigram_segments.append(Segment(trigram_path, _trigram_entry))
+            self._pending = {}
+            self._remap()
+
+    def lookup(self, provider, address):
+        """Returns the indexed result for an address, or None if there is no confident match
+
+        The normalized address is looked up exactly first. If it is not found and min_similarity is set, the indexed
+        address sharing the most trigrams with it is returned when their similarity reaches min_similarity.
+
+        Args:
+            provider (str): mapquest or bing
+            address (str): The address to search for
+
+        Returns:
+            obj: An AddressResult, or None
+        """
+        key = normalize.normalize_address(address)
+        with self._lock:
+            record = self._pending.get((provider, key)) or self._find_exact(provider, key)
+            if record is None and self.min_similarity is not None:
+                record = self._find_similar(provider, key)
+        if record is None or record['score'] < self.min_score:
+            return None
+        return build_result(provider, record['data'])
+
+    def _find_exact(self, provider, key):
+        target = key_hash(provider, key)
+        # Newer segments first, so the latest record for an address wins
+        for segment in reversed(self._key_segments):
+            for offset in reversed(segment.find(target)):
+                record = self._read_record(offset)
+                if record['provider'] == provider and record['key'] == key:
+                    return record
+        return None
+
+    def _find_similar(self, provider, key):
+        grams = trigrams(key)
+        anchors = anchor_tokens(key)
+        counts = {}
+        for gram in grams:
+            hashed = trigram_hash(gram)
+            for segment in self._trigram_segments:
+                if segment.count(hashed) > self.max_postings:
+                    continue
+                for offset in segment.find(hashed):
+                    counts[offset] = counts.get(offset, 0) + 1
+
+        # A record sharing c of the query's n trigrams has a similarity of at most c / n
+        best, best_similarity = None, self.min_similarity
+        for offset, count in sorted(counts.items(), key=lambda item: -item[1]):
+            if count < best_similarity * len(grams):
+                break
+            record = self._read_record(offset)
+            if record['provider'] != provider or anchor_tokens(record['key']) != anchors:
+                continue
+            record_grams = trigrams(record['key'])
+            similarity = len(grams & record_grams) / len(grams | record_grams)
+            if similarity >= best_similarity:
+                best, best_similarity = record, similarity
+        return best
+
+    def compact(self):
+        """Merges every index segment into one pair of segments
+
+        The merged segments are moved into place before the old segments are deleted, so a crash part way leaves every
+        entry in at least one segment. An entry found in more than one segment after such a crash is merged into one.
+        """
+        with self._lock:
+            self.flush()
+            if len(self._key_segments) <= 1:
+                return
+            keys = {entry for segment in self._key_segments for entry in segment.entries()}
+            grams = {entry for segment in self._trigram_segments for entry in segment.entries()}
+            old_segments = self._key_segments + self._trigram_segments
+            key_path = os.path.join(self.directory, 'keys-000001.idx')
+            trigram_path = os.path.join(self.directory, 'trigrams-000001.idx')
+            write_segment(trigram_path, grams, _trigram_entry)
+            write_segment(key_path, keys, _key_entry)
+            for segment in old_segments:
+                segment.close()
+                if segment.path not in (key_path, trigram_path):
+                    os.remove(segment.path)
+            self._key_segments = [Segment(key_path, _key_entry)]
+            self._trigram_segments = [Segment(trigram_path, _trigram_entry)]
+
+    def close(self):
+        self.flush()
+        for segment in self._key_segments + self._trigram_segments:
+            segment.close()
+        if self._records_map is not None:
+            self._records_map.close()
+        self._records.close()
+
+    def __len__(self):
+        return sum(len(segment) for segment in self._key_segments) + len(self._pending)
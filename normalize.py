@@ -0,0 +1,203 @@
+"""A module for reducing an address to a normalized form, so that different spellings of an address share one key
+
+normalize_address normalizes one address. prepare_queries normalizes a whole column with the pandas string methods,
+rejects rows that are not addresses and removes duplicates, so a bulk run only pays for each distinct address once.
+
+Attributes:
+    abbreviations (dict):
+        Maps a lower case address word to the standard USPS abbreviation used in the normalized address. Abbreviations
+        map to themselves so that both spellings normalize the same way.
+    unit_designators (tuple): The abbreviated words that start a unit number removed by normalize_column
+    street_suffixes (tuple): The abbreviated street types a unit number must come after to be removed
+    placeholder_values (frozenset): Normalized values that stand in for a missing address
+"""
+import re
+
+abbreviations = {
+    'street': 'st', 'st': 'st', 'str': 'st',
+    'avenue': 'ave', 'ave': 'ave', 'av': 'ave',
+    'road': 'rd', 'rd': 'rd',
+    'boulevard': 'blvd', 'blvd': 'blvd',
+    'drive': 'dr', 'dr': 'dr',
+    'lane': 'ln', 'ln': 'ln',
+    'court': 'ct', 'ct': 'ct',
+    'place': 'pl', 'pl': 'pl',
+    'circle': 'cir', 'cir': 'cir',
+    'terrace': 'ter', 'ter': 'ter',
+    'highway': 'hwy', 'hwy': 'hwy',
+    'parkway': 'pkwy', 'pkwy': 'pkwy',
+    'expressway': 'expy', 'expy': 'expy',
+    'freeway': 'fwy', 'fwy': 'fwy',
+    'square': 'sq', 'sq': 'sq',
+    'trail': 'trl', 'trl': 'trl',
+    'way': 'way',
+    'saint': 'st', 'mount': 'mt', 'mt': 'mt', 'fort': 'ft', 'ft': 'ft',
+    'north': 'n', 'n': 'n',
+    'south': 's', 's': 's',
+    'east': 'e', 'e': 'e',
+    'west': 'w', 'w': 'w',
+    'northeast': 'ne', 'ne': 'ne',
+    'northwest': 'nw', 'nw': 'nw',
+    'southeast': 'se', 'se': 'se',
+    'southwest': 'sw', 'sw': 'sw',
+    'suite': 'ste', 'ste': 'ste',
+    'apartment': 'apt', 'apt': 'apt',
+    'first': '1st', 'second': '2nd', 'third': '3rd', 'fourth': '4th', 'fifth': '5th',
+}
+
+_punctuation = re.compile(r"[^\w\s]")
+
+
+def normalize_address(address):
+    """Normalizes an address for use as a lookup key
+
+    The address is lower cased, punctuation is removed, runs of whitespace are collapsed to a single space, and
+    street types, directionals and unit designators are replaced with their standard abbreviations.
+
+    Args:
+        address (str): The address to normalize. Example: 81 First Street North, Paris
+
+    Returns:
+        str: The normalized address. Example: 81 1st st n paris
+    """
+    words = _punctuation.sub(' ', str(address).lower()).split()
+    return ' '.join(abbreviations.get(word, word) for word in words)
+
+
+unit_designators = ('apt', 'ste', 'unit', 'rm', 'room', 'bldg', 'spc', 'trlr', 'dept')
+street_suffixes = ('st', 'ave', 'rd', 'blvd', 'dr', 'ln', 'ct', 'pl', 'cir', 'ter', 'hwy', 'pkwy', 'expy', 'fwy', 'sq',
+                   'trl', 'way')
+placeholder_values = frozenset({'n a', 'na', 'none', 'null', 'nil', 'nan', 'unknown', 'tbd', 'test', 'x', 'xx',
+                                'xxx', 'no address', 'address'})
+
+_whitespace = r'\s+'
+_unit_sign = r'#\s*'
+_punctuation_except_unit_sign = re.compile(r"[^\w\s#]")
+_abbreviation = re.compile(r'\b(?:' + '|'.join(sorted(abbreviations, key=len, reverse=True)) + r')\b')
+# Unit numbers are only removed after the street suffix. Before it the words are part of the street or the building
+# name, as in 1 unit 7 rd
+_after_street = re.compile(r'\b(?:' + '|'.join(street_suffixes) + r')\b.*')
+# A unit designator or # followed by a unit number such as 4, 12b or b. Fl and lot are left out because fl is also a
+# state abbreviation and lot is also a word in place names, and floor and building because they start building names
+# as often as units
+_unit = re.compile(r'\s(?:(?:' + '|'.join(unit_designators) + r')\s+|#\s*)(?:\w*\d\w*|[a-z])\b')
+_zip_code = r'^\d{5}(?: ?\d{4})?$'
+
+
+def normalize_column(addresses, strip_units=True):
+    """Normalizes a column of addresses at once, the way normalize_address normalizes one
+
+    Each step runs over the whole column with the pandas string methods. Missing values become empty strings.
+
+    Args:
+        addresses (array-like): Addresses. Example: a pandas Series, a NumPy array of strings or a list
+        strip_units (bool): Remove apartment, suite and other unit numbers that follow the street suffix, which
+            providers do not need to locate the building. With False the result matches normalize_address. With True
+            an address with a unit normalizes to a different string than normalize_address gives, so it is cached
+            under the key of the address without the unit, which every unit of the building shares
+
+    Returns:
+        pandas.Series: The normalized addresses
+    """
+    import pandas
+    column = pandas.Series(addresses, dtype=object)
+    text = column.where(column.notna(), '').astype(str).str.lower()
+    if strip_units:
+        # The unit sign is kept through punctuation removal, so a unit number after the street can be found by it
+        text = text.str.replace(_unit_sign, ' # ', regex=True)
+        text = text.str.replace(_punctuation_except_unit_sign, ' ', regex=True)
+    else:
+        text = text.str.replace(_punctuation, ' ', regex=True)
+    text = text.str.replace(_whitespace, ' ', regex=True).str.strip()
+    text = text.str.replace(_abbreviation, lambda match: abbreviations[match.group(0)], regex=True)
+    if strip_units:
+        text = text.str.replace(_after_street, lambda match: _unit.sub('', match.group(0)), regex=True)
+        text = text.str.replace('#', ' ', regex=False).str.replace(_whitespace, ' ', regex=True).str.strip()
+    return text
+
+
+def rejection_reasons(raw, normalized, min_length=3, max_length=200):
+    """Returns why each normalized address should not be sent to a provider
+
+    Args:
+        raw (pandas.Series): The addresses as given
+        normalized (pandas.Series): The addresses from normalize_column
+        min_length (int): The fewest characters a normalized address can have
+        max_length (int): The most characters a normalized address can have
+
+    Returns:
+        pandas.Series: missing, empty, placeholder, too short, too long or no letters for each rejected address and
+            None for the rest
+    """
+    import numpy
+    import pandas
+    lengths = normalized.str.len()
+    has_letters = normalized.str.contains('[^\\W\\d_]', regex=True)
+    conditions = [raw.isna().to_numpy(), (lengths == 0).to_numpy(), normalized.isin(placeholder_values).to_numpy(),
+                  (lengths < min_length).to_numpy(), (lengths > max_length).to_numpy(),
+                  (~has_letters & ~normalized.str.match(_zip_code)).to_numpy()]
+    reasons = numpy.select(conditions, ['missing', 'empty', 'placeholder', 'too short', 'too long', 'no letters'], '')
+    return pandas.Series(reasons, index=normalized.index, dtype=object).replace('', None)
+
+
+class QuerySet:
+    """The distinct normalized queries of a column of addresses, and the row each came from
+
+    Attributes:
+        queries (list): The distinct normalized addresses, in order of first appearance. These are what is sent to the
+            provider
+        inverse (numpy.ndarray): For each row, the position of its query in queries, or -1 if the row was rejected
+        reasons (numpy.ndarray): For each row, why it was rejected, or None
+    """
+    def __init__(self, queries, inverse, reasons):
+        self.queries = queries
+        self.inverse = inverse
+        self.reasons = reasons
+
+    @property
+    def rejected(self):
+        """The number of rows rejected"""
+        return int((self.inverse < 0).sum())
+
+    def expand(self, results, rejected=None):
+        """Fans a result for each query back out to every row
+
+        Args:
+            results (list): The result for each query, in the order of queries
+            rejected (obj): The value given to rejected rows
+
+        Returns:
+            list: The result for each row
+        """
+        return [rejected if position < 0 else results[position] for position in self.inverse.tolist()]
+
+    def __len__(self):
+        return len(self.queries)
+
+
+def prepare_queries(addresses, strip_units=True, min_length=3, max_length=200):
+    """Normalizes a column of addresses, rejects the invalid ones and removes duplicates before any request is sent
+
+    Each distinct raw address is only normalized once, so a column with many repeats is cheap to prepare.
+
+    Args:
+        addresses (array-like): Addresses. Example: a pandas Series, a NumPy array of strings or a list
+        strip_units (bool): Remove apartment, suite and other unit numbers that follow the street suffix
+        min_length (int): The fewest characters a normalized address can have
+        max_length (int): The most characters a normalized address can have
+
+    Returns:
+        QuerySet: The distinct queries and the mapping from rows to queries
+
+    Example:
+        >>> prepared = prepare_queries(['81 First Street North, Paris', '81 1st St. N Paris #4', None])
+        >>> prepared.queries, prepared.inverse.tolist(), prepared.reasons.tolist()
+        (['81 1st st n paris'], [0, 0, -1], [None, None, 'missing'])
+    """
+    import pandas
+    raw_codes, raw_unique = pandas.factorize(pandas.Series(addresses, dtype=object), use_na_sentinel=False)
+    raw_unique = pandas.Series(raw_unique, dtype=object)
+    normalized = normalize_column(raw_unique, strip_units)
+    reasons = rejection_reasons(raw_unique, normalized, min_length, max_length)
+    query_codes, queries = pandas.factorize(normalized.where(reasons.isna(), None))
+    return QuerySet(list(queries), query_codes[raw_codes], reasons.to_numpy()[raw_codes])
@@ -0,0 +1,70 @@
+"""A module for parsing provider responses straight from the response bytes
+
+loads uses orjson when it is installed and falls back to the json module otherwise. Both accept bytes, so the body of
+a response never has to be decoded to a str first. LazyJSON holds the bytes of a response and only parses them the
+first time a field is read, which lets a result that is never inspected skip parsing entirely. Parsing is deferred,
+not done field by field: the first read parses the whole document.
+"""
+import json
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    orjson = None
+    loads = json.loads
+
+
+def walk(data, path):
+    """Follows a path of keys and list positions into parsed JSON, returning an empty dict where the path is missing
+
+    Args:
+        data (obj): The parsed JSON
+        path (tuple): Keys and list positions. Example: ('resourceSets', 0, 'resources', 0)
+
+    Returns:
+        obj: The value at the end of the path
+    """
+    for step in path:
+        if isinstance(step, int):
+            data = data[step] if isinstance(data, list) and len(data) > step else {}
+        else:
+            data = data.get(step, {}) if isinstance(data, dict) else {}
+    return data
+
+
+class LazyJSON:
+    """A JSON object that is parsed from its bytes the first time it is read
+
+    The first read parses the whole document, however little of it is read, so this saves the parse of a result that
+    is never inspected rather than the parse of the fields that are not read. Only the get method of a dict is
+    provided, which is all the result objects use. Once parsed, the bytes and every part of the document outside of
+    path are released.
+    """
+    __slots__ = ('_raw', '_path', '_keep', '_data')
+
+    def __init__(self, raw, path=(), keep=None):
+        """The constructor for the lazy JSON object
+
+        Args:
+            raw (bytes): The body of the response
+            path (tuple): The keys and list positions of the object within the document to expose
+            keep (tuple): The keys of the object to keep once it is parsed. Every key is kept when None
+        """
+        self._raw = raw
+        self._path = path
+        self._keep = keep
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            data = walk(loads(self._raw), self._path)
+            if self._keep is not None and isinstance(data, dict):
+                data = {key: data[key] for key in self._keep if key in data}
+            self._data = data
+            self._raw = None
+        return self._data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
@@ -0,0 +1,168 @@
+"""A module for keeping request rates within provider quotas
+
+TokenBucket limits the rate of requests for one budget and RateLimiter keeps a bucket for each key, such as each
+provider or api key. AdaptiveConcurrency raises the number of requests allowed in flight while responses are fast and
+successful, and cuts it back when latency climbs or the provider starts throttling. backoff_delay gives the wait before
+retrying a throttled or failed request.
+"""
+import random
+import threading
+import time
+
+
+class RateLimitError(Exception):
+    """Raised when a provider keeps throttling a request after every retry"""
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """Returns how long to wait before a retry, using exponential backoff with full jitter
+
+    Args:
+        attempt (int): The number of retries already made, starting from 0
+        base (float): The longest wait in seconds before the first retry
+        cap (float): The longest wait in seconds before any retry
+
+    Returns:
+        float: The number of seconds to wait
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """A thread safe token bucket
+
+    Attributes:
+        rate (float): The number of tokens added per second
+        capacity (float): The most tokens the bucket holds, which is the largest burst of requests allowed
+    """
+    def __init__(self, rate, capacity=None):
+        """The constructor for the token bucket
+
+        Args:
+            rate (float): The number of requests allowed per second
+            capacity (float): The largest burst of requests allowed. Defaults to one second of requests
+        """
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Takes tokens from the bucket, waiting until enough are available
+
+        Returns:
+            float: The number of seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def reserve(self, tokens=1):
+        """Takes tokens from the bucket without waiting, borrowing against tokens not yet added
+
+        Code that cannot block, such as a coroutine, waits for the returned delay itself before sending its request.
+
+        Returns:
+            float: The number of seconds to wait before the tokens may be used
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+
+class RateLimiter:
+    """Keeps a separate token bucket for each key"""
+    def __init__(self, rate=5.0, capacity=None, rates=None):
+        """The constructor for the rate limiter
+
+        Args:
+            rate (float): The requests per second allowed for keys without their own rate
+            capacity (float): The burst allowed for keys without their own rate. Defaults to one second of requests
+            rates (dict): The requests per second allowed for particular keys. Example: {'bing': 50, 'mapquest': 10}
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.rates = rates or {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key=None):
+        """Waits until a request for key is allowed
+
+        Returns:
+            float: The number of seconds spent waiting
+        """
+        return self._bucket(key).acquire()
+
+    def reserve(self, key=None):
+        """Counts a request for key without waiting
+
+        Returns:
+            float: The number of seconds to wait before sending the request
+        """
+        return self._bucket(key).reserve()
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    rate = self.rates.get(key, self.rate)
+                    bucket = self._buckets[key] = TokenBucket(rate, self.capacity if key not in self.rates else None)
+        return bucket
+
+
+class AdaptiveConcurrency:
+    """Tunes how many requests should be in flight from the latency and outcome of each request
+
+    The limit grows by one for every limit successful requests that finish within latency_target, and halves when a
+    request is throttled, fails, or takes longer than latency_target.
+
+    Attributes:
+        limit (int): The number of requests that should currently be in flight
+    """
+    def __init__(self, initial=4, minimum=1, maximum=64, latency_target=1.0):
+        """The constructor for the adaptive concurrency limit
+
+        Args:
+            initial (int): The starting limit
+            minimum (int): The smallest limit allowed
+            maximum (int): The largest limit allowed
+            latency_target (float): The number of seconds a healthy request should take
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self._limit = float(initial)
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def record(self, latency, ok=True):
+        """Updates the limit from a finished request
+
+        Args:
+            latency (float): The number of seconds the request took
+            ok (bool): False if the request was throttled or failed
+        """
+        with self._lock:
+            if ok and latency <= self.latency_target:
+                self._limit = min(self.maximum, self._limit + 1.0 / self._limit)
+            else:
+                self._limit = max(self.minimum, self._limit / 2)
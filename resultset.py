@@ -0,0 +1,154 @@
+"""A module for holding large numbers of address results in little memory
+
+Each AddressResult keeps the response it was built from, which is far larger than the handful of fields most callers
+read. CompactAddress keeps only those fields, and AddressResultSet stores them as columns: coordinates in float arrays
+and text fields as integer codes into a table of unique values, so a city or state repeated across a million rows is
+only stored once. Either provider's AddressResult can be added.
+
+Attributes:
+    fields (list): The fields kept from each address result
+    text_fields (list): The fields stored as text
+"""
+import array
+import math
+
+fields = ['street_address', 'zip_code', 'neighborhood', 'city', 'county', 'state', 'country', 'latitude', 'longitude',
+          'geocode_quality_code']
+text_fields = [field for field in fields if field not in ('latitude', 'longitude')]
+
+
+class CompactAddress:
+    """An address with only the extracted fields, without the response it came from
+
+    Attributes:
+        street_address (str): The street address. Example: 1 Main St
+        zip_code (str): The postal code
+        neighborhood (str): The neighborhood of the address result
+        city (str): The city
+        county (str): The county
+        state (str): The state
+        country (str): The country
+        latitude (float): The latitude of the address
+        longitude (float): The longitude of the address
+        geocode_quality_code (str): The quality of the result found
+    """
+    __slots__ = fields
+
+    def __init__(self, **values):
+        for field in fields:
+            setattr(self, field, values.get(field))
+
+    @classmethod
+    def from_result(cls, result):
+        """Copies the fields out of a Geocoder.AddressResult or a bing.AddressResult"""
+        return cls(**{field: getattr(result, field, None) for field in fields})
+
+    def __repr__(self):
+        return 'CompactAddress({0})'.format(', '.join('{0}={1!r}'.format(field, getattr(self, field)) for field in fields))
+
+
+class _TextColumn:
+    """A column of strings stored as codes into a table of unique values. Missing values have the code -1"""
+    __slots__ = ('codes', 'values', '_positions')
+
+    def __init__(self):
+        self.codes = array.array('i')
+        self.values = []
+        self._positions = {}
+
+    def append(self, value):
+        if value is None:
+            self.codes.append(-1)
+            return
+        value = str(value)
+        code = self._positions.get(value)
+        if code is None:
+            code = self._positions[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def __getitem__(self, index):
+        code = self.codes[index]
+        return None if code < 0 else self.values[code]
+
+
+class AddressResultSet:
+    """A columnar collection of address results
+
+    Attributes:
+        latitudes (array): The latitude of each result. Missing coordinates are NaN
+        longitudes (array): The longitude of each result. Missing coordinates are NaN
+    """
+    def __init__(self, results=()):
+        """The constructor for the result set
+
+        Args:
+            results (iterable): Address results to add
+        """
+        self.latitudes = array.array('d')
+        self.longitudes = array.array('d')
+        self._text = {field: _TextColumn() for field in text_fields}
+        self.extend(results)
+
+    def append(self, result):
+        """Adds a Geocoder.AddressResult, bing.AddressResult or CompactAddress to the set"""
+        for field, column in self._text.items():
+            column.append(getattr(result, field, None))
+        self.latitudes.append(_to_float(result.latitude))
+        self.longitudes.append(_to_float(result.longitude))
+
+    def extend(self, results):
+        for result in results:
+            self.append(result)
+
+    def column(self, field):
+        """Returns every value of a field as a list"""
+        if field == 'latitude':
+            return list(self.latitudes)
+        if field == 'longitude':
+            return list(self.longitudes)
+        column = self._text[field]
+        return [None if code < 0 else column.values[code] for code in column.codes]
+
+    def to_numpy(self):
+        """Returns the set as a dict of NumPy arrays
+
+        Coordinates are float arrays. Text fields are returned twice: as an integer array of codes under the field
+        name followed by _codes, and as an array of the unique values under the field name followed by _values.
+        """
+        import numpy
+        columns = {'latitude': numpy.frombuffer(self.latitudes, dtype=numpy.float64).copy(),
+                   'longitude': numpy.frombuffer(self.longitudes, dtype=numpy.float64).copy()}
+        for field, column in self._text.items():
+            columns[field + '_codes'] = numpy.frombuffer(column.codes, dtype=numpy.int32).copy()
+            columns[field + '_values'] = numpy.array(column.values, dtype=object)
+        return columns
+
+    def to_dataframe(self):
+        """Returns the set as a pandas DataFrame with a categorical column for each text field"""
+        import pandas
+        data = {}
+        for field in fields:
+            if field == 'latitude':
+                data[field] = self.latitudes
+            elif field == 'longitude':
+                data[field] = self.longitudes
+            else:
+                column = self._text[field]
+                data[field] = pandas.Categorical.from_codes(column.codes, categories=column.values)
+        return pandas.DataFrame(data)
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def __getitem__(self, index):
+        values = {field: column[index] for field, column in self._text.items()}
+        return CompactAddress(latitude=self.latitudes[index], longitude=self.longitudes[index], **values)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def _to_float(value):
+    return math.nan if value is None else float(value)
@@ -0,0 +1,178 @@
+"""A module for geocoding through several providers behind one interface
+
+Each provider is wrapped in a Provider with the same geocode method. GeocodeRouter tries the providers in order of
+cost or observed latency and stops as soon as a result's quality_score reaches the threshold, so the other providers
+are only paid for when the first result is poor. With hedge_after set, a slow request is raced against the next
+provider once the deadline passes.
+"""
+import abc
+import collections
+import concurrent.futures
+import threading
+import time
+import Geocoder
+import bing
+
+RoutedResult = collections.namedtuple('RoutedResult', ['result', 'provider', 'score'])
+
+
+class Provider(abc.ABC):
+    """A geocoding provider. Subclasses implement _geocode to send an address to the provider
+
+    Attributes:
+        name (str): The name of the provider
+        cost (float): The relative cost of a request, used to order providers
+        latency (float): A moving average of the seconds a request takes, or None before the first request
+    """
+    def __init__(self, name, cost=1.0):
+        self.name = name
+        self.cost = cost
+        self.latency = None
+        self._lock = threading.Lock()
+
+    def geocode(self, address):
+        """Geocodes an address, recording how long the request took
+
+        Returns:
+            obj: An AddressResult with a quality_score
+        """
+        start = time.monotonic()
+        try:
+            return self._geocode(address)
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+
+    @abc.abstractmethod
+    def _geocode(self, address):
+        """Returns the AddressResult for an address"""
+
+
+class MapQuestProvider(Provider):
+    """Geocodes with a Geocoder.Geocoder"""
+    def __init__(self, geocoder, cost=1.0):
+        super().__init__('mapquest', cost)
+        self.geocoder = geocoder
+
+    @classmethod
+    def from_key(cls, api_key, cost=1.0, **kwargs):
+        return cls(Geocoder.Geocoder(api_key, **kwargs), cost)
+
+    def _geocode(self, address):
+        return self.geocoder.geocode(address)
+
+
+class BingProvider(Provider):
+    """Geocodes with a bing.Geocoder"""
+    def __init__(self, geocoder, cost=1.0):
+        super().__init__('bing', cost)
+        self.geocoder = geocoder
+
+    @classmethod
+    def from_key(cls, api_key, cost=1.0, **kwargs):
+        return cls(bing.Geocoder(api_key, **kwargs), cost)
+
+    def _geocode(self, address):
+        return self.geocoder.geocode(address)
+
+
+class GeocodeRouter:
+    """Sends each address to the preferred provider, falling back to the others for poor results"""
+    def __init__(self, providers, threshold=0.7, order_by='cost', hedge_after=None):
+        """The constructor for the router
+
+        Args:
+            providers (list): The Provider objects to route between
+            threshold (float): The quality_score a result needs to be returned without trying another provider
+            order_by (str): cost to try the cheapest provider first, or latency to try the fastest first
+            hedge_after (float): The number of seconds to wait for a provider before also sending the address to the
+                next one. None waits for each provider to finish before trying the next
+        """
+        self.providers = list(providers)
+        self.threshold = threshold
+        self.order_by = order_by
+        self.hedge_after = hedge_after
+        self._executor = None
+        if hedge_after is not None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=4 * len(self.providers))
+
+    def ordered_providers(self):
+        """Returns the providers in the order they will be tried"""
+        if self.order_by == 'latency':
+            # Providers without a measured latency are tried first so every provider gets measured
+            return sorted(self.providers, key=lambda provider: (provider.latency or 0.0, provider.cost))
+        return sorted(self.providers, key=lambda provider: provider.cost)
+
+    def search(self, address):
+        """Geocodes an address, trying providers until one returns a result that reaches the threshold
+
+        Returns:
+            RoutedResult: The first result to reach the threshold, or the best result if none did
+
+        Raises:
+            Exception: The last error raised if every provider failed
+        """
+        if self._executor is not None:
+            return self._search_hedged(address)
+
+        best = None
+        error = None
+        for provider in self.ordered_providers():
+            try:
+                result = provider.geocode(address)
+            except Exception as e:
+                error = e
+                continue
+            routed = RoutedResult(result, provider.name, result.quality_score)
+            if routed.score >= self.threshold:
+                return routed
+            if best is None or routed.score > best.score:
+                best = routed
+        if best is None:
+            raise error
+        return best
+
+    def _search_hedged(self, address):
+        """Searches like search, but starts the next provider whenever the running ones pass the hedge deadline"""
+        providers = iter(self.ordered_providers())
+        pending = {}
+        best = None
+        error = None
+
+        def start_next():
+            provider = next(providers, None)
+            if provider is not None:
+                pending[self._executor.submit(provider.geocode, address)] = provider
+            return provider is not None
+
+        more = start_next()
+        while pending:
+            done, _ = concurrent.futures.wait(pending, timeout=self.hedge_after if more else None,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                more = start_next()
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    more = start_next()
+                    continue
+                routed = RoutedResult(result, provider.name, result.quality_score)
+                if routed.score >= self.threshold:
+                    for other in pending:
+                        other.cancel()
+                    return routed
+                if best is None or routed.score > best.score:
+                    best = routed
+                more = start_next()
+        if best is None:
+            raise error
+        return best
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
@@ -0,0 +1,275 @@
+"""A long running local service that answers geocode, route and batch requests over HTTP or a Unix socket
+
+Starting a script for each small job pays for importing requests and pandas, asking for a key and opening a new TLS
+connection every time. The service pays for that once. It keeps one pooled session, the provider objects, the cache
+and the rate limiter in memory for as long as it runs, so each request it answers only costs the lookup itself.
+client.Client talks to it without importing any of the heavy modules.
+
+Endpoints. Every request and response body is JSON, and GET requests take the same fields as query parameters:
+
+    GET/POST /geocode   address, provider (mapquest or bing). Returns the address fields
+    GET/POST /reverse   latitude, longitude, provider
+    POST     /route     start, end, travelMode, waypoints (stops between start and end), options (additional route
+                        parameters), steps (true to include the steps). Returns the route fields
+    POST     /batch     addresses, provider. Returns the address fields for each address in order, with an error for
+                        each address that could not be geocoded
+    GET      /health    The providers available
+    GET      /metrics   The instrumentation metrics in the Prometheus text format
+
+Errors are returned as {"error": message} with status 400 for a bad request and 502 when the provider fails.
+
+Example:
+    python service.py --port 8765 --cache responses.sqlite
+    python service.py --socket /tmp/addresslookup.sock
+"""
+import argparse
+import json
+import os
+import socketserver
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import Geocoder
+import bing
+import bulk
+import cache
+import concurrency
+import instrumentation
+import ratelimit
+
+address_fields = bulk.output_fields[2:-1]
+route_fields = ['distance', 'duration', 'duration_traffic', 'distance_unit', 'duration_unit', 'mode', 'leg_count']
+
+
+class BadRequest(Exception):
+    """Raised for a request that is missing a field or names a provider that is not configured"""
+
+
+def address_record(result):
+    """Returns the fields of an AddressResult as a dict"""
+    return {field: getattr(result, field) for field in address_fields}
+
+
+def route_record(route, steps=False):
+    """Returns the fields of a RouteResult as a dict, with its steps when steps is True"""
+    record = {field: getattr(route, field) for field in route_fields}
+    record['start_location'] = str(route.start_location)
+    record['end_location'] = str(route.end_location)
+    if steps:
+        record['steps'] = [step._asdict() for step in route.steps()]
+    return record
+
+
+class Service:
+    """The provider objects behind the endpoints, shared by every request the service answers
+
+    Attributes:
+        geocoders (dict): The Geocoder.Geocoder and bing.Geocoder for each configured provider, by name
+        router (obj): The bing.RouteRetriever, or None without a bing key
+        metrics (obj): The instrumentation.MetricsRegistry the providers report to
+    """
+    def __init__(self, mapquest_key=None, bing_key=None, cache=None, rate_limiter=None, pool_size=32, max_workers=16):
+        """The constructor for the service
+
+        Args:
+            mapquest_key (str): The MapQuest api key. The mapquest provider is not available without one
+            bing_key (str): The Bing api key. The bing provider and routes are not available without one
+            cache (obj): A cache such as cache.TieredCache shared by every provider
+            rate_limiter (obj): A ratelimit.RateLimiter shared by every provider
+            pool_size (int): The number of keep-alive connections to hold open to each provider
+            max_workers (int): The maximum number of requests in flight for one batch
+        """
+        self.max_workers = max_workers
+        self.metrics = instrumentation.MetricsRegistry()
+        self._events = instrumentation.EventEmitter()
+        self._events.subscribe(self.metrics.record)
+        session = concurrency.make_session(pool_size)
+        shared = {'cache': cache, 'rate_limiter': rate_limiter, 'events': self._events, 'session': session}
+        self.geocoders = {}
+        if mapquest_key:
+            self.geocoders['mapquest'] = Geocoder.Geocoder(mapquest_key, **shared)
+        if bing_key:
+            self.geocoders['bing'] = bing.Geocoder(bing_key, **shared)
+        self.router = bing.RouteRetriever(bing_key, **shared) if bing_key else None
+
+    def _geocoder(self, provider):
+        geocoder = self.geocoders.get(provider or next(iter(self.geocoders), None))
+        if geocoder is None:
+            raise BadRequest('No key is configured for {0}'.format(provider or 'any provider'))
+        return geocoder
+
+    def geocode(self, request):
+        address = _field(request, 'address')
+        return address_record(self._geocoder(request.get('provider')).geocode(address))
+
+    def reverse(self, request):
+        try:
+            latitude, longitude = float(_field(request, 'latitude')), float(_field(request, 'longitude'))
+        except ValueError:
+            raise BadRequest('latitude and longitude must be numbers')
+        return address_record(self._geocoder(request.get('provider')).reverse_geocode(latitude, longitude))
+
+    def route(self, request):
+        if self.router is None:
+            raise BadRequest('No key is configured for bing')
+        start, end = _field(request, 'start'), _field(request, 'end')
+        travelMode = request.get('travelMode', 'Driving')
+        options = request.get('options') or {}
+        if not isinstance(options, dict):
+            raise BadRequest('options must be an object')
+        waypoints = request.get('waypoints') or []
+        if isinstance(waypoints, str):
+            waypoints = [waypoints]
+        try:
+            if waypoints:
+                route = self.router.get_waypoint_route([start] + list(waypoints) + [end], travelMode, **options)
+            else:
+                route = self.router.get_route(start, end, travelMode, **options)
+        except ValueError as e:
+            raise BadRequest(str(e))
+        return route_record(route, str(request.get('steps', '')).lower() in ('1', 'true'))
+
+    def batch(self, request):
+        addresses = _field(request, 'addresses')
+        if not isinstance(addresses, list):
+            raise BadRequest('addresses must be a list')
+        geocoder = self._geocoder(request.get('provider'))
+        records = []
+        for _, _, result, error in bulk.geocode_chunk(geocoder, list(enumerate(addresses)), self.max_workers):
+            record = address_record(result) if result is not None and error is None else {}
+            record['error'] = error
+            records.append(record)
+        return records
+
+    def health(self, request):
+        return {'providers': sorted(self.geocoders), 'routes': self.router is not None}
+
+
+def _field(request, name):
+    value = request.get(name)
+    if value is None or value == '':
+        raise BadRequest('{0} is required'.format(name))
+    return value
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    endpoints = {'/geocode': 'geocode', '/reverse': 'reverse', '/route': 'route', '/batch': 'batch',
+                 '/health': 'health'}
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path == '/metrics':
+            self._send(200, self.server.service.metrics.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+            return
+        request = {name: values if len(values) > 1 else values[0]
+                   for name, values in urllib.parse.parse_qs(url.query).items()}
+        if 'options' in request:
+            try:
+                request['options'] = json.loads(request['options'])
+            except ValueError:
+                self._send_json(400, {'error': 'options must be a JSON object'})
+                return
+        self._respond(url.path, request)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request = json.loads(self.rfile.read(length)) if length else {}
+        except ValueError:
+            self._send_json(400, {'error': 'The request body is not valid JSON'})
+            return
+        if not isinstance(request, dict):
+            self._send_json(400, {'error': 'The request body must be a JSON object'})
+            return
+        self._respond(urllib.parse.urlparse(self.path).path, request)
+
+    def _respond(self, path, request):
+        endpoint = self.endpoints.get(path)
+        if endpoint is None:
+            self._send_json(404, {'error': 'Not found'})
+            return
+        try:
+            self._send_json(200, getattr(self.server.service, endpoint)(request))
+        except BadRequest as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            self._send_json(502, {'error': str(e) or type(e).__name__})
+
+    def _send_json(self, status, data):
+        self._send(status, json.dumps(data).encode('utf-8'), 'application/json')
+
+    def _send(self, status, payload, content_type):
+        # The status line, headers and body go out in one write, so Nagle's algorithm does not hold back the body
+        head = 'HTTP/1.1 {0} {1}\r\nContent-Type: {2}\r\nContent-Length: {3}\r\n\r\n'.format(
+            status, self.responses[status][0], content_type, len(payload))
+        self.wfile.write(head.encode('latin-1') + payload)
+
+
+class HTTPServer(ThreadingHTTPServer):
+    """Answers requests for a Service on a TCP port, each connection on its own thread"""
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def __init__(self, service, host='127.0.0.1', port=8765):
+        super().__init__((host, port), _Handler)
+        self.service = service
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Answers requests for a Service on a Unix socket, which only processes on the same machine can reach"""
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def __init__(self, service, path):
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, _Handler)
+        self.service = service
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve geocode, route and batch requests from warm provider objects')
+    parser.add_argument('--host', default='127.0.0.1', help='The address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='The port to listen on')
+    parser.add_argument('--socket', help='Listen on this Unix socket path instead of a port')
+    parser.add_argument('--mapquest-key', help='The MapQuest api key. Read from MAPQUEST_KEY if not given')
+    parser.add_argument('--bing-key', help='The Bing api key. Read from BING_KEY if not given')
+    parser.add_argument('--cache', help='The path of a SQLite file to cache responses in')
+    parser.add_argument('--rate', type=float, help='The most requests per second to send to each provider')
+    parser.add_argument('--pool-size', type=int, default=32, help='The keep-alive connections per provider')
+    parser.add_argument('--workers', type=int, default=16, help='The maximum requests in flight for a batch')
+    args = parser.parse_args(argv)
+
+    mapquest_key = args.mapquest_key or os.environ.get('MAPQUEST_KEY')
+    bing_key = args.bing_key or os.environ.get('BING_KEY')
+    if not mapquest_key and not bing_key:
+        parser.error('a MapQuest or Bing key is required')
+    response_cache = cache.TieredCache(cache.MemoryCache(), cache.SQLiteCache(args.cache)) if args.cache else \
+        cache.MemoryCache()
+    rate_limiter = ratelimit.RateLimiter(args.rate) if args.rate else None
+    service = Service(mapquest_key, bing_key, response_cache, rate_limiter, args.pool_size, args.workers)
+
+    server = UnixServer(service, args.socket) if args.socket else HTTPServer(service, args.host, args.port)
+    print('Listening on {0}'.format(args.socket or 'http://{0}:{1}'.format(args.host, server.server_port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,529 @@
+"""A bulk runner that spreads geocoding and routing over processes on one machine
+
+Parsing responses and building results hold the GIL, so past a point more threads in one process do not add
+throughput. ShardedRunner runs one worker process per shard. Each worker keeps its own pooled provider object, and
+rows are sent to a shard by a hash of their normalized query. Repeats of an address therefore always reach the same
+worker, where its cache and single flight can answer them. Results are yielded in input order whichever shard finished
+first.
+
+WorkQueue spreads a job over several worker commands through a SQLite file, so a long job survives a worker that
+stops part way. The input is stored as chunks, each worker leases a chunk at a time and runs it with its own
+ShardedRunner, and a chunk whose lease runs out without being finished is handed to another worker. Results are read
+back in input order once every chunk is finished. A chunk that has been leased max_attempts times without being
+finished, such as one holding a row that crashes its worker, is finished with an error for each of its rows instead of
+being leased again. The queue is for workers on one host only: sharing the file between machines relies on the locking
+of a network filesystem, which SQLite cannot count on. To use more machines, run a separate job on each.
+
+Example:
+    python sharded.py run addresses.csv geocoded.csv --provider bing --processes 8
+    python sharded.py run routes.csv routed.csv --provider route --route-option optmz=timeWithTraffic
+
+    python sharded.py enqueue job.db addresses.csv
+    python sharded.py work job.db --provider bing        (as many times as wanted, on the same host)
+    python sharded.py export job.db geocoded.csv
+"""
+import argparse
+import collections
+import concurrent.futures
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import Geocoder
+import bing
+import bulk
+import cache
+import concurrency
+
+route_fields = ['row', 'start', 'end', 'distance', 'duration', 'duration_traffic', 'error']
+
+# The provider object of a worker process, made once by _start_worker
+_worker = None
+
+
+def shard_key(provider, query, travelMode='Driving', route_options=None):
+    """Returns the normalized key rows are sharded by: the cache key of the address or route"""
+    if provider == 'route':
+        return cache.route_key(query[0], query[1], travelMode, route_options or {})
+    return cache.geocode_key(provider, query)
+
+
+def shard_of(key, shards):
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % shards
+
+
+def make_provider(provider, api_key, pool_size=8, cache_path=None):
+    """Creates the provider object for a worker
+
+    Args:
+        provider (str): mapquest, bing or route
+        api_key (str): The secret key for accessing the api
+        pool_size (int): The number of keep-alive connections to keep open
+        cache_path (str): The path of a SQLite file to cache responses in, shared by every worker
+
+    Returns:
+        obj: A Geocoder.Geocoder, bing.Geocoder or bing.RouteRetriever
+    """
+    response_cache = cache.SQLiteCache(cache_path) if cache_path else None
+    session = concurrency.make_session(pool_size)
+    if provider == 'mapquest':
+        return Geocoder.Geocoder(api_key, cache=response_cache, session=session)
+    if provider == 'bing':
+        return bing.Geocoder(api_key, cache=response_cache, session=session)
+    if provider == 'route':
+        return bing.RouteRetriever(api_key, cache=response_cache, session=session)
+    raise ValueError('provider must be mapquest, bing or route')
+
+
+def _start_worker(provider, api_key, pool_size, cache_path, travelMode, route_options):
+    global _worker
+    _worker = (make_provider(provider, api_key, pool_size, cache_path), pool_size, travelMode, route_options or {})
+
+
+def _run_chunk(rows):
+    """Runs a chunk of rows in a worker process
+
+    Returns:
+        list: A record dict for each row, in the order of the rows
+    """
+    provider, max_workers, travelMode, route_options = _worker
+    if not isinstance(provider, bing.RouteRetriever):
+        return [bulk.to_record(*row) for row in bulk.geocode_chunk(provider, rows, max_workers)]
+
+    queries = {index: (start, end, travelMode) for index, (_, (start, end)) in enumerate(rows)}
+    routes = [None] * len(rows)
+    for index, route, error in concurrency.run_concurrently(lambda query: provider.get_route(*query, **route_options),
+                                                            queries, max_workers):
+        routes[index] = (route, None if error is None else str(error))
+    return [route_record(row_number, start, end, route, error)
+            for (row_number, (start, end)), (route, error) in zip(rows, routes)]
+
+
+def route_record(row_number, start, end, route, error):
+    """Flattens a routed row into a dict with the route_fields"""
+    record = {'row': row_number, 'start': start, 'end': end, 'error': error}
+    if route is not None and error is None:
+        for field in route_fields[3:-1]:
+            record[field] = getattr(route, field)
+    return record
+
+
+def read_routes(path, start_column='start', end_column='end', file_format=None):
+    """Reads start and end addresses from a CSV or JSON lines file one row at a time
+
+    Yields:
+        tuple: The row number, counting from 0, and a (start, end) tuple
+    """
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            for row_number, row in enumerate(csv.DictReader(f)):
+                yield row_number, (row.get(start_column) or '', row.get(end_column) or '')
+        else:
+            for row_number, line in enumerate(f):
+                record = json.loads(line) if line.strip() else {}
+                yield row_number, (record.get(start_column) or '', record.get(end_column) or '')
+
+
+class ShardedRunner:
+    """Runs rows through a pool of worker processes, one per shard, yielding their records in input order
+
+    The processes are started once and reused by every call to run, so their connections and caches stay warm.
+    """
+    def __init__(self, provider, api_key, processes=None, chunk_size=100, max_workers=8, cache_path=None,
+                 travelMode='Driving', route_options=None, max_buffered=None):
+        """The constructor for the sharded runner
+
+        Args:
+            provider (str): mapquest, bing or route
+            api_key (str): The secret key for accessing the api
+            processes (int): The number of worker processes and shards. Defaults to the number of CPUs
+            chunk_size (int): The number of rows of a shard sent to its worker at once
+            max_workers (int): The maximum number of requests in flight in each worker
+            cache_path (str): The path of a SQLite file every worker caches responses in
+            travelMode (str): The mode of travel for routes
+            route_options (dict): Additional parameters sent with every route request, as accepted by
+                bing.RouteRetriever.calculate_route
+            max_buffered (int): The most rows read ahead of the oldest row without a record. Bounds memory when one
+                shard is slow. Defaults to four chunks per process
+        """
+        self.provider = provider
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.travelMode = travelMode
+        self.route_options = route_options or {}
+        self.max_buffered = max_buffered or self.processes * chunk_size * 4
+        initargs = (provider, api_key, max_workers, cache_path, travelMode, route_options)
+        # One single process pool per shard, so every row of a shard goes to the same worker
+        self._pools = [concurrent.futures.ProcessPoolExecutor(1, initializer=_start_worker, initargs=initargs)
+                       for _ in range(self.processes)]
+
+    def run(self, rows):
+        """Runs every row, reading the input lazily
+
+        Args:
+            rows (iterable): (row number, query) tuples. A query is an address, or a (start, end) tuple for routes.
+                Row numbers must be unique
+
+        Yields:
+            dict: The record for each row, in input order. See bulk.output_fields and route_fields
+
+        Raises:
+            Exception: What a worker raised for a chunk, such as for an invalid api key
+        """
+        buffers = [[] for _ in self._pools]
+        waiting = collections.deque()
+        in_flight = set()
+        records = {}
+
+        def submit(shard):
+            in_flight.add(self._pools[shard].submit(_run_chunk, buffers[shard]))
+            buffers[shard] = []
+
+        def ready(limit):
+            """Yields the records that are next in input order, waiting for chunks until at most limit rows wait"""
+            while waiting:
+                for future in [future for future in in_flight if future.done()]:
+                    in_flight.discard(future)
+                    records.update((record['row'], record) for record in future.result())
+                while waiting and waiting[0] in records:
+                    yield records.pop(waiting.popleft())
+                if len(waiting) <= limit:
+                    return
+                concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+
+        for row_number, query in rows:
+            waiting.append(row_number)
+            shard = shard_of(shard_key(self.provider, query, self.travelMode, self.route_options), len(self._pools))
+            buffers[shard].append((row_number, query))
+            if len(buffers[shard]) >= self.chunk_size:
+                submit(shard)
+            if len(waiting) >= self.max_buffered:
+                # Send the partial chunks too, so the oldest rows are being worked on, then wait for them
+                for shard in range(len(buffers)):
+                    if buffers[shard]:
+                        submit(shard)
+                yield from ready(self.max_buffered // 2)
+            else:
+                yield from ready(len(waiting))
+
+        for shard in range(len(buffers)):
+            if buffers[shard]:
+                submit(shard)
+        yield from ready(0)
+
+    def close(self):
+        for pool in self._pools:
+            pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class WorkQueue:
+    """Chunks of a job stored in a SQLite file, leased out to the nodes working on it
+
+    A node leases the oldest chunk that is neither finished nor leased, and must finish it before the lease runs out or
+    another node may take it over. A chunk is finished by whichever node completes it first. Every node must run on the
+    host that holds the file, since SQLite's locking is not reliable on network filesystems.
+
+    Attributes:
+        path (str): The path to the database file
+        lease_seconds (float): How long a lease lasts before the chunk can be leased to another node
+        max_attempts (int): The number of leases of a chunk that may run out before it is given up on
+    """
+    def __init__(self, path, lease_seconds=300, timeout=60, max_attempts=3):
+        """The constructor for the work queue
+
+        Args:
+            path (str): The path to the database file. It is created if it does not exist
+            lease_seconds (float): How long a lease lasts before the chunk can be leased to another node
+            timeout (float): How long to wait for another node to release its lock on the database
+            max_attempts (int): The number of leases of a chunk that may run out before it is given up on. A chunk
+                given up on is finished with an error record for each of its rows
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self._connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, rows TEXT NOT NULL, '
+                                 'owner TEXT, expires REAL, attempts INTEGER NOT NULL DEFAULT 0, records TEXT)')
+
+    def add(self, rows, chunk_size=1000):
+        """Stores the rows of a job as chunks, after any chunks already stored
+
+        Args:
+            rows (iterable): (row number, query) tuples
+            chunk_size (int): The number of rows in each chunk
+
+        Returns:
+            int: The number of chunks stored
+        """
+        added = 0
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            for chunk in bulk.chunks(rows, chunk_size):
+                rows_text = json.dumps([(row_number, _encode_query(query)) for row_number, query in chunk])
+                self._connection.execute('INSERT INTO chunks (rows) VALUES (?)', (rows_text,))
+                added += 1
+            self._connection.execute('COMMIT')
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        return added
+
+    def lease(self, owner):
+        """Leases the oldest chunk that is not finished or already leased
+
+        Chunks whose last lease ran out after max_attempts leases are finished with an error record for each row first.
+
+        Args:
+            owner (str): Identifies the node taking the lease
+
+        Returns:
+            tuple: The id of the chunk and its rows, or None if no chunk is available
+        """
+        now = time.time()
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            for chunk_id, rows, attempts in self._connection.execute(
+                    'SELECT id, rows, attempts FROM chunks WHERE records IS NULL AND expires < ? AND attempts >= ?',
+                    (now, self.max_attempts)).fetchall():
+                error = 'Not finished after {0} leases'.format(attempts)
+                records = [_error_record(row_number, _decode_query(query), error)
+                           for row_number, query in json.loads(rows)]
+                self._connection.execute('UPDATE chunks SET records = ?, expires = NULL WHERE id = ?',
+                                         (json.dumps(records), chunk_id))
+            row = self._connection.execute('SELECT id, rows FROM chunks WHERE records IS NULL AND '
+                                           '(expires IS NULL OR expires < ?) ORDER BY id LIMIT 1', (now,)).fetchone()
+            if row is not None:
+                self._connection.execute('UPDATE chunks SET owner = ?, expires = ?, attempts = attempts + 1 '
+                                         'WHERE id = ?', (owner, now + self.lease_seconds, row[0]))
+            self._connection.execute('COMMIT')
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return row[0], [(row_number, _decode_query(query)) for row_number, query in json.loads(row[1])]
+
+    def renew(self, chunk_id, owner):
+        """Extends a lease. Returns False if the lease has been taken over by another node"""
+        return bool(self._connection.execute('UPDATE chunks SET expires = ? WHERE id = ? AND owner = ? AND '
+                                             'records IS NULL', (time.time() + self.lease_seconds, chunk_id,
+                                                                 owner)).rowcount)
+
+    def complete(self, chunk_id, records):
+        """Stores the records of a leased chunk. Returns False if another node finished the chunk first"""
+        return bool(self._connection.execute('UPDATE chunks SET records = ?, expires = NULL WHERE id = ? AND '
+                                             'records IS NULL', (json.dumps(records), chunk_id)).rowcount)
+
+    def progress(self):
+        """Returns the number of chunks finished, leased and waiting as a dict"""
+        finished, leased, total = self._connection.execute(
+            'SELECT COUNT(records), SUM(records IS NULL AND expires >= ?), COUNT(*) FROM chunks',
+            (time.time(),)).fetchone()
+        leased = leased or 0
+        return {'finished': finished, 'leased': leased, 'waiting': total - finished - leased}
+
+    def records(self):
+        """Yields the record of every row in input order
+
+        Raises:
+            RuntimeError: If any chunk is not finished
+        """
+        unfinished = self._connection.execute('SELECT COUNT(*) FROM chunks WHERE records IS NULL').fetchone()[0]
+        if unfinished:
+            raise RuntimeError('{0} chunks are not finished'.format(unfinished))
+        for (records,) in self._connection.execute('SELECT records FROM chunks ORDER BY id'):
+            yield from json.loads(records)
+
+    def close(self):
+        self._connection.close()
+
+
+def _encode_query(query):
+    """Returns a query in the form it is stored in a work queue. An UnreadableRow is stored with its error"""
+    if isinstance(query, bulk.UnreadableRow):
+        return {'unreadable': query.error}
+    return query
+
+
+def _decode_query(query):
+    """Rebuilds a query stored by _encode_query"""
+    if isinstance(query, dict):
+        return bulk.UnreadableRow(query['unreadable'])
+    # JSON turns the (start, end) tuples of route rows into lists
+    return tuple(query) if isinstance(query, list) else query
+
+
+def _error_record(row_number, query, error):
+    """Returns the record of a row that was given up on"""
+    if isinstance(query, tuple):
+        return {'row': row_number, 'start': query[0], 'end': query[1], 'error': error}
+    return {'row': row_number, 'address': query, 'error': error}
+
+
+def _renew_lease(queue, chunk_id, owner, stop):
+    """Renews a lease every third of the lease time until stop is set or another node takes the chunk over. Runs on its
+    own thread, with its own connection since a SQLite connection belongs to the thread that made it"""
+    renewer = WorkQueue(queue.path, queue.lease_seconds, queue.timeout)
+    try:
+        while not stop.wait(queue.lease_seconds / 3) and renewer.renew(chunk_id, owner):
+            pass
+    finally:
+        renewer.close()
+
+
+def work(queue, runner, owner=None, poll_seconds=None):
+    """Leases chunks from a work queue and runs them until the queue has no work left
+
+    The lease of the chunk being run is renewed on a timer from another thread, so it is kept however long the chunk
+    takes to return its first record.
+
+    Args:
+        queue (obj): The WorkQueue
+        runner (obj): The ShardedRunner to run each chunk with
+        owner (str): Identifies this node. Defaults to the process id and a random suffix
+        poll_seconds (float): When given, wait this long and look again when every remaining chunk is leased by other
+            nodes, so chunks whose leases run out are picked up. Otherwise return as soon as nothing can be leased
+
+    Returns:
+        int: The number of chunks this node finished
+    """
+    owner = owner or '{0}-{1}'.format(os.getpid(), uuid.uuid4().hex[:8])
+    finished = 0
+    while True:
+        leased = queue.lease(owner)
+        if leased is None:
+            progress = queue.progress()
+            if poll_seconds is None or not progress['leased'] + progress['waiting']:
+                return finished
+            time.sleep(poll_seconds)
+            continue
+        chunk_id, rows = leased
+        stop = threading.Event()
+        renewer = threading.Thread(target=_renew_lease, args=(queue, chunk_id, owner, stop), daemon=True)
+        renewer.start()
+        try:
+            records = list(runner.run(rows))
+        finally:
+            stop.set()
+            renewer.join()
+        finished += queue.complete(chunk_id, records)
+
+
+def write_records(records, output_path, fields):
+    """Writes records to a CSV file
+
+    Returns:
+        int: The number of records written
+    """
+    written = 0
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            written += 1
+    return written
+
+
+def _read_input(args):
+    if args.provider == 'route':
+        return read_routes(args.input, args.start_column, args.end_column, args.format)
+    return bulk.read_addresses(args.input, args.column, args.format)
+
+
+def route_option(text):
+    """Parses a --route-option argument of the form name=value. A value that is valid JSON, such as a number or a list,
+    is sent as that value and any other value as a string"""
+    name, separator, value = text.partition('=')
+    if not separator or not name:
+        raise argparse.ArgumentTypeError('a route option must be given as name=value')
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def _runner(args):
+    api_key = args.key or os.environ.get('MAPQUEST_KEY' if args.provider == 'mapquest' else 'BING_KEY') or \
+        input('Enter the api key: ')
+    return ShardedRunner(args.provider, api_key, args.processes, args.chunk_size, args.workers, args.cache,
+                         args.travel_mode, dict(args.route_option or []))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Geocode or route a file of rows across the processes of one machine. '
+                                                 'The workers of a work queue must all run on the machine that holds '
+                                                 'its file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='Run a file on this machine')
+    run_parser.add_argument('input', help='The CSV or JSON lines file of rows')
+    run_parser.add_argument('output', help='The CSV file to write the results to')
+    enqueue_parser = commands.add_parser('enqueue', help='Store the rows of a file as chunks of a work queue')
+    enqueue_parser.add_argument('queue', help='The SQLite file of the work queue')
+    enqueue_parser.add_argument('input', help='The CSV or JSON lines file of rows')
+    enqueue_parser.add_argument('--queue-chunk-size', type=int, default=1000, help='The number of rows in a chunk')
+    work_parser = commands.add_parser('work', help='Run chunks of a work queue on this machine')
+    work_parser.add_argument('queue', help='The SQLite file of the work queue')
+    work_parser.add_argument('--poll', type=float, help='Seconds to wait for chunks leased by other workers')
+    export_parser = commands.add_parser('export', help='Write the results of a finished work queue in input order')
+    export_parser.add_argument('queue', help='The SQLite file of the work queue')
+    export_parser.add_argument('output', help='The CSV file to write the results to')
+
+    for command in (run_parser, enqueue_parser, work_parser, export_parser):
+        command.add_argument('--provider', choices=['mapquest', 'bing', 'route'], default='mapquest')
+    for command in (enqueue_parser, work_parser, export_parser):
+        command.add_argument('--lease', type=float, default=300, help='Seconds a node has to finish a chunk')
+        command.add_argument('--max-attempts', type=int, default=3,
+                             help='Leases of a chunk that may run out before its rows are written with an error')
+    for command in (run_parser, enqueue_parser):
+        command.add_argument('--column', default='address', help='The column or key holding the address')
+        command.add_argument('--start-column', default='start', help='The column or key holding a route start')
+        command.add_argument('--end-column', default='end', help='The column or key holding a route end')
+        command.add_argument('--format', choices=['csv', 'jsonl'], help='The input format')
+    for command in (run_parser, work_parser):
+        command.add_argument('--key', help='The api key. Read from MAPQUEST_KEY or BING_KEY if not given')
+        command.add_argument('--processes', type=int, help='The number of worker processes. Defaults to the CPUs')
+        command.add_argument('--chunk-size', type=int, default=100, help='The number of rows sent to a worker at once')
+        command.add_argument('--workers', type=int, default=8, help='The maximum requests in flight per process')
+        command.add_argument('--cache', help='The path of a SQLite file to cache responses in')
+        command.add_argument('--travel-mode', default='Driving', help='The mode of travel for routes')
+        command.add_argument('--route-option', type=route_option, action='append', metavar='NAME=VALUE',
+                             help='A parameter sent with every route request, such as optmz=timeWithTraffic. Repeat '
+                                  'for more parameters')
+    args = parser.parse_args(argv)
+    fields = route_fields if args.provider == 'route' else bulk.output_fields
+
+    if args.command == 'run':
+        with _runner(args) as runner:
+            written = write_records(runner.run(_read_input(args)), args.output, fields)
+        print('Wrote {0} rows'.format(written))
+        return
+
+    queue = WorkQueue(args.queue, args.lease, max_attempts=args.max_attempts)
+    try:
+        if args.command == 'enqueue':
+            print('Stored {0} chunks'.format(queue.add(_read_input(args), args.queue_chunk_size)))
+        elif args.command == 'work':
+            with _runner(args) as runner:
+                print('Finished {0} chunks'.format(work(queue, runner, poll_seconds=args.poll)))
+        else:
+            print('Wrote {0} rows'.format(write_records(queue.records(), args.output, fields)))
+    finally:
+        queue.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""A module for making one request for lookups of the same thing that happen at the same time
+
+SingleFlight runs one call per key at a time. A caller that asks for a key while a call for it is already running
+waits for that call and gets its result, or its exception, instead of making a call of its own. Provider objects run
+their requests through one, keyed by the normalized cache key, so a hot address searched by many threads at once is
+only requested once. AsyncSingleFlight does the same for coroutines on one event loop.
+
+collapse removes the duplicates from a list of inputs before they are sent, and gives the positions needed to fan the
+results back out to every input afterwards.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Shares one in flight call between every thread that asks for the same key
+
+    Attributes:
+        shared (int): The number of calls answered by waiting for another caller's call
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+    def do(self, key, function, *args, **kwargs):
+        """Calls function unless a call for key is already running, in which case its outcome is returned
+
+        Args:
+            key (hashable): Identifies calls that would return the same thing
+            function (callable): Called with args and kwargs when no call for key is running
+
+        Returns:
+            obj: What the call for key returned
+
+        Raises:
+            Exception: What the call for key raised
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def __len__(self):
+        """The number of calls in flight"""
+        return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """Shares one in flight coroutine between every task on an event loop that asks for the same key
+
+    Attributes:
+        shared (int): The number of calls answered by waiting for another caller's call
+    """
+    def __init__(self):
+        self._calls = {}
+        self.shared = 0
+
+    async def do(self, key, function, *args, **kwargs):
+        """Awaits function(*args, **kwargs) unless a call for key is already running, in which case its outcome is
+        returned. The shared call is only cancelled once every caller waiting for it has been cancelled.
+
+        Returns:
+            obj: What the call for key returned
+        """
+        entry = self._calls.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(function(*args, **kwargs))
+            entry = self._calls[key] = [task, 0]
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.shared += 1
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            entry[1] -= 1
+            if not entry[1] and not task.done():
+                task.cancel()
+            raise
+
+    def __len__(self):
+        return len(self._calls)
+
+
+def collapse(values, key=None):
+    """Removes duplicates from a list, keeping the first of each
+
+    Args:
+        values (iterable): The values
+        key (callable): Gives the value duplicates are compared by. Defaults to the value itself
+
+    Returns:
+        tuple: The unique values in order of first appearance, and for each input value the position of its unique
+            value. Example: ['a', 'b'], [0, 1, 0] for ['a', 'b', 'a']
+    """
+    positions = {}
+    unique = []
+    inverse = []
+    for value in values:
+        value_key = value if key is None else key(value)
+        position = positions.get(value_key)
+        if position is None:
+            position = positions[value_key] = len(unique)
+            unique.append(value)
+        inverse.append(position)
+    return unique, inverse
@@ -0,0 +1,202 @@
+"""A module for finding the closest already geocoded address to a coordinate
+
+SpatialIndex buckets address results into a grid of cells a fixed number of degrees wide. A lookup only measures the
+distance to results in the cells around the coordinate. nearest_many answers a whole array of coordinates at once,
+grouping them by cell so the distances for each group are computed in one NumPy operation.
+
+The columns of the grid wrap around at the antimeridian, so coordinates on either side of longitude 180 are found as
+neighbours. A SpatialIndex can be added to and searched from many threads at once.
+"""
+import array
+import math
+import threading
+
+earth_radius = 6371008.8
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """Returns the distance in meters between two coordinates"""
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = math.sin((latitude2 - latitude1) / 2) ** 2 + \
+        math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2
+    return 2 * earth_radius * math.asin(math.sqrt(a))
+
+
+def haversine_arrays(latitudes1, longitudes1, latitudes2, longitudes2):
+    """Returns the distances in meters between NumPy arrays of coordinates, broadcasting the arrays together"""
+    import numpy
+    latitudes1, longitudes1, latitudes2, longitudes2 = map(numpy.radians,
+                                                            (latitudes1, longitudes1, latitudes2, longitudes2))
+    a = numpy.sin((latitudes2 - latitudes1) / 2) ** 2 + \
+        numpy.cos(latitudes1) * numpy.cos(latitudes2) * numpy.sin((longitudes2 - longitudes1) / 2) ** 2
+    return 2 * earth_radius * numpy.arcsin(numpy.sqrt(a))
+
+
+class SpatialIndex:
+    """A grid index over the coordinates of address results
+
+    Attributes:
+        tolerance (float): The furthest, in meters, a result can be from a coordinate to be returned for it
+        results (list): The indexed results
+    """
+    def __init__(self, tolerance=50.0, cell_degrees=None):
+        """The constructor for the spatial index
+
+        Args:
+            tolerance (float): The furthest, in meters, a result can be from a coordinate to be returned for it
+            cell_degrees (float): The width of a grid cell in degrees. Defaults to the tolerance in degrees of latitude
+        """
+        self.tolerance = tolerance
+        self.cell_degrees = cell_degrees or max(tolerance / 111195.0, 1e-5)
+        self.results = []
+        self._columns = int(math.ceil(360.0 / self.cell_degrees))
+        self._lock = threading.Lock()
+        self._latitudes = array.array('d')
+        self._longitudes = array.array('d')
+        self._cells = {}
+
+    @classmethod
+    def from_results(cls, results, tolerance=50.0):
+        index = cls(tolerance)
+        for result in results:
+            index.add(result)
+        return index
+
+    def _cell(self, latitude, longitude):
+        column = int(math.floor((longitude + 180.0) / self.cell_degrees)) % self._columns
+        return int(math.floor(latitude / self.cell_degrees)), column
+
+    def _neighbour_rows(self):
+        """Returns how many rows either side of a coordinate's cell may hold a result within tolerance of it"""
+        return int(math.ceil(self.tolerance / 111195.0 / self.cell_degrees))
+
+    def _neighbour_columns(self, numpy, latitudes):
+        """Returns how many columns either side of the cell of each coordinate in a NumPy array may hold a result within
+        tolerance of it. Degrees of longitude shrink towards the poles, so more columns are needed there"""
+        polar_edge = numpy.minimum(numpy.abs(latitudes) + self.cell_degrees, 89.9)
+        columns = numpy.ceil(self._neighbour_rows() / numpy.cos(numpy.radians(polar_edge))).astype(numpy.int64)
+        return numpy.minimum(columns, self._columns // 2)
+
+    def _neighbour_offsets(self, latitude):
+        """Returns the row and column offsets of the cells that may hold a result within tolerance of a coordinate at
+        this latitude"""
+        rows = self._neighbour_rows()
+        polar_edge = min(abs(latitude) + self.cell_degrees, 89.9)
+        columns = min(int(math.ceil(rows / math.cos(math.radians(polar_edge)))), self._columns // 2)
+        return [(r, c) for r in range(-rows, rows + 1) for c in range(-columns, columns + 1)]
+
+    def _neighbour_cells(self, latitude, longitude):
+        """Returns the cells that may hold a result within tolerance of the coordinate"""
+        row, column = self._cell(latitude, longitude)
+        return list(dict.fromkeys((row + r, (column + c) % self._columns)
+                                  for r, c in self._neighbour_offsets(latitude)))
+
+    def add(self, result):
+        """Adds an address result. Results without coordinates are ignored
+
+        Returns:
+            bool: True if the result was added
+        """
+        if result.latitude is None or result.longitude is None:
+            return False
+        latitude, longitude = float(result.latitude), float(result.longitude)
+        with self._lock:
+            self._cells.setdefault(self._cell(latitude, longitude), []).append(len(self.results))
+            self.results.append(result)
+            self._latitudes.append(latitude)
+            self._longitudes.append(longitude)
+        return True
+
+    def nearest(self, latitude, longitude):
+        """Returns the closest result within tolerance of a coordinate
+
+        Returns:
+            tuple: The result and its distance in meters, or None if no result is within tolerance
+        """
+        best, best_distance = None, self.tolerance
+        with self._lock:
+            for cell in self._neighbour_cells(latitude, longitude):
+                for position in self._cells.get(cell, ()):
+                    distance = haversine(latitude, longitude, self._latitudes[position], self._longitudes[position])
+                    if distance <= best_distance:
+                        best, best_distance = position, distance
+            if best is None:
+                return None
+            return self.results[best], float(best_distance)
+
+    def nearest_many(self, latitudes, longitudes):
+        """Finds the closest result within tolerance of each coordinate in arrays of coordinates
+
+        The indexed points are sorted by cell, and each neighbouring cell of every coordinate is found with a binary
+        search over that order. Coordinates are grouped by how many neighbouring columns their latitude needs, so the
+        work is done in whole-array NumPy operations for each group rather than a Python loop per coordinate.
+
+        Args:
+            latitudes (array-like): The latitudes
+            longitudes (array-like): The longitudes
+
+        Returns:
+            tuple: An int64 NumPy array with the position in results of the closest result for each coordinate, or -1,
+                and a float array of the distances in meters, NaN where there is no result
+        """
+        import numpy
+        latitudes = numpy.asarray(latitudes, dtype=numpy.float64)
+        longitudes = numpy.asarray(longitudes, dtype=numpy.float64)
+        positions = numpy.full(len(latitudes), -1, dtype=numpy.int64)
+        distances = numpy.full(len(latitudes), numpy.inf)
+        if not len(latitudes):
+            return positions, numpy.where(positions < 0, numpy.nan, distances)
+
+        # Copies, so the arrays can keep growing while this runs. A view of their buffers would stop add resizing them
+        with self._lock:
+            indexed_latitudes = numpy.array(self._latitudes, dtype=numpy.float64)
+            indexed_longitudes = numpy.array(self._longitudes, dtype=numpy.float64)
+        if not len(indexed_latitudes):
+            return positions, numpy.where(positions < 0, numpy.nan, distances)
+        indexed_rows, indexed_columns = self._cell_arrays(numpy, indexed_latitudes, indexed_longitudes)
+        indexed_keys = _combine(indexed_rows, indexed_columns)
+        order = numpy.argsort(indexed_keys, kind='stable')
+        sorted_keys = indexed_keys[order]
+
+        rows, columns = self._cell_arrays(numpy, latitudes, longitudes)
+        row_reach = self._neighbour_rows()
+        widths = self._neighbour_columns(numpy, latitudes)
+        # Coordinates are searched in groups needing the same number of columns, so a few coordinates near a pole do
+        # not widen the search of every other coordinate
+        for width in numpy.unique(widths).tolist():
+            group = numpy.nonzero(widths == width)[0]
+            for row_offset in range(-row_reach, row_reach + 1):
+                for column_offset in range(-width, width + 1):
+                    keys = _combine(rows[group] + row_offset, (columns[group] + column_offset) % self._columns)
+                    first = numpy.searchsorted(sorted_keys, keys, side='left')
+                    counts = numpy.searchsorted(sorted_keys, keys, side='right') - first
+                    # Cells rarely hold more than a few points, so step through the k-th point of every cell at once
+                    for k in range(int(counts.max())):
+                        hits = numpy.nonzero(counts > k)[0]
+                        queries = group[hits]
+                        candidates = order[first[hits] + k]
+                        candidate_distances = haversine_arrays(latitudes[queries], longitudes[queries],
+                                                               indexed_latitudes[candidates],
+                                                               indexed_longitudes[candidates])
+                        closer = candidate_distances < distances[queries]
+                        distances[queries[closer]] = candidate_distances[closer]
+                        positions[queries[closer]] = candidates[closer]
+
+        outside = distances > self.tolerance
+        positions[outside] = -1
+        distances[outside] = numpy.nan
+        return positions, distances
+
+    def _cell_arrays(self, numpy, latitudes, longitudes):
+        """Returns the cell rows and columns of NumPy arrays of coordinates"""
+        rows = numpy.floor(latitudes / self.cell_degrees).astype(numpy.int64)
+        columns = numpy.floor((longitudes + 180.0) / self.cell_degrees).astype(numpy.int64) % self._columns
+        return rows, columns
+
+    def __len__(self):
+        return len(self.results)
+
+
+def _combine(rows, columns):
+    """Packs NumPy arrays of cell rows and columns into one int64 key per cell"""
+    return rows * (1 << 32) + (columns + (1 << 31))
@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+# The modules live at the root of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='module')
+def server():
+    """A mock provider server shared by the tests of a module"""
+    import bench
+    with bench.MockProviderServer() as mock:
+        yield mock
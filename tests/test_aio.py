@@ -0,0 +1,44 @@
+import asyncio
+import threading
+import pytest
+import cache
+
+aio = pytest.importorskip('aio')
+pytest.importorskip('aiohttp')
+
+
+def mapquest_client(server, **options):
+    client = aio.AsyncGeocoder('key', **options)
+    client.search_api_url = server.url + '/geocoding/v1/address'
+    client.reverse_api_url = server.url + '/geocoding/v1/reverse'
+    return client
+
+
+def test_search_parses_and_stores_off_the_event_loop(server):
+    responses = cache.MemoryCache()
+    stored_on = []
+
+    async def search():
+        async with mapquest_client(server, cache=responses) as client:
+            store = client._provider._store
+            client._provider._store = lambda *args: stored_on.append(threading.current_thread()) or store(*args)
+            return await client.search('100 Main St, Minneapolis')
+
+    result = asyncio.run(search())
+    assert result.city == 'Minneapolis'
+    assert stored_on and stored_on[0] is not threading.main_thread()
+    assert responses.get(cache.geocode_key('mapquest', '100 Main St, Minneapolis')) is not None
+
+
+def test_provider_has_no_requests_session():
+    for client in (aio.AsyncGeocoder('key'), aio.AsyncBingGeocoder('key'), aio.AsyncRouteRetriever('key')):
+        assert client._provider._session is aio._no_session
+
+
+def test_zero_timeout_is_not_replaced_by_the_default(server):
+    async def search():
+        async with mapquest_client(server, timeout=60) as client:
+            return await client.search('100 Main St, Minneapolis', timeout=0)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(search())
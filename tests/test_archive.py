@@ -0,0 +1,51 @@
+import json
+import os
+import archive
+import bench
+
+
+def mapquest_text(address):
+    return json.dumps(bench.mapquest_response([address]))
+
+
+def test_latest_response_for_a_key_wins_across_segments(tmp_path):
+    store = archive.Archive(str(tmp_path), compression='gzip', block_records=2)
+    store.append('mapquest', 'mapquest:a', mapquest_text('1 Main St'))
+    store.append('mapquest', 'mapquest:b', mapquest_text('2 Main St'))
+    store.rotate()
+    store.append('mapquest', 'mapquest:a', mapquest_text('3 Main St'))
+    assert len(store) == 3
+    assert json.loads(store.get('mapquest:a')[1]) == bench.mapquest_response(['3 Main St'])
+    store.close()
+
+    store = archive.Archive(str(tmp_path))
+    assert json.loads(store.get('mapquest:a')[1]) == bench.mapquest_response(['3 Main St'])
+    assert store.get('mapquest:missing') is None
+    assert [key for key, _ in store.replay('mapquest')] == ['mapquest:a', 'mapquest:b', 'mapquest:a']
+    store.close()
+
+
+def test_unsealed_segment_is_recovered_without_its_partial_block(tmp_path):
+    store = archive.Archive(str(tmp_path), compression='gzip', block_records=1)
+    store.append('mapquest', 'mapquest:a', mapquest_text('1 Main St'))
+    store.append('mapquest', 'mapquest:b', mapquest_text('2 Main St'))
+    path = store._path
+    store._file.write(b'\x00\x01')
+    store._file.close()
+    size = os.path.getsize(path)
+
+    # Reopening without closing is what a crash leaves behind
+    recovered = archive.Archive(str(tmp_path))
+    assert os.path.getsize(path) == size - 2
+    assert recovered.result('mapquest:b').latitude == 44.97
+    recovered.close()
+
+
+def test_oldest_segments_are_removed_past_max_segments(tmp_path):
+    store = archive.Archive(str(tmp_path), compression='gzip', max_segments=1)
+    for number in range(3):
+        store.append('mapquest', 'mapquest:{0}'.format(number), mapquest_text('1 Main St'))
+        store.rotate()
+    assert store.get('mapquest:0') is None
+    assert store.get('mapquest:2') is not None
+    store.close()
@@ -0,0 +1,83 @@
+import csv
+import json
+import pytest
+import Geocoder
+import bulk
+import normalize
+
+
+def write_csv(path, addresses):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'address'])
+        for number, address in enumerate(addresses):
+            writer.writerow([number, address])
+
+
+def test_reading_from_an_offset_continues_where_the_rows_left_off(tmp_path):
+    path = str(tmp_path / 'addresses.csv')
+    write_csv(path, ['100 Main St', '200 Main St,\nMinneapolis', 'Ünïcode Ave', '', '300 Main St'])
+    rows = list(bulk.read_rows(path))
+    assert [address for _, address, _ in rows] == ['100 Main St', '200 Main St,\nMinneapolis', 'Ünïcode Ave', '',
+                                                    '300 Main St']
+    for row_number, _, offset in rows:
+        assert list(bulk.read_rows(path, offset=offset, row_number=row_number + 1)) == rows[row_number + 1:]
+
+
+def test_malformed_json_lines_are_written_with_an_error(tmp_path, server):
+    path = str(tmp_path / 'addresses.jsonl')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"address": "100 Main St"}\n{"address": "200 Main\n"300 Main St"\n\n')
+    rows = list(bulk.read_addresses(path))
+    assert rows[0] == (0, '100 Main St') and rows[2] == (2, '300 Main St') and rows[3] == (3, '')
+    assert isinstance(rows[1][1], bulk.UnreadableRow)
+
+    geocoder = server.point_at(Geocoder.Geocoder('key'))
+    errors = [error for _, _, _, error in bulk.geocode_chunk(geocoder, rows)]
+    assert errors[0] is None and errors[2] is None
+    assert errors[1].startswith('Not read: Line 2 is not valid JSON')
+    assert errors[3] == 'Not sent: empty'
+
+
+def test_queries_without_pandas(monkeypatch):
+    def missing_pandas(addresses):
+        raise ImportError('No module named pandas')
+
+    monkeypatch.setattr(normalize, 'prepare_queries', missing_pandas)
+    queries, inverse, reasons = bulk.prepare_queries(['81 First Street North, Paris', None, 'N/A', '81 1st St N Paris'])
+    assert queries == ['81 1st st n paris']
+    assert inverse == [0, -1, -1, 0]
+    assert reasons == [None, 'missing', 'placeholder', None]
+
+
+class FailingGeocoder(Geocoder.Geocoder):
+    """Stops the run with an error once it has searched fail_after chunks"""
+    def __init__(self, fail_after):
+        super().__init__('key')
+        self.fail_after = fail_after
+
+    def search_many(self, addresses, batch_size=100):
+        if not self.fail_after:
+            raise RuntimeError('stopped')
+        self.fail_after -= 1
+        return super().search_many(addresses, batch_size)
+
+
+def test_a_stopped_run_resumes_from_the_input_offset(tmp_path, server, monkeypatch):
+    input_path, output_path = str(tmp_path / 'addresses.csv'), str(tmp_path / 'geocoded.csv')
+    write_csv(input_path, ['{0} Main St, Minneapolis'.format(number) for number in range(10)])
+    with pytest.raises(RuntimeError):
+        bulk.run(server.point_at(FailingGeocoder(2)), input_path, output_path, chunk_size=3)
+    with open(output_path + '.checkpoint') as f:
+        checkpoint = json.load(f)
+    assert checkpoint['rows_done'] == 6 and checkpoint['input_offset'] > 0
+
+    offsets = []
+    read_rows = bulk.read_rows
+    monkeypatch.setattr(bulk, 'read_rows', lambda *args: offsets.append(args[3:]) or read_rows(*args))
+    assert bulk.run(server.point_at(Geocoder.Geocoder('key')), input_path, output_path, chunk_size=3) == 4
+    assert offsets == [(checkpoint['input_offset'], 6)]
+    with open(output_path, newline='', encoding='utf-8') as f:
+        records = list(csv.DictReader(f))
+    assert [int(record['row']) for record in records] == list(range(10))
+    assert all(not record['error'] for record in records)
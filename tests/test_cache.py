@@ -0,0 +1,80 @@
+import time
+import cache
+
+
+def test_geocode_key_ignores_case_and_spelling_of_abbreviations():
+    assert cache.geocode_key('bing', '100 Main Street, Paris') == cache.geocode_key('bing', '100 main st  paris')
+    assert cache.geocode_key('bing', '100 Main St') != cache.geocode_key('mapquest', '100 Main St')
+
+
+def test_route_key_ignores_option_order():
+    first = cache.route_key('1 Main St', '5 Oak Ave', 'Driving', {'optmz': 'time', 'du': 'mi'})
+    second = cache.route_key('1 main street', '5 oak avenue', 'driving', {'du': 'mi', 'optmz': 'time'})
+    assert first == second
+    assert first != cache.route_key('1 Main St', '5 Oak Ave', 'Driving', {'optmz': 'distance', 'du': 'mi'})
+
+
+def test_route_ttl_follows_optmz():
+    assert cache.route_ttl({'optmz': 'timeWithTraffic'}) == 15 * 60
+    assert cache.route_ttl({}) == cache.route_ttls[None]
+    assert cache.route_ttl({'optmz': 'unknown'}, {None: 5}) == 5
+
+
+def test_memory_cache_evicts_the_least_recently_used_entry():
+    store = cache.MemoryCache(max_entries=2)
+    store.set('a', '1')
+    store.set('b', '2')
+    assert store.get('a') == '1'
+    store.set('c', '3')
+    assert (store.get('a'), store.get('b'), store.get('c')) == ('1', None, '3')
+    assert store.stats() == {'entries': 2, 'hits': 3, 'misses': 1}
+
+
+def test_memory_cache_expires_entries():
+    store = cache.MemoryCache(ttl=60)
+    store.set('old', '1', ttl=-1)
+    store.set('new', '2')
+    assert store.get('old') is None
+    assert store.get('new') == '2'
+    assert len(store) == 1
+
+
+def test_sqlite_cache_persists_and_evicts(tmp_path):
+    path = str(tmp_path / 'responses.sqlite')
+    store = cache.SQLiteCache(path, max_entries=2)
+    store.set('a', '1')
+    time.sleep(0.01)
+    store.set('b', '2')
+    time.sleep(0.01)
+    store.set('c', '3')
+    store.close()
+
+    store = cache.SQLiteCache(path, max_entries=2)
+    assert len(store) == 2
+    assert (store.get('a'), store.get('b'), store.get('c')) == (None, '2', '3')
+    store.set('d', '4', ttl=-1)
+    assert store.get('d') is None
+    store.close()
+
+
+def test_tiered_cache_copies_persistent_hits_into_memory(tmp_path):
+    persistent = cache.SQLiteCache(str(tmp_path / 'responses.sqlite'))
+    persistent.set('a', '1')
+    tiered = cache.TieredCache(cache.MemoryCache(), persistent)
+    assert tiered.get('a') == '1'
+    assert tiered.memory.get('a') == '1'
+    tiered.set('b', '2')
+    assert persistent.get('b') == '2'
+    assert tiered.get('missing') is None
+    assert tiered.misses == 1
+    persistent.close()
+
+
+def test_delete_removes_an_entry_from_every_tier(tmp_path):
+    persistent = cache.SQLiteCache(str(tmp_path / 'responses.sqlite'))
+    tiered = cache.TieredCache(cache.MemoryCache(), persistent)
+    tiered.set('a', '1')
+    tiered.delete('a')
+    tiered.delete('missing')
+    assert (tiered.memory.get('a'), persistent.get('a'), len(persistent)) == (None, None, 0)
+    persistent.close()
@@ -0,0 +1,45 @@
+import threading
+import time
+import concurrency
+
+
+def test_errors_are_returned_with_their_query():
+    def square(value):
+        if value < 0:
+            raise ValueError(value)
+        return value * value
+
+    outcomes = {key: (result, error) for key, result, error in concurrency.run_concurrently(square, [3, -1, 2], 2)}
+    assert outcomes[0] == (9, None) and outcomes[2] == (4, None)
+    assert isinstance(outcomes[1][1], ValueError)
+    assert sorted(key for key, _, _ in concurrency.run_concurrently(square, {'a': 1, 'b': 2})) == ['a', 'b']
+
+
+def test_in_flight_queries_stay_within_max_workers():
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def slow(value):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    consumed = []
+    queries = (consumed.append(value) or value for value in range(20))
+    results = concurrency.run_concurrently(slow, queries, max_workers=2)
+    next(results)
+    # Only the queries in flight have been read from the input
+    assert len(consumed) == 2
+    assert len(list(results)) == 19
+    assert running[1] == 2
+
+
+def test_shared_session_is_one_session_for_the_process():
+    session = concurrency.shared_session()
+    assert concurrency.shared_session() is session
+    assert concurrency.shared_session(pool_size=4) is session
+    assert session.get_adapter('https://example.com')._pool_maxsize == 4
+    concurrency.shared_session(pool_size=10)
@@ -0,0 +1,41 @@
+import array
+import datetime
+import math
+import pytest
+import bench
+import bing
+import cache
+import instrumentation
+
+start = datetime.datetime(2021, 5, 4, 6, 0)
+step = datetime.timedelta(minutes=30)
+
+
+def test_profile_interpolates_between_departures():
+    profile = bing.DepartureProfile(start, step, array.array('f', [600, 900, math.nan]))
+    assert profile.end == start + 2 * step
+    assert profile.duration_at(start + step / 2) == 750
+    assert math.isnan(profile.duration_at(start + 2 * step))
+    with pytest.raises(ValueError):
+        profile.duration_at(start - step)
+    restored = bing.DepartureProfile.from_text(profile.to_text())
+    assert (restored.start, restored.step, restored.durations[:2].tolist()) == (start, step, [600, 900])
+
+
+def test_sweep_answers_departures_without_more_requests():
+    requests = []
+    events = instrumentation.EventEmitter()
+    events.subscribe(lambda event, provider, values: requests.append(event == 'request'))
+    with bench.MockProviderServer(itinerary_items=2) as server:
+        router = server.point_at(bing.RouteRetriever('key', cache=cache.MemoryCache(), events=events))
+        pairs = [('1 Main St', '5 Oak Ave'), ('2 Elm St', '6 Pine Ave'), ('1 Main St', '5 Oak Ave')]
+        profiles = router.sweep_departures(pairs, 'Driving', start, start + 4 * step, step)
+        assert profiles[0] is profiles[2]
+        assert [len(profile) for profile in profiles] == [5, 5, 5]
+        assert sum(requests) == 10
+        # The morning peak in the mock traffic makes 08:00 the slowest departure
+        assert max(profiles[0].departures(), key=profiles[0].duration_at) == datetime.datetime(2021, 5, 4, 8, 0)
+
+        duration = router.departure_duration('1 Main St', '5 Oak Ave', 'Driving', start + step / 3)
+        assert sum(requests) == 10
+        assert profiles[0].durations[0] < duration < profiles[0].durations[1]
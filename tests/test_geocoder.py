@@ -0,0 +1,46 @@
+import Geocoder
+import cache
+import spatial
+
+addresses = ['{0} Main St, Minneapolis'.format(number) for number in range(5)]
+
+
+def test_search_many_keeps_input_order_and_sends_repeats_once(server):
+    geocoder = server.point_at(Geocoder.Geocoder('key'))
+    results = list(geocoder.search_many(addresses[:3] + addresses[:2], batch_size=5))
+    assert len(results) == 5
+    # The mock server numbers the locations of a batch, so a repeat sent again would get a different coordinate
+    assert [result.latitude for result in results[3:]] == [result.latitude for result in results[:2]]
+    assert len({result.latitude for result in results}) == 3
+
+
+def test_search_many_adds_results_to_the_spatial_index(server):
+    index = spatial.SpatialIndex()
+    geocoder = server.point_at(Geocoder.Geocoder('key', spatial_index=index))
+    results = list(geocoder.search_many(addresses))
+    assert len(index) == len(results)
+    result, _ = index.nearest(results[2].latitude, results[2].longitude)
+    assert result is results[2]
+
+
+def test_search_many_answers_cached_addresses_without_a_request(server):
+    responses = cache.MemoryCache()
+    geocoder = server.point_at(Geocoder.Geocoder('key', cache=responses))
+    first = list(geocoder.search_many(addresses))
+    geocoder.batch_api_url = server.url + '/missing'
+    again = list(geocoder.search_many(addresses))
+    assert [result.street_address for result in again] == [result.street_address for result in first]
+    assert all(result.error is None for result in again)
+
+
+def test_a_bad_cached_response_only_affects_its_own_address(server):
+    responses = cache.MemoryCache()
+    geocoder = server.point_at(Geocoder.Geocoder('key', cache=responses))
+    list(geocoder.search_many(addresses))
+    bad_key = cache.geocode_key('mapquest', addresses[1])
+    responses.set(bad_key, '{"results": [')
+    results = list(geocoder.search_many(addresses))
+    assert all(result.error is None for result in results)
+    assert results[1].street_address is not None
+    # The bad entry was dropped and replaced by the response fetched again
+    assert responses.get(bad_key).startswith('{"info"')
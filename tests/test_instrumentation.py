@@ -0,0 +1,43 @@
+import Geocoder
+import bench
+import instrumentation
+
+
+def test_geocoder_requests_and_cache_lookups_are_counted():
+    events = instrumentation.EventEmitter()
+    registry = instrumentation.MetricsRegistry()
+    events.subscribe(registry.record)
+    with bench.MockProviderServer() as server:
+        geocoder = Geocoder.Geocoder('key', events=events)
+        server.point_at(geocoder)
+        geocoder.search('100 Main St, Paris')
+    snapshot = registry.snapshot()
+    requests = snapshot['addresslookup_requests_total']['series']
+    assert requests == [{'labels': {'provider': 'mapquest', 'status': '200'}, 'value': 1}]
+    phases = {series['labels']['phase'] for series in snapshot['addresslookup_phase_seconds']['series']}
+    assert {'wait', 'download', 'parse'} <= phases
+
+
+def test_unsubscribed_emitter_does_no_timing():
+    events = instrumentation.EventEmitter()
+    assert not events.enabled
+    assert events.timed('parse', 'bing', len, 'abc') == 3
+    seen = []
+    listener = events.subscribe(lambda *event: seen.append(event))
+    events.timed('parse', 'bing', len, 'abc')
+    events.unsubscribe(listener)
+    events.emit('retry', 'bing', attempt=0, delay=1.0)
+    assert [(event, provider, sorted(values)) for event, provider, values in seen] == \
+        [('parse', 'bing', ['bytes', 'seconds'])]
+
+
+def test_prometheus_histograms_are_cumulative():
+    registry = instrumentation.MetricsRegistry(latency_buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 5.0):
+        registry.record('parse', 'bing', {'seconds': seconds})
+    registry.record('request', 'bing', {'status': None, 'error': 'ConnectTimeout'})
+    text = registry.to_prometheus()
+    assert 'addresslookup_phase_seconds_bucket{provider="bing",phase="parse",le="1.0"} 2' in text
+    assert 'addresslookup_phase_seconds_bucket{provider="bing",phase="parse",le="+Inf"} 3' in text
+    assert 'addresslookup_phase_seconds_count{provider="bing",phase="parse"} 3' in text
+    assert 'addresslookup_request_errors_total{provider="bing",error="ConnectTimeout"} 1' in text
@@ -0,0 +1,105 @@
+import os
+import pytest
+import Geocoder
+import bench
+import localindex
+import normalize
+
+indexed_address = '12345 North Washington Avenue, Minneapolis, Minnesota 55401'
+
+
+def mapquest_result(address):
+    return Geocoder.AddressResult(bench.mapquest_response([address]))
+
+
+def make_index(directory, **options):
+    index = localindex.LocalIndex(str(directory), **options)
+    assert index.add('mapquest', indexed_address, mapquest_result(indexed_address))
+    index.flush()
+    return index
+
+
+def test_exact_lookup_after_reopening(tmp_path):
+    make_index(tmp_path).close()
+    index = localindex.LocalIndex(str(tmp_path))
+    result = index.lookup('mapquest', '12345 N Washington Ave, Minneapolis, Minnesota 55401')
+    assert result is not None
+    assert result.latitude == 44.97
+    assert index.lookup('bing', indexed_address) is None
+    index.close()
+
+
+def test_near_duplicates_are_not_returned_by_default(tmp_path):
+    index = make_index(tmp_path)
+    assert index.lookup('mapquest', '12345 North Washingtn Avenue, Minneapolis, Minnesota 55401') is None
+    index.close()
+
+
+def test_near_duplicates_need_the_same_number_directional_and_postal_code(tmp_path):
+    index = make_index(tmp_path, min_similarity=0.7)
+    assert index.lookup('mapquest', '12345 North Washingtn Avenue, Minneapolis, Minnesota 55401') is not None
+    for address in ['12346 North Washington Avenue, Minneapolis, Minnesota 55401',
+                    '12345 South Washington Avenue, Minneapolis, Minnesota 55401',
+                    '12345 North Washington Avenue, Minneapolis, Minnesota 55402']:
+        assert index.lookup('mapquest', address) is None, address
+    index.close()
+
+
+def test_common_trigrams_are_skipped(tmp_path):
+    index = localindex.LocalIndex(str(tmp_path), min_similarity=0.7, max_postings=5)
+    for number in range(20):
+        address = '{0} Main Street, Minneapolis, Minnesota 55401'.format(number)
+        index.add('mapquest', address, mapquest_result(address))
+    index.flush()
+    # Only the trigrams of the house number are in five addresses or fewer, too few to reach min_similarity
+    assert index.lookup('mapquest', '7 Main Stret, Minneapolis, Minnesota 55401') is None
+    index.max_postings = 1000
+    assert index.lookup('mapquest', '7 Main Stret, Minneapolis, Minnesota 55401') is not None
+    index.close()
+
+
+def test_low_scores_are_not_added(tmp_path):
+    index = localindex.LocalIndex(str(tmp_path), min_score=1.1)
+    assert not index.add('mapquest', indexed_address, mapquest_result(indexed_address))
+    assert len(index) == 0
+    index.close()
+
+
+def test_compact_keeps_every_address(tmp_path):
+    index = localindex.LocalIndex(str(tmp_path), flush_every=2)
+    addresses = ['{0} Main Street, Minneapolis, Minnesota 55401'.format(number) for number in range(5)]
+    for address in addresses:
+        index.add('mapquest', address, mapquest_result(address))
+    index.compact()
+    assert len(index) == 5
+    assert all(index.lookup('mapquest', address) is not None for address in addresses)
+    index.close()
+
+
+def test_a_failed_compact_keeps_the_old_segments(tmp_path, monkeypatch):
+    index = localindex.LocalIndex(str(tmp_path), flush_every=2)
+    addresses = ['{0} Main Street, Minneapolis, Minnesota 55401'.format(number) for number in range(5)]
+    for address in addresses:
+        index.add('mapquest', address, mapquest_result(address))
+    index.flush()
+    replace = os.replace
+
+    def fail_on_keys(source, destination):
+        if os.path.basename(destination) == 'keys-000001.idx':
+            raise OSError('disk full')
+        replace(source, destination)
+
+    monkeypatch.setattr(os, 'replace', fail_on_keys)
+    with pytest.raises(OSError):
+        index.compact()
+    index.close()
+    monkeypatch.undo()
+
+    # The merged trigram segment is in place next to the old ones, so entries are repeated until the next compact
+    index = localindex.LocalIndex(str(tmp_path), min_similarity=0.7)
+    assert all(index.lookup('mapquest', address) is not None for address in addresses)
+    index.compact()
+    assert len(index) == 5
+    assert len(index._trigram_segments[0]) == \
+        sum(len(localindex.trigrams(normalize.normalize_address(address))) for address in addresses)
+    index.close()
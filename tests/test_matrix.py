@@ -0,0 +1,26 @@
+import bing
+import instrumentation
+
+origins = [(44.97, -93.26), (44.98, -93.27)]
+destinations = [(44.99, -93.28), (44.97, -93.26), (45.0, -93.3)]
+
+
+def requested_urls(server, **options):
+    events = instrumentation.EventEmitter()
+    urls = []
+    events.subscribe(lambda event, provider, values: urls.append(values['url']) if event == 'request' else None)
+    retriever = server.point_at(bing.RouteRetriever('key', events=events))
+    matrix = retriever.calculate_matrix(origins, destinations, 'Driving', **options)
+    assert len(matrix.durations) == 2 and len(matrix.durations[0]) == 3
+    assert not matrix.errors
+    return urls
+
+
+def test_coordinates_use_the_distance_matrix_api(server):
+    urls = requested_urls(server, du='mi')
+    assert urls == [server.url + '/REST/v1/Routes/DistanceMatrix']
+
+
+def test_options_the_matrix_api_lacks_route_each_pair(server):
+    urls = requested_urls(server, optmz='distance')
+    assert urls and all('DistanceMatrix' not in url for url in urls)
@@ -0,0 +1,50 @@
+import pandas
+import pytest
+import normalize
+
+addresses = ['81 First Street North, Paris', '81 1st St. N Paris #4', '  100  MAIN st., Apt 4B, Minneapolis',
+             'Empire State Building 350 5th Ave, New York', '1 Unit 7 Rd', '500 Floor 2 Industrial Pkwy',
+             '12 Oak Avenue Unit B', 'Apt 4, 100 Main St', '1 #7 Rd', '', 'N/A']
+
+
+def test_normalize_address():
+    assert normalize.normalize_address('81 First Street North, Paris') == '81 1st st n paris'
+    assert normalize.normalize_address('81 1st St. N Paris') == '81 1st st n paris'
+
+
+def test_normalize_column_without_stripping_matches_normalize_address():
+    expected = [normalize.normalize_address(address) for address in addresses]
+    assert normalize.normalize_column(addresses, strip_units=False).tolist() == expected
+
+
+@pytest.mark.parametrize('address, expected', [
+    ('81 1st St. N Paris #4', '81 1st st n paris'),
+    ('100 Main St Apt 4B, Minneapolis', '100 main st minneapolis'),
+    ('100 Main St, Suite 200, Apt 3', '100 main st'),
+    ('12 Oak Avenue Unit B', '12 oak ave'),
+    # Words before the street suffix are part of the address, not a unit
+    ('Empire State Building 350 5th Ave, New York', 'empire state building 350 5th ave new york'),
+    ('1 Unit 7 Rd', '1 unit 7 rd'),
+    ('500 Floor 2 Industrial Pkwy', '500 floor 2 industrial pkwy'),
+    ('Apt 4, 100 Main St', 'apt 4 100 main st'),
+    ('1 #7 Rd', '1 7 rd'),
+])
+def test_unit_numbers_are_only_stripped_after_the_street(address, expected):
+    assert normalize.normalize_column([address]).tolist() == [expected]
+
+
+def test_prepare_queries_removes_duplicates_and_rejects_non_addresses():
+    prepared = normalize.prepare_queries(['81 First Street North, Paris', '81 1st St. N Paris #4', None, 'N/A', '',
+                                          '12345', '!!', '81 first street north paris'])
+    assert prepared.queries == ['81 1st st n paris', '12345']
+    assert prepared.inverse.tolist() == [0, 0, -1, -1, -1, 1, -1, 0]
+    assert prepared.reasons.tolist() == [None, None, 'missing', 'placeholder', 'empty', None, 'empty', None]
+    assert prepared.rejected == 4
+    assert len(prepared) == 2
+    assert prepared.expand(['a', 'b'], rejected='-') == ['a', 'a', '-', '-', '-', 'b', '-', 'a']
+
+
+def test_rejection_reasons():
+    raw = pandas.Series(['ab', 'x' * 300, '#1 2', '55401'], dtype=object)
+    reasons = normalize.rejection_reasons(raw, normalize.normalize_column(raw))
+    assert reasons.tolist() == ['too short', 'too long', 'no letters', None]
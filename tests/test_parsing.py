@@ -0,0 +1,37 @@
+import json
+import pytest
+import bench
+import bing
+import parsing
+
+document = json.dumps(bench.bing_envelope([bench.bing_location('100 Main St')])).encode('utf-8')
+path = ('resourceSets', 0, 'resources', 0)
+
+
+def test_walk_returns_an_empty_dict_for_a_missing_path():
+    data = json.loads(document)
+    assert parsing.walk(data, path)['confidence'] == 'High'
+    assert parsing.walk(data, ('resourceSets', 5, 'resources')) == {}
+
+
+def test_lazy_json_parses_on_first_read_and_releases_the_bytes():
+    lazy = parsing.LazyJSON(document, path)
+    assert lazy._data is None
+    assert lazy.get('confidence') == 'High'
+    assert lazy._raw is None
+
+
+def test_lazy_json_keeps_only_the_asked_for_keys():
+    lazy = parsing.LazyJSON(document, path, keep=('address', 'confidence'))
+    assert set(lazy.data) == {'address', 'confidence'}
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_bing_results_without_the_whole_response(server, lazy):
+    full = server.point_at(bing.Geocoder('key', lazy=lazy)).geocode('100 Main St, Minneapolis')
+    slim = server.point_at(bing.Geocoder('key', lazy=lazy, keep_response=False)).geocode('100 Main St, Minneapolis')
+    for field in ('street_address', 'city', 'latitude', 'longitude', 'geocode_quality', 'quality_score'):
+        assert getattr(slim, field) == getattr(full, field)
+    assert str(slim) == str(full)
+    response = slim._response.data if lazy else slim._response
+    assert set(response) == set(bing.AddressResult.fields)
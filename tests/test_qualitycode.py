@@ -0,0 +1,20 @@
+import numpy
+import QualityCode
+
+
+def test_confidence_orders_the_score():
+    scores = [QualityCode.GeocodeQuality('L1' + street + 'AA').score for street in 'ABCX']
+    assert scores == sorted(scores, reverse=True)
+    assert scores[-1] < scores[-2]
+
+
+def test_no_confidence_is_the_lowest():
+    assert QualityCode.GeocodeQuality('L1XAA').score == 0.5
+    assert QualityCode.GeocodeQuality('A5XXX').score < QualityCode.GeocodeQuality('A5XAX').score
+
+
+def test_decode_codes():
+    columns = QualityCode.decode_codes(['P1AAA', 'A5XAX', 'bad', 'P1AAA'])
+    assert columns['granularity_rank'].tolist()[2] == -1
+    assert columns['street_confidence'].tolist() == [3, 0, -1, 3]
+    assert columns['admin_confidence'].dtype == numpy.int8
@@ -0,0 +1,74 @@
+import threading
+import time
+import concurrency
+import ratelimit
+
+
+def test_backoff_delay_is_capped():
+    for attempt in range(10):
+        assert 0 <= ratelimit.backoff_delay(attempt, base=0.5, cap=2.0) <= min(2.0, 0.5 * 2 ** attempt)
+
+
+def test_token_bucket_allows_a_burst_then_waits():
+    bucket = ratelimit.TokenBucket(rate=20, capacity=2)
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    start = time.monotonic()
+    assert bucket.acquire() > 0
+    assert time.monotonic() - start >= 0.04
+
+
+def test_token_bucket_reserve_borrows_without_waiting():
+    bucket = ratelimit.TokenBucket(rate=10, capacity=1)
+    assert bucket.reserve() == 0.0
+    assert abs(bucket.reserve() - 0.1) < 0.02
+    assert abs(bucket.reserve() - 0.2) < 0.02
+
+
+def test_rate_limiter_keeps_a_bucket_per_key():
+    limiter = ratelimit.RateLimiter(rate=10, capacity=1, rates={'bing': 100})
+    assert limiter.acquire('mapquest') == 0.0
+    assert limiter.acquire('mapquest') > 0.05
+    assert limiter.acquire('bing') == 0.0
+    assert limiter.acquire('bing') == 0.0
+
+
+def test_adaptive_concurrency_grows_slowly_and_halves():
+    limiter = ratelimit.AdaptiveConcurrency(initial=4, minimum=1, maximum=5, latency_target=1.0)
+    for _ in range(3):
+        limiter.record(0.1)
+    assert limiter.limit == 4
+    for _ in range(2):
+        limiter.record(0.1)
+    assert limiter.limit == 5
+    for _ in range(10):
+        limiter.record(0.1)
+    assert limiter.limit == 5
+    limiter.record(0.1, ok=False)
+    assert limiter.limit == 2
+    limiter.record(5.0)
+    limiter.record(5.0)
+    assert limiter.limit == 1
+
+
+def test_run_concurrently_keeps_to_the_adaptive_limit():
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def slow(value):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    limiter = ratelimit.AdaptiveConcurrency(initial=2, maximum=2)
+    consumed = []
+    queries = (consumed.append(value) or value for value in range(20))
+    results = concurrency.run_concurrently(slow, queries, max_workers=8, limiter=limiter)
+    next(results)
+    # Only the queries in flight have been read from the input
+    assert len(consumed) == 2
+    assert len(list(results)) == 19
+    assert running[1] == 2
@@ -0,0 +1,33 @@
+import math
+import Geocoder
+import resultset
+
+
+def mapquest_results(addresses):
+    return [Geocoder.AddressResult({'info': {'statuscode': 0}, 'results': [{'locations': [{
+        'street': address, 'adminArea6': '', 'adminArea5': 'Minneapolis', 'adminArea4': 'Hennepin', 'adminArea3': 'MN',
+        'adminArea1': 'US', 'postalCode': '55401', 'geocodeQualityCode': 'L1AAA', 'geocodeQuality': 'ADDRESS',
+        'latLng': {'lat': 44.97 + index * 1e-4, 'lng': -93.26}}]}]}) for index, address in enumerate(addresses)]
+
+
+def test_repeated_text_is_stored_once():
+    results = mapquest_results(['1 Main St', '2 Main St', '3 Main St'])
+    addresses = resultset.AddressResultSet(results)
+    addresses.append(resultset.CompactAddress(city='Paris'))
+    assert len(addresses) == 4
+    assert addresses.column('city')[:3] == [results[0].city] * 3
+    assert len(addresses._text['state'].values) == 1
+    assert addresses.column('state')[3] is None
+    assert math.isnan(addresses.column('latitude')[3])
+
+
+def test_rows_and_exports_match_the_results():
+    results = mapquest_results(['1 Main St', '2 Main St'])
+    addresses = resultset.AddressResultSet(results)
+    assert [row.street_address for row in addresses] == [result.street_address for result in results]
+    assert addresses[1].latitude == results[1].latitude
+    frame = addresses.to_dataframe()
+    assert list(frame['city']) == [result.city for result in results]
+    assert frame['city'].dtype.name == 'category'
+    columns = addresses.to_numpy()
+    assert columns['city_values'][columns['city_codes'][0]] == results[0].city
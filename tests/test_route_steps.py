@@ -0,0 +1,40 @@
+import csv
+import io
+import json
+import bench
+import bing
+
+
+def route_result(legs=2, itinerary_items=3):
+    items = [{'instruction': {'maneuverType': 'DepartStart', 'text': 'Head north on Main St'},
+              'maneuverPoint': {'type': 'Point', 'coordinates': [44.85, -93.24]},
+              'travelDistance': 0.25, 'travelDuration': 30} for _ in range(itinerary_items)]
+    route = {'distanceUnit': 'Kilometer', 'durationUnit': 'Second', 'travelMode': 'Driving',
+             'routeLegs': [{'itineraryItems': items} for _ in range(legs)]}
+    return bing.RouteResult({'statusCode': 200, 'resourceSets': [{'estimatedTotal': 1, 'resources': [route]}]})
+
+
+def test_steps_are_numbered_by_leg():
+    route = route_result()
+    steps = list(route.steps())
+    assert route.leg_count == 2
+    assert [step.leg for step in steps] == [0, 0, 0, 1, 1, 1]
+    assert steps[0].text == 'Head north on Main St'
+    assert steps[0].coordinates == (44.85, -93.24)
+    assert [step.leg for step in route.steps(leg=1)] == [1, 1, 1]
+
+
+def test_rendered_instructions_agree_with_the_steps():
+    route = route_result()
+    assert route.print_instructions.splitlines() == ['(0.25) Head north on Main St'] * 6
+    rows = list(csv.DictReader(io.StringIO(route.instructions_csv)))
+    assert (len(rows), rows[0]['maneuver'], rows[0]['latitude']) == (6, 'DepartStart', '44.85')
+    assert json.loads(route.instructions_json)[3]['leg'] == 1
+
+
+def test_start_and_end_locations_come_from_the_first_and_last_legs():
+    resource = bench.bing_route(['Start', 'Middle', 'End'], 'Driving', 2)
+    route = bing.RouteResult(bench.bing_envelope([resource]))
+    assert route.leg_count == 2
+    assert str(route.start_location) == 'Start'
+    assert str(route.end_location) == 'End'
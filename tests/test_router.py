@@ -0,0 +1,54 @@
+import collections
+import time
+import pytest
+import router
+
+Result = collections.namedtuple('Result', ['name', 'quality_score'])
+
+
+class FakeProvider(router.Provider):
+    def __init__(self, name, score, cost=1.0, delay=0.0, error=None):
+        super().__init__(name, cost)
+        self.score = score
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def _geocode(self, address):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return Result(self.name, self.score)
+
+
+def test_provider_must_implement_geocode():
+    with pytest.raises(TypeError):
+        router.Provider('incomplete')
+
+
+def test_cheapest_good_result_stops_the_search():
+    cheap, dear = FakeProvider('cheap', 0.9, cost=1.0), FakeProvider('dear', 1.0, cost=5.0)
+    routed = router.GeocodeRouter([dear, cheap]).search('100 Main St')
+    assert (routed.provider, dear.calls) == ('cheap', 0)
+    assert cheap.latency is not None
+
+
+def test_best_poor_result_is_returned():
+    routed = router.GeocodeRouter([FakeProvider('a', 0.3), FakeProvider('b', 0.5, cost=2.0)]).search('x')
+    assert (routed.provider, routed.score) == ('b', 0.5)
+
+
+def test_every_provider_failing_raises_the_last_error():
+    providers = [FakeProvider('a', 1.0, error=ValueError('a')), FakeProvider('b', 1.0, cost=2.0, error=KeyError('b'))]
+    with pytest.raises(KeyError):
+        router.GeocodeRouter(providers).search('x')
+
+
+def test_hedging_races_a_slow_provider():
+    slow, fast = FakeProvider('slow', 1.0, delay=1.0), FakeProvider('fast', 1.0, cost=2.0)
+    geocoder = router.GeocodeRouter([slow, fast], hedge_after=0.05)
+    start = time.monotonic()
+    assert geocoder.search('x').provider == 'fast'
+    assert time.monotonic() - start < 0.9
+    geocoder.close()
@@ -0,0 +1,46 @@
+import http.client
+import threading
+import pytest
+import bench
+import client
+import service
+
+
+@pytest.fixture
+def running_service():
+    with bench.MockProviderServer() as provider_server:
+        answering = service.Service(mapquest_key='key')
+        provider_server.point_at(answering.geocoders['mapquest'])
+        server = service.HTTPServer(answering, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield 'http://127.0.0.1:{0}'.format(server.server_port)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def test_geocode_and_batch_over_one_connection(running_service):
+    with client.Client(running_service) as service_client:
+        assert service_client.health() == {'providers': ['mapquest'], 'routes': False}
+        assert service_client.geocode('100 Main St, Paris')['latitude'] == 44.97
+        records = service_client.batch(['1 Main St, Paris', '2 Main St, Paris'])
+        assert [record['error'] for record in records] == [None, None]
+        assert 'addresslookup_requests_total' in service_client.metrics()
+
+
+def test_bad_requests_are_reported(running_service):
+    with client.Client(running_service) as service_client:
+        with pytest.raises(client.ServiceError) as error:
+            service_client.geocode('')
+        assert error.value.status == 400
+        with pytest.raises(client.ServiceError) as error:
+            service_client.route('1 Main St', '2 Main St')
+        assert (error.value.status, str(error.value)) == (400, 'No key is configured for bing')
+
+
+def test_https_addresses_are_sent_over_tls():
+    assert isinstance(client.Client('https://geocoding.example.com/')._connect(), http.client.HTTPSConnection)
+    connection = client.Client('http://127.0.0.1:8765')._connect()
+    assert type(connection) is http.client.HTTPConnection and connection.port == 8765
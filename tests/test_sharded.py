@@ -0,0 +1,110 @@
+import argparse
+import threading
+import time
+import pytest
+import Geocoder
+import bench
+import bulk
+import sharded
+
+
+class SlowRunner:
+    """Stands in for a ShardedRunner, taking longer than a lease before returning its first record"""
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def run(self, rows):
+        time.sleep(self.seconds)
+        for row_number, query in rows:
+            yield {'row': row_number, 'address': query}
+
+
+def test_work_queue_leases_chunks_in_order(tmp_path):
+    queue = sharded.WorkQueue(str(tmp_path / 'job.db'), lease_seconds=60)
+    assert queue.add([(number, 'address {0}'.format(number)) for number in range(5)], chunk_size=2) == 3
+    first, rows = queue.lease('a')
+    assert rows == [(0, 'address 0'), (1, 'address 1')]
+    assert queue.lease('b')[0] == first + 1
+    assert queue.progress() == {'finished': 0, 'leased': 2, 'waiting': 1}
+    assert queue.renew(first, 'a') and not queue.renew(first, 'b')
+    assert queue.complete(first, [{'row': 0}, {'row': 1}])
+    assert not queue.complete(first, [])
+    with pytest.raises(RuntimeError):
+        list(queue.records())
+    queue.close()
+
+
+def test_an_expired_lease_is_taken_over(tmp_path):
+    queue = sharded.WorkQueue(str(tmp_path / 'job.db'), lease_seconds=0.05)
+    queue.add([(0, ('start', 'end'))])
+    chunk_id, rows = queue.lease('a')
+    assert rows == [(0, ('start', 'end'))]
+    assert queue.lease('b') is None
+    time.sleep(0.1)
+    assert queue.lease('b')[0] == chunk_id
+    assert not queue.renew(chunk_id, 'a')
+    queue.close()
+
+
+def test_a_chunk_is_given_up_on_after_max_attempts(tmp_path):
+    queue = sharded.WorkQueue(str(tmp_path / 'job.db'), lease_seconds=0.01, max_attempts=2)
+    queue.add([(0, '100 Main St'), (1, ('start', 'end'))])
+    for _ in range(2):
+        assert queue.lease('crashing') is not None
+        time.sleep(0.02)
+    assert queue.lease('next') is None
+    assert list(queue.records()) == [
+        {'row': 0, 'address': '100 Main St', 'error': 'Not finished after 2 leases'},
+        {'row': 1, 'start': 'start', 'end': 'end', 'error': 'Not finished after 2 leases'}]
+    queue.close()
+
+
+def test_unreadable_rows_keep_their_error_in_the_queue(tmp_path):
+    queue = sharded.WorkQueue(str(tmp_path / 'job.db'))
+    queue.add([(0, bulk.UnreadableRow('Line 1 is not valid JSON')), (1, '100 Main St')])
+    _, rows = queue.lease('a')
+    assert isinstance(rows[0][1], bulk.UnreadableRow) and rows[0][1].error == 'Line 1 is not valid JSON'
+    assert rows[1] == (1, '100 Main St')
+    queue.close()
+
+
+def test_work_renews_a_lease_while_the_first_record_is_slow(tmp_path):
+    path = str(tmp_path / 'job.db')
+    queue = sharded.WorkQueue(path, lease_seconds=0.3)
+    queue.add([(number, 'address {0}'.format(number)) for number in range(4)], chunk_size=4)
+    taken = []
+
+    def other_node():
+        other = sharded.WorkQueue(path, lease_seconds=0.3)
+        deadline = time.monotonic() + 0.8
+        while time.monotonic() < deadline:
+            taken.append(other.lease('other'))
+            time.sleep(0.05)
+        other.close()
+
+    thief = threading.Thread(target=other_node)
+    thief.start()
+    assert sharded.work(queue, SlowRunner(0.9), owner='node') == 1
+    thief.join()
+    assert not any(taken)
+    assert [record['row'] for record in queue.records()] == [0, 1, 2, 3]
+    queue.close()
+
+
+def test_route_option_arguments():
+    assert sharded.route_option('optmz=timeWithTraffic') == ('optmz', 'timeWithTraffic')
+    assert sharded.route_option('maxSolns=3') == ('maxSolns', 3)
+    with pytest.raises(argparse.ArgumentTypeError):
+        sharded.route_option('optmz')
+
+
+def test_runner_yields_records_in_input_order(monkeypatch):
+    with bench.MockProviderServer() as server:
+        # The worker processes are forked, so they see the urls set on the class
+        monkeypatch.setattr(Geocoder.Geocoder, 'search_api_url', server.url + '/geocoding/v1/address')
+        monkeypatch.setattr(Geocoder.Geocoder, 'batch_api_url', server.url + '/geocoding/v1/batch')
+        rows = [(number, '{0} Main St, Minneapolis'.format(number % 40)) for number in range(300)]
+        with sharded.ShardedRunner('mapquest', 'key', processes=3, chunk_size=25) as runner:
+            records = list(runner.run(rows))
+    assert [record['row'] for record in records] == list(range(300))
+    assert all(record['error'] is None and record['city'] == 'Minneapolis' for record in records)
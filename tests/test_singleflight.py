@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import pytest
+import singleflight
+
+
+def test_concurrent_calls_for_a_key_share_one_call():
+    flight = singleflight.SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def lookup(value):
+        calls.append(value)
+        release.wait(5)
+        return value * 2
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', lookup, 21))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while flight.shared < 4:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert (calls, results, flight.shared, len(flight)) == ([21], [42] * 5, 4, 0)
+
+
+def test_errors_reach_every_caller_and_are_not_kept():
+    flight = singleflight.SingleFlight()
+
+    def fail():
+        raise ValueError('no result')
+
+    with pytest.raises(ValueError):
+        flight.do('key', fail)
+    assert flight.do('key', lambda: 'retried') == 'retried'
+
+
+def test_async_calls_share_one_task():
+    flight = singleflight.AsyncSingleFlight()
+    calls = []
+
+    async def lookup():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'found'
+
+    async def main():
+        return await asyncio.gather(*[flight.do('key', lookup) for _ in range(3)])
+
+    assert asyncio.run(main()) == ['found'] * 3
+    assert (len(calls), flight.shared, len(flight)) == (1, 2, 0)
+
+
+def test_collapse_gives_the_positions_to_fan_results_out():
+    unique, inverse = singleflight.collapse(['100 Main St', '5 Oak Ave', '100 MAIN ST'], key=str.lower)
+    assert unique == ['100 Main St', '5 Oak Ave']
+    assert inverse == [0, 1, 0]
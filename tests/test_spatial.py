@@ -0,0 +1,89 @@
+import random
+import threading
+import collections
+import numpy
+import spatial
+
+Point = collections.namedtuple('Point', ['latitude', 'longitude'])
+
+
+def test_nearest_within_tolerance():
+    index = spatial.SpatialIndex.from_results([Point(44.97, -93.26), Point(44.98, -93.26), Point(None, None)])
+    assert len(index) == 2
+    result, distance = index.nearest(44.9701, -93.26)
+    assert result == Point(44.97, -93.26)
+    assert 11 < distance < 12
+    assert index.nearest(44.975, -93.26) is None
+
+
+def test_nearest_many_matches_nearest():
+    generator = random.Random(7)
+    index = spatial.SpatialIndex(tolerance=500.0)
+    for _ in range(2000):
+        index.add(Point(44.9 + generator.random() * 0.1, -93.3 + generator.random() * 0.1))
+    latitudes = [44.9 + generator.random() * 0.1 for _ in range(500)]
+    longitudes = [-93.3 + generator.random() * 0.1 for _ in range(500)]
+    positions, distances = index.nearest_many(latitudes, longitudes)
+    for latitude, longitude, position, distance in zip(latitudes, longitudes, positions, distances):
+        nearest = index.nearest(latitude, longitude)
+        if nearest is None:
+            assert position == -1 and numpy.isnan(distance)
+        else:
+            assert index.results[position] == nearest[0]
+            assert abs(distance - nearest[1]) < 1e-6
+
+
+def test_nearest_many_with_queries_near_a_pole_matches_nearest():
+    generator = random.Random(11)
+    index = spatial.SpatialIndex(tolerance=500.0)
+    for _ in range(500):
+        index.add(Point(44.9 + generator.random() * 0.1, -93.3 + generator.random() * 0.1))
+        index.add(Point(89.5 + generator.random() * 0.4, generator.uniform(-180, 180)))
+    latitudes = [44.9 + generator.random() * 0.1 for _ in range(200)] + [89.5 + generator.random() * 0.4
+                                                                         for _ in range(200)]
+    longitudes = [-93.3 + generator.random() * 0.1 for _ in range(200)] + [generator.uniform(-180, 180)
+                                                                           for _ in range(200)]
+    positions, distances = index.nearest_many(latitudes, longitudes)
+    for latitude, longitude, position, distance in zip(latitudes, longitudes, positions, distances):
+        nearest = index.nearest(latitude, longitude)
+        if nearest is None:
+            assert position == -1
+        else:
+            assert index.results[position] == nearest[0]
+            assert abs(distance - nearest[1]) < 1e-6
+
+
+def test_neighbours_across_the_antimeridian():
+    index = spatial.SpatialIndex.from_results([Point(-17.0, 179.99995)])
+    result, distance = index.nearest(-17.0, -179.99995)
+    assert distance < 15
+    positions, distances = index.nearest_many([-17.0, -17.0], [-179.99995, 179.9999])
+    assert list(positions) == [0, 0]
+    assert numpy.all(distances < 15)
+
+
+def test_adding_while_searching_many():
+    index = spatial.SpatialIndex()
+    index.add(Point(44.97, -93.26))
+    errors = []
+    stop = threading.Event()
+
+    def search():
+        try:
+            while not stop.is_set():
+                index.nearest_many([44.97] * 100, [-93.26] * 100)
+        except Exception as e:
+            errors.append(e)
+
+    searchers = [threading.Thread(target=search) for _ in range(4)]
+    for searcher in searchers:
+        searcher.start()
+    try:
+        for number in range(20000):
+            index.add(Point(45.0 + number * 1e-5, -93.0))
+    finally:
+        stop.set()
+        for searcher in searchers:
+            searcher.join()
+    assert errors == []
+    assert len(index) == 20001
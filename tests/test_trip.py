@@ -0,0 +1,48 @@
+import itertools
+import math
+import random
+import trip
+
+
+def points_matrix(count, seed=3):
+    generator = random.Random(seed)
+    points = [(generator.random(), generator.random()) for _ in range(count)]
+    return [[math.dist(a, b) for b in points] for a in points]
+
+
+def shortest_cost(durations, start, end):
+    middle = [stop for stop in range(len(durations)) if stop not in (start, end)]
+    return min(trip.tour_cost([start] + list(order) + [end], durations) for order in itertools.permutations(middle))
+
+
+def test_optimize_order_visits_every_stop_once_between_the_ends():
+    durations = points_matrix(8)
+    order = trip.optimize_order(durations, start=2, end=5)
+    assert (order[0], order[-1]) == (2, 5)
+    assert sorted(order) == list(range(8))
+    assert trip.tour_cost(order, durations) <= shortest_cost(durations, 2, 5) * 1.1
+
+
+def test_round_trips_return_to_the_start():
+    order = trip.optimize_order(points_matrix(6), start=1, round_trip=True)
+    assert (order[0], order[-1], len(order)) == (1, 1, 7)
+    assert trip.optimize_order([[0.0]], round_trip=True) == [0, 0]
+
+
+def test_pairs_without_a_route_are_avoided():
+    nan = float('nan')
+    durations = [[0, 1, nan], [1, 0, 1], [1, 1, 0]]
+    assert trip.optimize_order(durations) == [0, 1, 2]
+
+
+def test_asymmetric_durations_are_priced_by_direction():
+    durations = [[0, 1, 9, 9], [9, 0, 1, 9], [9, 9, 0, 1], [1, 9, 9, 0]]
+    assert trip.optimize_order(durations, start=0, end=3) == [0, 1, 2, 3]
+
+
+def test_sections_share_their_end_points():
+    waypoints = list(range(60))
+    split = trip.sections(waypoints, max_waypoints=25)
+    assert [len(section) for section in split] == [25, 25, 12]
+    assert all(first[-1] == second[0] for first, second in zip(split, split[1:]))
+    assert trip.sections(waypoints[:25]) == [waypoints[:25]]
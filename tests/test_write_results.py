@@ -0,0 +1,42 @@
+import json
+import pytest
+import Geocoder
+import archive
+import bench
+import bing
+import localindex
+import spatial
+
+address = '100 Main St, Minneapolis, MN 55401'
+
+
+def test_mapquest_result_from_the_local_index_is_written(tmp_path):
+    index = localindex.LocalIndex(str(tmp_path / 'index'))
+    index.add('mapquest', address, Geocoder.AddressResult(bench.mapquest_response([address])))
+    geocoder = Geocoder.Geocoder('key', local_index=index)
+    geocoder.search(address)
+    geocoder.write_results(str(tmp_path / 'result'))
+    with open(str(tmp_path / 'result.json')) as f:
+        written = Geocoder.AddressResult(json.load(f))
+    assert (written.street_address, written.latitude) == (geocoder.result.street_address, geocoder.result.latitude)
+
+    with archive.Archive(str(tmp_path / 'archive')) as responses:
+        geocoder.write_results(responses)
+        assert list(responses.replay())[0][1].zip_code == '55401'
+    index.close()
+
+
+def test_bing_result_from_the_spatial_index_is_written(tmp_path):
+    index = spatial.SpatialIndex()
+    index.add(bing.AddressResult(bench.bing_location(address)))
+    geocoder = bing.Geocoder('key', spatial_index=index)
+    geocoder.reverse(44.97, -93.26)
+    geocoder.write_results(str(tmp_path / 'result'))
+    with open(str(tmp_path / 'result.json')) as f:
+        written = archive.build_result('bing', f.read())
+    assert written.street_address == '100 Main St'
+
+
+def test_nothing_to_write_raises():
+    with pytest.raises(ValueError):
+        Geocoder.Geocoder('key').write_results('unused')
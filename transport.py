@@ -0,0 +1,124 @@
+"""A module for sending provider requests with rate limiting and retries
+
+Transport wraps the requests session of a provider object. Every request waits for the rate limiter, and requests that
+are throttled (HTTP 429, or Bing's X-MS-BM-WS-INFO header) or fail with a 5xx status or a connection error are retried
+with exponential backoff. The latency and outcome of every attempt are reported to an optional AdaptiveConcurrency,
+and each attempt and retry is reported as an event to an instrumentation.EventEmitter.
+"""
+import time
+import requests
+import instrumentation
+import ratelimit
+
+retry_statuses = (429, 500, 502, 503, 504)
+
+
+class Transport:
+    """Sends requests for one provider
+
+    Attributes:
+        session (requests.Session): The session requests are sent with
+        key (str): The rate limiter key requests are counted against
+        events (obj): The instrumentation.EventEmitter requests are reported to
+    """
+    def __init__(self, session, key, rate_limiter=None, max_retries=3, concurrency_limiter=None, events=None):
+        """The constructor for the transport
+
+        Args:
+            session (requests.Session): The session to send requests with
+            key (str): The rate limiter key requests are counted against. Example: bing
+            rate_limiter (obj): A ratelimit.RateLimiter shared by everything that uses the same quota
+            max_retries (int): The number of times a throttled or failed request is retried
+            concurrency_limiter (obj): A ratelimit.AdaptiveConcurrency to report the latency of each request to
+            events (obj): An instrumentation.EventEmitter. Defaults to instrumentation.events
+        """
+        self.session = session
+        self.key = key
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.concurrency_limiter = concurrency_limiter
+        self.events = instrumentation.events if events is None else events
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """Sends a request, retrying it while it is throttled or fails
+
+        Returns:
+            requests.Response: The first response that was not throttled, or the last 5xx response
+
+        Raises:
+            ratelimit.RateLimitError: If the request is still throttled after every retry
+            requests.RequestException: If the request could not be sent after every retry
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(self.key)
+
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                seconds = time.monotonic() - start
+                self._record(seconds, False)
+                if self.events.enabled:
+                    self.events.emit('request', self.key, method=method, url=url, status=None,
+                                     error=type(e).__name__, attempt=attempt, seconds=seconds)
+                if attempt == self.max_retries:
+                    raise
+                self._retry(attempt, ratelimit.backoff_delay(attempt))
+                continue
+
+            seconds = time.monotonic() - start
+            throttled = is_throttled(response)
+            self._record(seconds, not throttled and response.status_code not in retry_statuses)
+            if self.events.enabled:
+                self._emit_response(method, url, response, attempt, throttled, seconds)
+            if not throttled and response.status_code not in retry_statuses:
+                return response
+            if attempt < self.max_retries:
+                self._retry(attempt, retry_after(response) or ratelimit.backoff_delay(attempt))
+
+        if throttled:
+            raise ratelimit.RateLimitError('The {0} request was throttled {1} times'.format(self.key, attempt + 1))
+        return response
+
+    def _record(self, latency, ok):
+        if self.concurrency_limiter is not None:
+            self.concurrency_limiter.record(latency, ok)
+
+    def _retry(self, attempt, delay):
+        if self.events.enabled:
+            self.events.emit('retry', self.key, attempt=attempt, delay=delay)
+        time.sleep(delay)
+
+    def _emit_response(self, method, url, response, attempt, throttled, seconds):
+        """Reports an attempt that got a response
+
+        requests reads the whole body before returning, and response.elapsed only runs until the headers were parsed,
+        so the rest of the time was spent downloading the body.
+        """
+        wait_seconds = min(response.elapsed.total_seconds(), seconds)
+        self.events.emit('request', self.key, method=method, url=url, status=response.status_code, error=None,
+                         attempt=attempt, throttled=throttled, bytes=len(response.content), seconds=seconds,
+                         wait_seconds=wait_seconds, download_seconds=seconds - wait_seconds)
+
+
+def is_throttled(response):
+    """Returns True if the response shows the request was rejected for exceeding a rate or quota
+
+    Bing returns a normal response with no results and the X-MS-BM-WS-INFO header set to 1 when it throttles a request.
+    """
+    return response.status_code == 429 or response.headers.get('X-MS-BM-WS-INFO') == '1'
+
+
+def retry_after(response):
+    """Returns the number of seconds from the Retry-After header, or None if it is missing or not a number"""
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
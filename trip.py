@@ -0,0 +1,164 @@
+"""A module for choosing the order to visit a list of stops in
+
+optimize_order builds a tour with the nearest neighbour heuristic and then improves it with 2-opt, which reverses
+sections of the tour while that makes it shorter. Durations may differ by direction. Reversing a section also reverses
+every leg inside it, so the cost of each section in both directions is kept as running sums and every candidate move is
+priced in constant time.
+
+Trip holds the routes for an ordered list of stops. Bing limits a route to 25 waypoints, so longer trips are sent as
+several consecutive routes that share their end points.
+"""
+import itertools
+import math
+
+
+def _cost_matrix(durations):
+    """Copies a matrix into lists of floats, replacing pairs without a route by a cost larger than any tour"""
+    matrix = [[float(value) for value in row] for row in durations]
+    finite = [value for row in matrix for value in row if not math.isnan(value) and not math.isinf(value)]
+    unreachable = (max(finite, default=0.0) + 1.0) * (len(matrix) + 1)
+    return [[unreachable if math.isnan(value) or math.isinf(value) else value for value in row] for row in matrix]
+
+
+def tour_cost(order, durations):
+    """Returns the total cost of visiting the stops in order"""
+    return sum(durations[a][b] for a, b in zip(order, order[1:]))
+
+
+def nearest_neighbour(durations, start=0, end=None):
+    """Builds a tour by always going to the closest stop not yet visited
+
+    Args:
+        durations (list): durations[i][j] is the cost of going from stop i to stop j
+        start (int): The stop to start at
+        end (int): The stop to finish at, or None to finish at whichever stop is visited last
+
+    Returns:
+        list: The stops in the order to visit them
+    """
+    remaining = set(range(len(durations))) - {start, end}
+    order = [start]
+    while remaining:
+        row = durations[order[-1]]
+        closest = min(remaining, key=lambda stop: (row[stop], stop))
+        remaining.remove(closest)
+        order.append(closest)
+    if end is not None and end != start:
+        order.append(end)
+    return order
+
+
+def two_opt(order, durations, fixed_end=True, max_passes=50):
+    """Shortens a tour by reversing sections of it until no reversal helps
+
+    The first stop always stays first.
+
+    Args:
+        order (list): The tour to improve
+        durations (list): durations[i][j] is the cost of going from stop i to stop j
+        fixed_end (bool): Keep the last stop last. For a round trip the last stop is the start again
+        max_passes (int): The most times to sweep over every section
+
+    Returns:
+        list: The improved tour
+    """
+    order = list(order)
+    last = len(order) - 1 if fixed_end else len(order)
+    for _ in range(max_passes):
+        improved = False
+        forward, backward = _running_costs(order, durations)
+        for i in range(1, last):
+            for j in range(i + 1, last):
+                # The change in cost from reversing order[i:j + 1]
+                change = durations[order[i - 1]][order[j]] - durations[order[i - 1]][order[i]] + \
+                    backward[j] - backward[i] - forward[j] + forward[i]
+                if j + 1 < len(order):
+                    change += durations[order[i]][order[j + 1]] - durations[order[j]][order[j + 1]]
+                if change < -1e-9:
+                    order[i:j + 1] = reversed(order[i:j + 1])
+                    forward, backward = _running_costs(order, durations)
+                    improved = True
+        if not improved:
+            break
+    return order
+
+
+def _running_costs(order, durations):
+    """Returns the costs of the first k legs of a tour, travelled forwards and travelled backwards, for every k"""
+    forward = [0.0] + list(itertools.accumulate(durations[a][b] for a, b in zip(order, order[1:])))
+    backward = [0.0] + list(itertools.accumulate(durations[b][a] for a, b in zip(order, order[1:])))
+    return forward, backward
+
+
+def optimize_order(durations, start=0, end=None, round_trip=False, max_passes=50):
+    """Finds a short order to visit every stop in
+
+    Args:
+        durations (array-like): durations[i][j] is the cost of going from stop i to stop j. NaN marks pairs without a
+            route, which are only used when there is no other way
+        start (int): The stop to start at
+        end (int): The stop to finish at. None lets the optimizer choose
+        round_trip (bool): Return to the start at the end of the tour. The start is then both first and last in the
+            order returned
+        max_passes (int): The most 2-opt sweeps to make
+
+    Returns:
+        list: The positions of the stops in the order to visit them
+    """
+    durations = _cost_matrix(durations)
+    if len(durations) <= 1:
+        return [start] * len(durations) + ([start] if round_trip and durations else [])
+    order = nearest_neighbour(durations, start, None if round_trip else end)
+    if round_trip:
+        order.append(start)
+    return two_opt(order, durations, fixed_end=round_trip or end is not None, max_passes=max_passes)
+
+
+class Trip:
+    """The routes for visiting a list of stops in order
+
+    Attributes:
+        stops (list): The stops, in the order given
+        order (list): The positions in stops of the stops in the order they are visited
+        routes (list): The bing.RouteResult for each section of the trip, in order
+        matrix (obj): The bing.RouteMatrix the order was chosen from
+        estimated_duration (float): The duration of the trip from the matrix, in seconds
+    """
+    def __init__(self, stops, order, routes, matrix=None):
+        self.stops = list(stops)
+        self.order = list(order)
+        self.routes = list(routes)
+        self.matrix = matrix
+        self.estimated_duration = None if matrix is None else tour_cost(self.order, _cost_matrix(matrix.durations))
+
+    @property
+    def ordered_stops(self):
+        return [self.stops[position] for position in self.order]
+
+    @property
+    def distance(self):
+        return sum(float(route.distance or 0) for route in self.routes)
+
+    @property
+    def duration(self):
+        return sum(float(route.duration or 0) for route in self.routes)
+
+    def steps(self):
+        """Yields the bing.RouteStep records of every route in turn, numbering the legs across the whole trip"""
+        first_leg = 0
+        for route in self.routes:
+            for step in route.steps():
+                yield step._replace(leg=first_leg + step.leg)
+            first_leg += route.leg_count
+
+
+def sections(waypoints, max_waypoints=25):
+    """Splits a list of waypoints into consecutive sections of at most max_waypoints, each starting where the last ended
+
+    Returns:
+        list: Lists of waypoints
+    """
+    if len(waypoints) <= max_waypoints:
+        return [list(waypoints)]
+    step = max_waypoints - 1
+    return [list(waypoints[first:first + max_waypoints]) for first in range(0, len(waypoints) - 1, step)]